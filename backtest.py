@@ -0,0 +1,345 @@
+from getter import Get, INTERVALS
+from rate_limiter import RequestScheduler
+from slingshot_bot import SlingShotBot
+from symbol import Symbol
+
+from datetime import datetime, timedelta
+from decimal import *
+import numpy as np
+import itertools
+import json
+
+EPOCH = datetime(1970, 1, 1)
+DEFAULT_FILTERS = {'tickSize': '0.0001', 'stepSize': '0.001', 'minQty': '0.001'}
+
+
+# binance kline lists read off a CANDLE_COLUMNS frame on demand, for a history held as columns elsewhere; prices
+# come back as the shortest strings of their floats
+class FrameKlines:
+    FIELDS = ('open_time', 'open', 'high', 'low', 'close', 'volume', 'close_time', 'cash_volume', 'trades')
+
+    def __init__(self, frame):
+        self.columns = [frame[field].to_numpy() for field in self.FIELDS]
+        self.length = len(frame)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):     # one bar is read a field or two at a time
+            return FrameKline(self.columns, index)
+        return [[int(open_time), repr(open_price), repr(high), repr(low), repr(close), repr(volume),
+                 int(close_time), repr(cash_volume), int(trades), '0', '0', '0']
+                for open_time, open_price, high, low, close, volume, close_time, cash_volume, trades
+                in zip(*(column[index].tolist() for column in self.columns))]
+
+
+class FrameKline:
+    __slots__ = ('columns', 'index')
+
+    def __init__(self, columns: list, index: int):
+        self.columns = columns
+        self.index = index
+
+    def __getitem__(self, field: int):
+        if field > 8:
+            return '0'
+        value = self.columns[field][self.index].item()
+        return repr(value) if isinstance(value, float) else int(value)
+
+
+# stands in for the binance Client: market data comes from historical klines up to the current bar, market orders
+# fill at its close, stop, trailing stop and limit orders are checked against the high and low of later bars
+class SimulatedExchange:
+    SIDE_BUY = 'BUY'
+    SIDE_SELL = 'SELL'
+    ORDER_TYPE_MARKET = 'MARKET'
+    ORDER_TYPE_LIMIT = 'LIMIT'
+    TIME_IN_FORCE_GTC = 'GTC'
+
+    def __init__(self, history: dict, interval: str = '1h', balance: Decimal = Decimal('10000'),
+                 fee: Decimal = Decimal('0.0004'), maint_rate: Decimal = Decimal('0.004'), filters: dict = None):
+        self.history = {}      # symbol -> binance klines, oldest first
+        self.frames = {}
+        for symbol, klines in history.items():     # kline lists or CANDLE_COLUMNS frames, used as they are
+            if isinstance(klines, list):
+                self.history[symbol], self.frames[symbol] = klines, Get.candles_to_df(klines)
+            else:
+                self.history[symbol], self.frames[symbol] = FrameKlines(klines), klines
+        self.interval = interval
+        self.step = INTERVALS[interval]
+        self.fee = fee
+        self.maint_rate = maint_rate
+        self.filters = filters if filters else {}
+
+        self.open_times = {symbol: frame['open_time'].to_numpy() for symbol, frame in self.frames.items()}
+        self.times = np.unique(np.concatenate(list(self.open_times.values()))) if history else np.empty(0, np.int64)
+        day = max(1, 86400000 // self.step)
+        self.day_volume = {}    # rolling 24h quote volume, what the 24h ticker reports
+        for symbol, frame in self.frames.items():
+            volume = np.concatenate(([0.0], np.cumsum(frame['cash_volume'].to_numpy())))
+            self.day_volume[symbol] = volume[1:] - volume[np.maximum(np.arange(1, len(volume)) - day, 0)]
+        self.day = day
+
+        self.index = {symbol: -1 for symbol in history}   # current bar of every symbol, -1 until it is listed
+        self.open_time = None
+        self.wallet = balance
+        self.fees = Decimal(0)
+        self.positions = {}    # symbol -> [signed amount, entry price]
+        self.orders = {}
+        self.pending = {}      # symbol -> ids of orders waiting for a trigger
+        self.order_ids = itertools.count(1)
+        self.fills = 0
+
+    def clock(self):
+        return int(self.open_time) + self.step - 1 if self.open_time is not None else 0
+
+    def datetime(self):
+        return EPOCH + timedelta(milliseconds=self.clock())
+
+    def close(self, symbol: str):
+        return Decimal(self.history[symbol][self.index[symbol]][4])
+
+    # moves every symbol that has a bar at open_time onto it and triggers the orders its range crosses
+    def advance(self, open_time: int):
+        self.open_time = open_time
+        updated = []
+        for symbol, open_times in self.open_times.items():
+            i = self.index[symbol] + 1
+            if i < len(open_times) and open_times[i] == open_time:
+                self.index[symbol] = i
+                updated.append(symbol)
+                if self.pending.get(symbol):
+                    self.__trigger(symbol)
+        return updated
+
+    def __trigger(self, symbol: str):
+        kline = self.history[symbol][self.index[symbol]]
+        open_price, high, low = Decimal(kline[1]), Decimal(kline[2]), Decimal(kline[3])
+        for order_id in list(self.pending[symbol]):
+            order = self.orders[order_id]
+            sell = order['side'] == self.SIDE_SELL
+            if order['type'] == 'STOP_MARKET':
+                stop = Decimal(order['stopPrice'])
+                if (low <= stop) if sell else (high >= stop):
+                    self.__fill(order, min(stop, open_price) if sell else max(stop, open_price))
+            elif order['type'] == 'TRAILING_STOP_MARKET':
+                rate = order['callbackRate'] / 100
+                level = order['extreme'] * (1 - rate) if sell else order['extreme'] * (1 + rate)
+                if (low <= level) if sell else (high >= level):
+                    self.__fill(order, min(level, open_price) if sell else max(level, open_price))
+                else:
+                    order['extreme'] = max(order['extreme'], high) if sell else min(order['extreme'], low)
+            elif order['type'] == self.ORDER_TYPE_LIMIT:
+                price = Decimal(order['price'])
+                if (high >= price) if sell else (low <= price):
+                    self.__fill(order, max(price, open_price) if sell else min(price, open_price))
+
+    def __fill(self, order: dict, price: Decimal):
+        symbol = order['symbol']
+        amount, entry = self.positions.get(symbol, (Decimal(0), Decimal(0)))
+        qty = abs(amount) if order['closePosition'] else order['quantity']
+        if order['id'] in self.pending.get(symbol, ()):
+            self.pending[symbol].remove(order['id'])
+        if not qty:
+            order['status'] = 'EXPIRED'
+            return
+
+        signed = qty if order['side'] == self.SIDE_BUY else -qty
+        fee = price * qty * self.fee
+        self.wallet -= fee
+        self.fees += fee
+        if amount == 0 or (amount > 0) == (signed > 0):
+            entry = (entry * abs(amount) + price * qty) / (abs(amount) + qty)
+        else:
+            closed = min(qty, abs(amount))
+            self.wallet += (price - entry) * closed * (1 if amount > 0 else -1)
+            if qty > abs(amount):
+                entry = price
+        amount += signed
+        self.positions[symbol] = (amount, entry if amount else Decimal(0))
+        order.update({'status': 'FILLED', 'executedQty': qty, 'avgPrice': price, 'updateTime': self.clock()})
+        self.fills += 1
+
+    def equity(self):
+        equity = self.wallet
+        for symbol, (amount, entry) in self.positions.items():
+            if amount:
+                equity += amount * (self.close(symbol) - entry)
+        return equity
+
+    @staticmethod
+    def __answer(order: dict):
+        return {'orderId': order['id'], 'symbol': order['symbol'], 'side': order['side'], 'type': order['type'],
+                'status': order['status'], 'executedQty': str(order['executedQty']),
+                'avgPrice': str(order['avgPrice']), 'stopPrice': str(order['stopPrice']),
+                'updateTime': order['updateTime']}
+
+    @staticmethod
+    def __error(code: int, message: str):
+        from binance.exceptions import BinanceAPIException
+        return BinanceAPIException(None, 400, json.dumps({'code': code, 'msg': message}))
+
+    def futures_exchange_info(self):
+        symbols = []
+        for symbol in self.history:
+            filters = dict(DEFAULT_FILTERS, **self.filters.get(symbol, {}))
+            symbols.append({'symbol': symbol, 'status': 'TRADING', 'filters': [
+                {'filterType': 'PRICE_FILTER', 'tickSize': filters['tickSize']},
+                {'filterType': 'LOT_SIZE', 'stepSize': filters['stepSize'], 'minQty': filters['minQty']}]})
+        return {'serverTime': self.clock(), 'symbols': symbols}
+
+    def futures_klines(self, symbol: str, interval: str, startTime: int = None, endTime: int = None,
+                       limit: int = 500):
+        if interval != self.interval:
+            raise self.__error(-1120, f'history holds {self.interval} klines only')
+        open_times = self.open_times[symbol][:self.index[symbol] + 1]
+        last = len(open_times) if endTime is None else int(np.searchsorted(open_times, endTime, side='right'))
+        first = max(0, last - limit)
+        if startTime is not None:
+            first = int(np.searchsorted(open_times, startTime))
+            last = min(last, first + limit)
+        return self.history[symbol][first:last]
+
+    def __ticker(self, symbol: str):
+        i = self.index[symbol]
+        klines = self.history[symbol]
+        last_price = klines[i][4]
+        open_price = klines[max(0, i - self.day + 1)][1]
+        change = (float(last_price) / float(open_price) - 1) * 100
+        return {'symbol': symbol, 'lastPrice': last_price, 'openPrice': open_price,
+                'priceChangePercent': f'{change:.3f}', 'quoteVolume': f'{self.day_volume[symbol][i]:.2f}',
+                'closeTime': self.clock()}
+
+    def futures_ticker(self, symbol: str = None):
+        if symbol:
+            return self.__ticker(symbol)
+        return [self.__ticker(symbol) for symbol, i in self.index.items() if i >= 0]
+
+    def futures_order_book(self, symbol: str, limit: int = 500):
+        price = self.history[symbol][self.index[symbol]][4]
+        return {'bids': [[price, '1000000']], 'asks': [[price, '1000000']]}
+
+    def futures_account_information(self):
+        maint_margin, margin_balance = Decimal(0), self.wallet
+        for symbol, (amount, entry) in self.positions.items():
+            if amount:
+                close = self.close(symbol)
+                maint_margin += abs(amount) * close * self.maint_rate
+                margin_balance += amount * (close - entry)
+        return {'totalWalletBalance': str(self.wallet), 'totalMaintMargin': str(maint_margin),
+                'totalMarginBalance': str(margin_balance)}
+
+    def futures_create_order(self, symbol: str, side: str, type: str, quantity: Decimal = None,
+                             price: Decimal = None, stopPrice: Decimal = None, closePosition: bool = False,
+                             callbackRate: Decimal = None, **params):
+        if self.index.get(symbol, -1) < 0:
+            raise self.__error(-1121, 'Invalid symbol.')
+        order = {'id': next(self.order_ids), 'symbol': symbol, 'side': side, 'type': type, 'status': 'NEW',
+                 'quantity': Decimal(str(quantity)) if quantity else Decimal(0), 'closePosition': closePosition,
+                 'price': price, 'stopPrice': stopPrice if stopPrice else 0, 'executedQty': 0, 'avgPrice': 0,
+                 'updateTime': self.clock()}
+        self.orders[order['id']] = order
+        if type == self.ORDER_TYPE_MARKET:
+            self.__fill(order, self.close(symbol))
+        else:
+            if type == 'TRAILING_STOP_MARKET':
+                order['callbackRate'] = Decimal(str(callbackRate))
+                order['extreme'] = self.close(symbol)
+            self.pending.setdefault(symbol, []).append(order['id'])
+        return self.__answer(order)
+
+    def futures_get_order(self, symbol: str, orderId: int):
+        if orderId not in self.orders:
+            raise self.__error(-2013, 'Order does not exist.')
+        return self.__answer(self.orders[orderId])
+
+    def futures_cancel_order(self, symbol: str, orderId: int):
+        order = self.orders.get(orderId)
+        if not order or order['status'] != 'NEW':
+            raise self.__error(-2011, 'Unknown order sent.')
+        order['status'] = 'CANCELED'
+        self.pending[symbol].remove(orderId)
+        return self.__answer(order)
+
+
+# serves the open bar window straight from the exchange frames, so Indicators only ever sees one new bar per call
+class BacktestGet(Get):
+    def __init__(self, exchange: SimulatedExchange, cache_depth: int = 1000):
+        unlimited = float('inf')
+        super(BacktestGet, self).__init__(exchange, cache_depth, exchange.clock,
+                                          scheduler=RequestScheduler(exchange, unlimited, unlimited, unlimited))
+        self.exchange = exchange
+
+    def candles(self, symbol: Symbol, interval: str, end_time=None, limit=1000, to_df=False):
+        if interval != self.exchange.interval or end_time:
+            return super(BacktestGet, self).candles(symbol, interval, end_time, limit, to_df)
+        i = self.exchange.index[symbol.symbol]
+        start = max(0, i + 1 - limit)
+        if to_df:
+            return self.exchange.frames[symbol.symbol].iloc[start:i + 1]
+        return self.exchange.history[symbol.symbol][start:i + 1]
+
+
+class Backtest:
+    def __init__(self, history: dict, interval: str = '1h', balance: Decimal = Decimal('10000'),
+                 order_percent: Decimal = Decimal('0.01'), sl_percent: Decimal = Decimal('0.02'),
+                 sl_type: str = 'STOP_MARKET', main_trend: int = 1, required_volume: Decimal = 80000000,
+                 required_volatility: Decimal = 0, required_fix_percent: Decimal = Decimal('0.08'),
+                 max_fix_times: int = 6, fee: Decimal = Decimal('0.0004'), warmup: int = 200, filters: dict = None,
+                 signal_params: dict = None):
+        self.balance = balance
+        self.exchange = SimulatedExchange(history, interval, balance, fee, filters=filters)
+        self.get = BacktestGet(self.exchange)
+        self.bot = SlingShotBot(self.exchange, order_percent, sl_percent, sl_type, main_trend, required_volume,
+                                required_volatility, required_fix_percent, max_fix_times, get=self.get,
+                                signal_params=signal_params)
+        self.symbols = {symbol.symbol: symbol for symbol in self.bot.symbols}
+        for symbol in self.bot.symbols:
+            symbol.clock = self.exchange.datetime
+        self.warmup = warmup
+        self.trades = []
+        self.equity = []    # (open time, account equity) per bar
+        self.symbol_equity = {symbol: [] for symbol in self.symbols}    # (close time, realized result) per trade
+
+    def __record(self, symbol: Symbol, statistics: dict):
+        statistics = dict(statistics, symbol=symbol.symbol)
+        self.trades.append(statistics)
+        curve = self.symbol_equity[symbol.symbol]
+        curve.append((self.exchange.clock(), (curve[-1][1] if curve else 0) + statistics['result']))
+
+    def step(self, open_time: int):
+        ready = []
+        for ticker in self.exchange.advance(open_time):
+            if self.exchange.index[ticker] + 1 >= self.warmup:
+                ready.append(self.symbols[ticker])
+
+        for symbol in ready:
+            if symbol.in_trade:
+                result = self.bot.check_position(symbol)
+                if isinstance(result, dict):
+                    self.__record(symbol, result)
+
+        ready = set(ready)
+        for symbol in self.bot.market_candidates(self.get.market()):
+            if symbol in ready:
+                self.bot.new_position(symbol)
+        self.equity.append((int(open_time), self.exchange.equity()))
+
+    def run(self, start: int = None, end: int = None):
+        for open_time in self.exchange.times:
+            if (start is None or open_time >= start) and (end is None or open_time <= end):
+                self.step(open_time)
+            elif end is not None and open_time > end:
+                break
+            else:
+                self.exchange.advance(open_time)
+        return self.results()
+
+    def results(self):
+        equity = np.array([float(value) for _, value in self.equity])
+        peak = np.maximum.accumulate(equity) if len(equity) else equity
+        return {'trades': self.trades, 'equity': self.equity, 'symbol_equity': self.symbol_equity,
+                'pnl': self.exchange.equity() - self.balance,
+                'max_drawdown': float(np.max((peak - equity) / peak)) if len(equity) else 0.0,
+                'fees': self.exchange.fees, 'fills': self.exchange.fills}
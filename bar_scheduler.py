@@ -0,0 +1,84 @@
+from getter import INTERVALS
+from slingshot_bot import SlingShotBot
+
+import time
+
+
+# runs the bot off the bar clock instead of a tight loop: entries and exits are decided once when a bar closes, in
+# between only open trades whose price crossed their extra fix level are looked at. Signals memoize the closed bar,
+# so whatever still asks inside the bar (a pushed stop loss fill, a second caller) reads it instead of computing it
+class BarScheduler:
+    def __init__(self, bot: SlingShotBot, interval: str = '1h', poll: float = 5, clock=None, sleep=time.sleep):
+        self.bot = bot
+        self.period = INTERVALS[interval]   # bar length in ms
+        self.poll = poll    # seconds between price checks inside a bar
+        self.clock = clock if clock else bot.get.clock
+        self.sleep = sleep
+        self.bar = None     # open time of the closed bar the bot last ran on
+        self.triggers = {}  # symbol -> (side, price) of its extra fix
+        self.hours = {}     # hour open time -> evaluations computed, memoized and skipped against a polling loop
+        self.stopped = False
+        for signal in bot.signals.values():
+            signal.memoize = True
+
+    def __evaluations(self):
+        computed = skipped = 0
+        for signal in self.bot.signals.values():
+            computed += signal.computed
+            skipped += signal.skipped
+        return computed, skipped
+
+    def __update_triggers(self):
+        self.triggers = {}
+        for symbol in self.bot.registry.in_trade():
+            side, price = self.bot.signals[symbol.symbol].extra_fix_trigger()
+            if price is not None:
+                self.triggers[symbol.symbol] = (side, price)
+
+    def __crossed(self):
+        if not self.triggers:
+            return []
+        market = self.bot.get.market()
+        crossed = []
+        for ticker, (side, price) in self.triggers.items():
+            last_price = market.get(ticker, {}).get('last_price')
+            if last_price is not None and (last_price > price if side == 'SELL' else last_price < price):
+                crossed.append((self.bot.registry.get(ticker), side))
+        return crossed
+
+    def step(self):
+        now = self.clock()
+        hour = self.hours.setdefault(now // 3600000 * 3600000, {'computed': 0, 'memoized': 0, 'skipped': 0,
+                                                                 'bar_closes': 0, 'triggered': 0, 'polls': 0})
+        computed, memoized = self.__evaluations()
+        closed = now // self.period * self.period - self.period
+        if closed != self.bar:
+            self.bar = closed
+            self.bot.func1()
+            self.bot.func2()
+            hour['bar_closes'] += 1
+        else:
+            # what a polling loop would have evaluated: every symbol's entry and every open trade's exit
+            hour['skipped'] += len(self.bot.symbols) + len(self.triggers)
+            for symbol, side in self.__crossed():
+                self.bot.check_position(symbol, side)
+                hour['triggered'] += 1
+        self.__update_triggers()
+        hour['polls'] += 1
+        after = self.__evaluations()
+        hour['computed'] += after[0] - computed
+        hour['memoized'] += after[1] - memoized
+
+    # wakes every poll seconds and on every bar close
+    def run(self):
+        self.stopped = False
+        while not self.stopped:
+            self.step()
+            now = self.clock()
+            self.sleep(max(0.0, min(self.poll, ((now // self.period + 1) * self.period - now) / 1000)))
+
+    def stop(self):
+        self.stopped = True
+
+    def stats(self):
+        return [dict(counts, hour=hour) for hour, counts in sorted(self.hours.items())]
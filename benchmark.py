@@ -0,0 +1,1204 @@
+from backtest import Backtest
+from bar_scheduler import BarScheduler
+from fake_client import FakeClient, AsyncFakeClient, DepthReplay, FakeStreamServer, RecordedClient, record_fixture
+from getter import Get, KlineArchive, Resampler
+from order_book import OrderBook
+from order_controller import OrderController
+from rate_limiter import RequestScheduler
+from indicators import Indicators
+from journal import TradeJournal
+from metrics import METRICS, Metrics, MetricsServer
+from shards import ShardCoordinator
+from signaller import Signal
+from streamer import MarketStream, StreamGet
+from tech_analysis import TechAnalysis
+from sweep import Sweep, SharedCandles, grid, normalize
+from slingshot_bot import SlingShotBot, AsyncSlingShotBot
+from symbol import Symbol, SymbolRegistry, TradeData
+from user_stream import UserStream
+from finta import TA
+import binance.exceptions     # loaded up front like a live client would have it, injected errors raise it
+from datetime import datetime
+from decimal import Decimal, ROUND_DOWN, ROUND_UP
+import numpy as np
+import pandas as pd
+import argparse
+import asyncio
+import functools
+import json
+import os
+import pickle
+import signal
+import random
+import requests
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import urllib.request
+
+
+def bench_candle_cache(symbols: int = 200, cycles: int = 3):
+    client = FakeClient(symbols)
+    get = Get(client, clock=client.clock)
+    pairs = get.symbols()
+    result = []
+    for cycle in range(cycles):
+        client.calls.clear()
+        served = client.klines_served
+        for symbol in pairs:
+            get.candles(symbol, '1h')
+        result.append({'cycle': cycle, 'requests': client.requests('futures_klines'),
+                       'klines_transferred': client.klines_served - served})
+    return {'symbols': symbols, 'cycles': result, 'cache': get.cache.stats()}
+
+
+def _decimal_candles_to_df(candles: list):
+    data = {'open_time': [int(candle[0]) for candle in candles], 'close_time': [int(candle[6]) for candle in candles],
+            'high': [Decimal(candle[2]) for candle in candles], 'low': [Decimal(candle[3]) for candle in candles],
+            'open': [Decimal(candle[1]) for candle in candles], 'close': [Decimal(candle[4]) for candle in candles],
+            'volume': [Decimal(candle[5]) for candle in candles],
+            'cash_volume': [Decimal(candle[7]) for candle in candles],
+            'trades': [int(candle[8]) for candle in candles]}
+    return pd.DataFrame.from_dict(data)
+
+
+def _best(func, number: int = 20, repeat: int = 5):
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def bench_candle_frames(bars: int = 1000):
+    klines = FakeClient(1).futures_klines(symbol='BTCUSDT', interval='1h', limit=bars)
+    ta = TechAnalysis()
+    result = {'bars': bars}
+    for name, convert in (('decimal', _decimal_candles_to_df), ('columnar', Get.candles_to_df)):
+        frame = convert(klines)
+        result[name] = {'to_df_seconds': _best(lambda: convert(klines)),
+                        'memory_bytes': int(frame.memory_usage(deep=True).sum()),
+                        'stoch_rsi_seconds': _best(lambda: ta.stoch_rsi(frame))}
+    return result
+
+
+# finta recomputing every series against the streamed indicators taking one bar, on a recorded 1h series; their
+# parity is checked in test_indicators.py
+def bench_indicators(bars: int = 1000, warmup: int = 500):
+    client = RecordedClient(FIXTURE)
+    frame = Get.candles_to_df(client.futures_klines(symbol=client.tickers[0], interval='1h', limit=bars))
+    ta = TechAnalysis()
+
+    def finta_cycle():
+        ta.slingshot(frame)
+        ta.stoch_rsi(frame)
+        TA.EMA(frame, 62, adjust=False)
+
+    warm = Indicators()
+    warm.update(frame.iloc[:warmup])
+    step = [warmup]
+
+    def incremental_cycle():
+        step[0] += 1
+        warm.update(frame.iloc[step[0] - 2:step[0]])
+
+    return {'bars': len(frame), 'finta_seconds_per_bar': _best(finta_cycle),
+            'incremental_seconds_per_bar': _best(incremental_cycle, number=len(frame) - warmup - 2, repeat=1)}
+
+
+class _FrameGet:
+    def __init__(self, frames: dict):
+        self.frames = frames
+
+    def candles(self, symbol, interval: str, end_time=None, limit=1000, to_df=False):
+        return self.frames[symbol.symbol]
+
+    def volume(self, symbol):
+        return Decimal('1e9')
+
+    def volatility(self, symbol):
+        return Decimal('10')
+
+
+def bench_batch_signals(sizes=(50, 200, 1000), bars: int = 500):
+    client = FakeClient(max(sizes))
+    pairs = Get(client).symbols()
+    klines = client.futures_klines(symbol=pairs[0].symbol, interval='1h', limit=bars)
+    frames = {}
+    for symbol in pairs:
+        frame = Get.candles_to_df(klines)
+        scale = 1 + client.price(symbol.symbol, 0) / 50000
+        noise = np.random.default_rng(len(frames)).normal(0, 0.01, bars).cumsum()
+        frame['close'] = frame['close'] * scale * (1 + noise)
+        frames[symbol.symbol] = frame
+    get = _FrameGet(frames)
+
+    result = []
+    for size in sizes:
+        subset = pairs[:size]
+        closes = np.vstack([frames[symbol.symbol]['close'].to_numpy() for symbol in subset])
+        row = {'symbols': size}
+        for trend in (1, -1):
+            signals = [Signal(symbol, get, trend, 0, 0, Decimal('0.08')) for symbol in subset]
+            started = time.perf_counter()
+            single = [signal.slingshot_signal(True, False) for signal in signals]
+            single_seconds = time.perf_counter() - started
+
+            started = time.perf_counter()
+            batch = Signal.batch_signals(signals, closes, True, False)
+            batch_seconds = time.perf_counter() - started
+            row[f'trend_{trend}'] = {'match': single == batch.tolist(), 'entries': sum(s != 'NEUTRAL' for s in single),
+                                     'per_symbol_seconds': single_seconds, 'batch_seconds': batch_seconds,
+                                     'speedup': single_seconds / batch_seconds}
+        result.append(row)
+    return result
+
+
+def bench_async_scan(symbols: int = 100, latency: float = 0.02, concurrency=(1, 10, 50)):
+    client = FakeClient(symbols, latency=latency)
+    get = Get(client, clock=client.clock)
+    signals = [Signal(symbol, get, 1, 0, 0, Decimal('0.08')) for symbol in get.symbols()]
+    for signal in signals:
+        signal.slingshot_signal(True, False)
+    started = time.perf_counter()
+    for signal in signals:
+        signal.slingshot_signal(True, False)
+    result = {'symbols': symbols, 'latency_seconds': latency,
+              'sequential_wall_seconds': time.perf_counter() - started, 'async': []}
+
+    for limit in concurrency:
+        client = FakeClient(symbols)
+        async_client = AsyncFakeClient(client, latency)
+        bot = AsyncSlingShotBot(client, async_client, Decimal('0.01'), Decimal('0.02'), 'STOP_MARKET', main_trend=1,
+                                required_volume=0, concurrency=limit)
+        bot.get.clock = bot.async_get.clock = client.clock
+        asyncio.run(bot.func1())
+        cycle = asyncio.run(bot.func1())
+        cycle.update({'concurrency': limit, 'max_in_flight': async_client.max_in_flight})
+        result['async'].append(cycle)
+    return result
+
+
+def bench_market_snapshot(symbols: int = 200, cycles: int = 3, required_volume: Decimal = Decimal('2.5e8')):
+    client = FakeClient(symbols)
+    bot = SlingShotBot(client, Decimal('0.01'), Decimal('0.02'), 'STOP_MARKET', main_trend=1,
+                       required_volume=required_volume)
+    bot.get.clock = client.clock
+    result = []
+    for cycle in range(cycles):
+        client.calls.clear()
+        bot.func1()
+        result.append({'cycle': cycle, 'candidates': len(bot.market_candidates(bot.get.market())),
+                       'requests': {method: client.requests(method)
+                                    for method in sorted({call[0] for call in client.calls})}})
+    return {'symbols': symbols, 'cycles': result, 'snapshot_refreshes': bot.get.snapshot.refreshes}
+
+
+# a burst of kline reads over a small weight limit, with market orders arriving once the reads are queued;
+# the clock is fake and every sleep advances it, a fake second takes a real millisecond
+def bench_scheduler(reads: int = 600, orders: int = 10, weight_limit: int = 600):
+    now, lock = [0.0], threading.Lock()
+
+    def sleep(delay: float):
+        time.sleep(delay / 1000)
+        with lock:
+            now[0] += delay
+
+    client = FakeClient(50)
+    scheduler = RequestScheduler(client, weight_limit, clock=lambda: now[0], sleep=sleep, rng=random.Random(1))
+    get = Get(client, clock=client.clock, scheduler=scheduler)
+    pairs = get.symbols()
+    client.calls.clear()
+    client.errors['futures_create_order'] = [(429, -1003), (503, -1001)]
+
+    def read(i: int):
+        scheduler.call('futures_klines', symbol=pairs[i % len(pairs)].symbol, interval='1h', limit=1000)
+
+    filled = []
+
+    def order(i: int):
+        controller = OrderController(client, pairs[i % len(pairs)], get)
+        filled.append(controller.create_market_order('BUY', percent=Decimal('0.01')))
+
+    threads = [threading.Thread(target=read, args=(i,)) for i in range(reads)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    depth = scheduler.queue_depth()
+    order_threads = [threading.Thread(target=order, args=(i,)) for i in range(orders)]
+    for thread in order_threads:
+        thread.start()
+    for thread in threads + order_threads:
+        thread.join()
+
+    methods = [call[0] for call in client.calls]
+    last_order = max(i for i, method in enumerate(methods) if method == 'futures_create_order')
+    return {'reads': reads, 'orders': orders, 'weight_limit': weight_limit, 'queue_depth_at_orders': depth,
+            'filled': sum(1 for order in filled if order and order.get('status') == 'FILLED'),
+            'reads_before_last_order': methods[:last_order].count('futures_klines'),
+            'reads_after_last_order': methods[last_order:].count('futures_klines'),
+            'fake_seconds': now[0], 'stats': scheduler.stats()}
+
+
+# market orders that fill after fill_delay, waited for by REST polling and by the user data stream, then a stop
+# loss fill that the bot has to notice
+def bench_user_stream(orders: int = 10, fill_delay: float = 0.05):
+    result = {'orders': orders, 'fill_delay_seconds': fill_delay}
+    for mode in ('polling', 'stream'):
+        client = FakeClient(5, fill_delay=fill_delay)
+        get = Get(client, clock=client.clock)
+        server = stream = None
+        if mode == 'stream':
+            server = FakeStreamServer(client.user_events, user=True)
+            stream = UserStream(get.scheduler, url=server.start())
+            stream.start()
+            while not stream.live:
+                time.sleep(0.01)
+        bot = SlingShotBot(client, Decimal('0.01'), Decimal('0.02'), 'STOP_MARKET', main_trend=1, get=get,
+                           user_stream=stream)
+        symbol = bot.symbols[1]
+        controller = bot.order_controllers[symbol.symbol]
+
+        client.calls.clear()
+        latencies = []
+        for i in range(orders):
+            started = time.perf_counter()
+            controller.create_market_order('BUY', percent=Decimal('0.01'))
+            latencies.append(time.perf_counter() - started - fill_delay)
+        row = {'fill_requests': client.requests('futures_get_order'),
+               'mean_detection_seconds': float(np.mean(latencies))}
+
+        bot.new_position(symbol, 'BUY')
+        client.calls.clear()
+        client.fill_order(symbol.trade_data.stop_loss)
+        started, cycles = time.perf_counter(), 0
+        while symbol.in_trade:
+            if mode == 'polling':
+                bot.func2()
+                cycles += 1
+            time.sleep(0.001)
+        row.update({'stop_loss_detection_seconds': time.perf_counter() - started, 'cycles': cycles,
+                    'stop_loss_requests': client.requests('futures_get_order')})
+        if stream:
+            row['stream'] = stream.stats()
+            stream.stop()
+            server.stop()
+        result[mode] = row
+    return result
+
+
+# account reads for a burst of market orders: without the user data stream every fill invalidates the cached
+# account, with it the balances are updated in place and only the ttl forces a full read
+def bench_account_state(orders: int = 20):
+    result = {'orders': orders}
+    for mode in ('rest', 'stream'):
+        client = FakeClient(5)
+        get = Get(client, clock=client.clock)
+        server = stream = None
+        if mode == 'stream':
+            server = FakeStreamServer(client.user_events, user=True)
+            stream = UserStream(get.scheduler, url=server.start(), account=get.account_state)
+            stream.start()
+            while not stream.live:
+                time.sleep(0.01)
+        bot = SlingShotBot(client, Decimal('0.01'), Decimal('0.02'), 'STOP_MARKET', main_trend=1, get=get,
+                           user_stream=stream)
+        controller = bot.order_controllers[bot.symbols[1].symbol]
+        client.calls.clear()
+        ages = []
+        for i in range(orders):
+            controller.create_market_order('BUY', percent=Decimal('0.01'))
+            ages.append(controller.sizing_age)
+        result[mode] = {'account_requests': client.requests('futures_account_information'), 'sizing_ages_ms': ages,
+                        'account': get.account_state.stats(client.clock())}
+        if stream:
+            stream.stop()
+            server.stop()
+    return result
+
+
+# synthetic history through the real bot; a year of 1h bars for 200 symbols is projected from the measured rate
+def bench_backtest(symbols: int = 50, bars: int = 2000):
+    end = 1700000000000
+    client = FakeClient(symbols, clock=lambda: end)
+    history = {ticker: client.futures_klines(symbol=ticker, interval='1h', limit=bars) for ticker in client.tickers}
+    backtest = Backtest(history, required_volume=0)
+    started = time.perf_counter()
+    result = backtest.run()
+    seconds = time.perf_counter() - started
+    return {'symbols': symbols, 'bars': bars, 'seconds': seconds, 'trades': len(result['trades']),
+            'pnl': result['pnl'], 'max_drawdown': result['max_drawdown'], 'fees': result['fees'],
+            'seconds_per_symbol_bar': seconds / symbols / bars,
+            'projected_seconds_200_symbols_year': seconds / symbols / bars * 200 * 8760}
+
+
+# the same grid over 1, 2 and all cores; workers attach to one shared candle block instead of unpickling history
+def bench_sweep(symbols: int = 10, bars: int = 1000, workers=(1, 2, None)):
+    client = FakeClient(symbols, clock=lambda: 1700000000000)
+    history = {ticker: client.futures_klines(symbol=ticker, interval='1h', limit=bars) for ticker in client.tickers}
+    samples = [normalize(params) for params in grid(fast_length=[30, 38], slow_length=[62, 80],
+                                                    sl_percent=[0.01, 0.02])]
+    candles = SharedCandles(history)
+    attached = SharedCandles(None, *candles.handle())    # what a worker sees
+    copied = sum(frame[column].to_numpy().nbytes for frame in attached.frames().values() for column in frame
+                 if not np.shares_memory(frame[column].to_numpy(), attached.memory.buf))
+    result = {'symbols': symbols, 'bars': bars, 'samples': len(samples), 'cores': os.cpu_count(),
+              'history_pickle_bytes': len(pickle.dumps(history)), 'shared_bytes': candles.memory.size,
+              'worker_copied_bytes': copied, 'worker_handle_pickle_bytes': len(pickle.dumps(candles.handle())),
+              'runs': []}
+    attached.close()
+    candles.close()
+    for count in workers:
+        count = count if count else os.cpu_count()
+        started = time.perf_counter()
+        ranked = Sweep(history, workers=count, required_volume=0).run(samples)
+        seconds = time.perf_counter() - started
+        result['runs'].append({'workers': count, 'seconds': seconds, 'replays_per_second': len(samples) / seconds,
+                               'best': ranked[0]['params'], 'best_pnl': ranked[0]['pnl']})
+    base = result['runs'][0]['replays_per_second']
+    for run in result['runs']:
+        run['efficiency'] = run['replays_per_second'] / base / min(run['workers'], os.cpu_count())
+    return result
+
+
+# deep history reads and a restart, REST paging against the archive; a restart is a new Get on the same folder
+def bench_kline_archive(symbols: int = 20, bars: int = 5000):
+    client = FakeClient(symbols)
+    pairs = Get(client).symbols()
+    result = {'symbols': symbols, 'bars': bars}
+    with tempfile.TemporaryDirectory() as path:
+        for name, make in (('rest', lambda: Get(client, clock=client.clock)),
+                           ('archive', lambda: Get(client, clock=client.clock, archive=KlineArchive(path)))):
+            runs = []
+            for run in ('cold', 'restart'):
+                get = make()
+                client.calls.clear()
+                served = client.klines_served
+                started = time.perf_counter()
+                for symbol in pairs:
+                    get.candles(symbol, '1h', limit=bars, to_df=True)
+                    get.candles(symbol, '1h', to_df=True)
+                runs.append({'run': run, 'seconds': time.perf_counter() - started,
+                             'requests': client.requests('futures_klines'),
+                             'klines_transferred': client.klines_served - served})
+            result[name] = runs
+    return result
+
+
+# a restart with trades open on most symbols: one stop loss filled while down, one cancelled and one position opened
+# by hand; restore reads the journal and reconciles with two exchange requests
+def bench_journal(symbols: int = 200, trades: int = 150, records: int = 500):
+    client = FakeClient(symbols)
+    result = {'symbols': symbols, 'trades': trades}
+    with tempfile.TemporaryDirectory() as path:
+        path = os.path.join(path, 'journal.db')
+        journal = TradeJournal(path, snapshot_every=0)
+        bot = SlingShotBot(client, Decimal('0.01'), Decimal('0.02'), 'STOP_MARKET', main_trend=1,
+                           get=Get(client, clock=client.clock), journal=journal)
+        for symbol in bot.symbols[:trades]:
+            bot.new_position(symbol, 'BUY')
+        symbol = bot.symbols[0]
+        latencies = []
+        for i in range(records):
+            started = time.perf_counter()
+            journal.record(symbol.symbol, 'stop_loss', symbol.trade_data)
+            latencies.append(time.perf_counter() - started)
+        latencies.sort()
+        result['record_ms'] = {'median': latencies[len(latencies) // 2] * 1000,
+                               'p99': latencies[int(len(latencies) * 0.99)] * 1000}
+        result['events'] = journal.events
+        journal.close()
+
+        client.fill_order(bot.symbols[1].trade_data.stop_loss)
+        client.futures_cancel_order(symbol=bot.symbols[2].symbol, orderId=bot.symbols[2].trade_data.stop_loss)
+        client.futures_create_order(symbol=bot.symbols[-1].symbol, side='BUY', type='MARKET', quantity='1')
+
+        for run in ('log', 'snapshot'):
+            journal = TradeJournal(path)
+            if run == 'snapshot':
+                journal.snapshot()
+            get = Get(client, clock=client.clock)
+            get.symbols()
+            client.calls.clear()
+            started = time.perf_counter()
+            bot = SlingShotBot(client, Decimal('0.01'), Decimal('0.02'), 'STOP_MARKET', main_trend=1, get=get,
+                               journal=journal)
+            seconds = time.perf_counter() - started
+            report = bot.restored
+            result[run] = {'bot_start_seconds': seconds, 'restored': report['restored'],
+                           'closed': report['closed'], 'stop_loss_replaced': report['stop_loss_replaced'],
+                           'unknown_positions': report['unknown_positions'],
+                           'requests': {method: client.requests(method) for method in
+                                        ('futures_position_information', 'futures_get_open_orders',
+                                         'futures_get_order', 'futures_create_order')},
+                           'closed_trades': len(journal.closed_trades()), 'file_bytes': os.path.getsize(path)}
+            journal.close()
+    return result
+
+
+class _DictRecord:
+    pass
+
+
+# the same fields in an instance dict, the layout before __slots__
+def _dict_record(record):
+    copy = _DictRecord()
+    for cls in type(record).__mro__:
+        for name in getattr(cls, '__slots__', ()):
+            name = f'_{cls.__name__}{name}' if name.startswith('__') else name
+            if hasattr(record, name):
+                copy.__dict__[name] = getattr(record, name)
+    return copy
+
+
+# record layout and the per-cycle walks over 1k and 10k symbols with a few trades open
+def bench_symbol_registry(sizes=(1000, 10000), open_share: float = 0.02):
+    result = []
+    for size in sizes:
+        symbols = [Symbol(f'S{i:05d}USDT', Decimal('0.0001'), Decimal('0.001'), Decimal('0.001')) for i in range(size)]
+        symbols[-1].symbol = 'BTCUSDT'
+        registry = SymbolRegistry(symbols)
+        for symbol in symbols:
+            symbol.start_trade('BUY', Decimal('1.5'), Decimal('100.25'), Decimal('98'), 1, 'STOP_MARKET')
+        slotted = sum(sys.getsizeof(symbol) + sys.getsizeof(symbol.trade_data) for symbol in symbols)
+        dicts = 0
+        for symbol in symbols:
+            for record in (_dict_record(symbol), _dict_record(symbol.trade_data)):
+                dicts += sys.getsizeof(record) + sys.getsizeof(record.__dict__)
+        rng = random.Random(size)
+        for symbol in symbols:
+            if rng.random() >= open_share:
+                symbol.stop_trade()
+        scan = _best(lambda: [symbol for symbol in symbols if symbol.in_trade], number=100)
+        indexed = _best(registry.in_trade, number=100)
+        linear = _best(lambda: next(symbol for symbol in symbols if symbol.symbol == 'BTCUSDT'), number=100)
+        lookup = _best(lambda: registry.get('BTCUSDT'), number=100)
+        result.append({'symbols': size, 'open': len(registry.open),
+                       'record_bytes': {'dict': dicts, 'slots': slotted, 'ratio': dicts / slotted},
+                       'open_trades_us': {'scan': scan * 1e6, 'registry': indexed * 1e6},
+                       'ticker_lookup_us': {'scan': linear * 1e6, 'registry': lookup * 1e6}})
+    return result
+
+
+# the Decimal accounting TradeData and Symbol did before fixed point, with the fee as an exact Decimal
+# the accounting as it was before FEE_RATE: the maker fee built from a float on every order
+class _FloatFeeTrade:
+    def __init__(self, side: str, qty: Decimal, price: Decimal):
+        self.side = side
+        self.original_quantity = self.current_quantity = qty
+        self.current_price = price
+        self.result = - qty * price * Decimal(0.0004)
+        self.addons, self.fixes = 1, 0
+        self.last_addon_time = self.last_fix_time = self.last_fix_price = None
+
+    def addon(self, qty: Decimal, price: Decimal, price_step: Decimal):
+        self.last_addon_time = datetime.now()
+        self.addons += 1
+        self.result -= qty * price * Decimal(0.0004)
+        self.original_quantity = self.current_quantity + qty
+        price = (self.current_price * self.current_quantity + price * qty) / (self.current_quantity + qty)
+        self.current_price = price.quantize(price_step, rounding=ROUND_UP if self.side == 'BUY' else ROUND_DOWN)
+        self.current_quantity += qty
+        return {'price': self.current_price, 'qty': self.current_quantity}
+
+    def fix(self, qty: Decimal, price: Decimal):
+        self.last_fix_time = datetime.now()
+        self.fixes += 1
+        self.last_fix_price = price
+        self.result -= qty * price * Decimal(0.0004)
+        self.current_quantity -= qty
+        pnl = (price - self.current_price) * qty
+        self.result += pnl if self.side == 'BUY' else -pnl
+        return {'closed': self.current_quantity == Decimal(0)}
+
+
+def _random_trade(rng: random.Random, orders: int):
+    price_step = Decimal(1).scaleb(-rng.randint(0, 5))
+    lot_step = Decimal(1).scaleb(-rng.randint(0, 3))
+    ticks = rng.randint(10, 10 ** 7)
+
+    def price():    # fills on a tick or averaged to full precision between ticks, as avgPrice comes back
+        extra = rng.choice((0, 0, 1, 3, 6, 9, 12))
+        return (Decimal(ticks + rng.randint(-ticks // 5, ticks // 5)) * price_step +
+                Decimal(rng.randint(0, 10 ** extra - 1)).scaleb(-extra) * price_step).normalize()
+
+    side, qty = rng.choice(('BUY', 'SELL')), Decimal(rng.randint(1, 1000)) * lot_step
+    start, current, orders_done = (side, qty, price()), qty, []
+    for i in range(orders):
+        addon, qty = rng.random() < 0.5, Decimal(rng.randint(1, 1000)) * lot_step
+        if not addon:
+            qty = min(qty, current)
+            if not qty:
+                continue
+        current += qty if addon else -qty
+        orders_done.append((addon, qty, price()))
+    return price_step, lot_step, start, orders_done
+
+
+# per order cost of the trade accounting on random trades, against the float fee it used to build on every order;
+# its correctness is checked in test_trade_data.py
+def bench_trade_accounting(cases: int = 2000, orders: int = 8, seed: int = 1):
+    rng = random.Random(seed)
+    workloads = [_random_trade(rng, orders) for case in range(cases)]
+
+    def replay(trade_class):
+        for price_step, lot_step, (side, qty, price), orders_done in workloads:
+            if trade_class is TradeData:
+                trade = TradeData(side, qty, price, None, None, 'STOP_MARKET')
+            else:
+                trade = trade_class(side, qty, price)
+            for addon, qty, price in orders_done:
+                if addon:
+                    trade.addon(qty, price, price_step)
+                else:
+                    trade.fix(qty, price)
+
+    count = sum(len(workload[3]) for workload in workloads)
+    return {'cases': cases, 'orders': count, 'us_per_order': {
+        'trade_data': _best(lambda: replay(TradeData), number=1) / count * 1e6,
+        'float_fee': _best(lambda: replay(_FloatFeeTrade), number=1) / count * 1e6}}
+
+
+# one cold start in a fresh interpreter: imports, bot construction and the first entry scan against a FakeClient whose
+# every request costs latency seconds
+_STARTUP = '''
+import json, sys, time
+started = time.perf_counter()
+if sys.argv[5] == 'eager':     # what every start paid before imports were deferred
+    import binance, finta, pandas
+from decimal import Decimal
+from fake_client import FakeClient
+from getter import Get, ExchangeInfoCache
+from slingshot_bot import SlingShotBot
+imported = time.perf_counter()
+path, ttl, symbols, latency = sys.argv[1], float(sys.argv[2]), int(sys.argv[3]), float(sys.argv[4])
+client = FakeClient(symbols, latency=latency)
+get = Get(client, exchange_cache=ExchangeInfoCache(path, ttl) if path else None)
+bot = SlingShotBot(client, Decimal('0.01'), Decimal('0.02'), 'STOP_MARKET', required_volume=0, get=get)
+ready = time.perf_counter()
+heavy = [name for name in ('pandas', 'finta', 'binance') if name in sys.modules]
+bot.func1()
+scanned = time.perf_counter()
+if get.refresh_thread:
+    get.refresh_thread.join()
+print(json.dumps({'import_seconds': imported - started, 'bot_ready_seconds': ready - started,
+                  'first_scan_seconds': scanned - started, 'loaded_at_ready': heavy,
+                  'exchange_info_requests': client.requests('futures_exchange_info')}))
+'''
+
+
+def bench_startup(symbols: int = 20, latency: float = 0.05):
+    result = {'symbols': symbols, 'latency': latency}
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'exchange_info.json')
+        for name, cache, ttl, imports in (('eager_network', '', 0, 'eager'), ('network', '', 0, 'lazy'),
+                                          ('cold_cache', path, 3600, 'lazy'), ('cached', path, 3600, 'lazy'),
+                                          ('stale_cache', path, 0, 'lazy')):
+            output = subprocess.run([sys.executable, '-c', _STARTUP, cache, str(ttl), str(symbols), str(latency),
+                                     imports],
+                                    cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True,
+                                    check=True).stdout
+            result[name] = json.loads(output)
+    return result
+
+
+# cost of the instrumentation per timed call and per bot cycle, the retries it makes visible and the scrape endpoint
+def bench_metrics(symbols: int = 100, cycles: int = 5, calls: int = 100000):
+    metrics = Metrics()
+
+    def plain():
+        pass
+
+    timed = metrics.timed('bench_seconds')(plain)
+    per_call = {'plain': _best(plain, calls) * 1e6, 'timed': _best(timed, calls) * 1e6}
+    metrics.enabled = False
+    per_call['disabled'] = _best(timed, calls) * 1e6
+    per_call['labelled_observe'] = _best(lambda: METRICS.observe('bench_seconds', 0.001, symbol='BTCUSDT',
+                                                                 phase='entry'), calls) * 1e6
+    result = {'microseconds_per_call': per_call}
+
+    client = FakeClient(symbols)
+    scheduler = RequestScheduler(client, sleep=lambda delay: None)
+    get = Get(client, clock=client.clock, scheduler=scheduler)
+    bot = SlingShotBot(client, Decimal('0.01'), Decimal('0.02'), 'STOP_MARKET', main_trend=1, required_volume=0,
+                       get=get)
+    for symbol in bot.symbols[1:6]:     # open trades for the exit loop to check
+        bot.new_position(symbol, 'BUY')
+    bot.func1()
+    bot.func2()
+    timings = {True: [], False: []}
+    for cycle in range(cycles):
+        for enabled in (True, False):
+            METRICS.enabled = enabled
+            started = time.perf_counter()
+            bot.func1()
+            bot.func2()
+            timings[enabled].append(time.perf_counter() - started)
+    METRICS.enabled = True
+    enabled, disabled = min(timings[True]), min(timings[False])
+    result['cycle'] = {'symbols': symbols, 'in_trade': len(bot.registry.in_trade()), 'enabled_seconds': enabled,
+                       'disabled_seconds': disabled, 'overhead_percent': (enabled - disabled) / disabled * 100}
+
+    METRICS.reset()
+    client.errors['futures_klines'] = [(503, -1001)] * 3
+    client.errors['futures_get_order'] = [(400, -2013)]
+    bot.get.cache.clear()
+    bot.func1()
+    bot.func2()
+    stats = METRICS.stats()
+    result['visible'] = {name: stats.get(name, []) for name in ('rest_retries_total', 'rest_errors_total',
+                                                                 'rest_failures_total', 'order_fill_polls_total')}
+    result['latency'] = {name: [dict(row, labels=','.join(f'{key}={value}' for key, value in row['labels'].items()))
+                                for row in stats.get(name, [])]
+                         for name in ('get_seconds', 'indicator_seconds', 'signal_seconds', 'order_seconds',
+                                      'cycle_seconds')}
+    result['symbols_timed'] = len(stats['symbol_cycle_seconds'])
+
+    server = MetricsServer(port=0).start()
+    try:
+        body = urllib.request.urlopen(server.url).read().decode()
+    finally:
+        server.stop()
+    lines = body.splitlines()
+    result['endpoint'] = {'bytes': len(body), 'series': sum(1 for line in lines if not line.startswith('#')),
+                          'families': sum(1 for line in lines if line.startswith('# TYPE')),
+                          'sample': [line for line in lines if 'rest_request_seconds_count' in line][:3]}
+    return result
+
+
+
+
+# Get.candles before the backfill: endTime pages one after another, the whole history copied on every page and
+# the first short page taken for the start of the history
+def _paged_candles(get: Get, symbol: Symbol, interval: str, limit: int):
+    klines, end_time = [], None
+    while limit > 1000:
+        params = {'endTime': end_time} if end_time else {}
+        last_klines = get.scheduler.call('futures_klines', symbol=symbol.symbol, interval=interval, limit=1000,
+                                         **params)
+        if len(last_klines) < 1000:
+            limit = len(last_klines)
+            break
+        end_time = int(last_klines[0][0]) - 1
+        limit -= 1000
+        last_klines.extend(klines)
+        klines = last_klines.copy()
+    params = {'endTime': end_time} if end_time else {}
+    last_klines = get.scheduler.call('futures_klines', symbol=symbol.symbol, interval=interval, limit=max(limit, 10),
+                                     **params)
+    last_klines.extend(klines)
+    return last_klines.copy()
+
+
+# deep 1h history over a slow connection, then the same history with a maintenance window in the middle
+def bench_backfill(bars: int = 30000, latency: float = 0.2, workers=(1, 4, 8), hole: int = 48):
+    result = {'bars': bars, 'latency_seconds': latency}
+    for gap in (False, True):
+        client = FakeClient(2, latency=latency)
+        symbol = Get(client).symbols()[1]
+        if gap:
+            step = 3600000
+            start = (client.clock() // step - bars // 2) * step
+            client.holes[symbol.symbol] = [(start, start + (hole - 1) * step)]
+        rows = {}
+        for name, count in [('sequential_copy', None)] + [(f'backfill_{count}', count) for count in workers]:
+            get = Get(client, clock=client.clock, backfill_workers=count if count else 1)
+            client.calls.clear()
+            started = time.perf_counter()
+            if count is None:
+                klines = _paged_candles(get, symbol, '1h', bars)
+            else:
+                klines = get.candles(symbol, '1h', limit=bars)
+            open_times = [int(kline[0]) for kline in klines]
+            rows[name] = {'seconds': time.perf_counter() - started, 'requests': client.requests('futures_klines'),
+                          'candles': len(klines), 'first_open_time': open_times[0] if open_times else None,
+                          'ordered': all(earlier < later for earlier, later in zip(open_times, open_times[1:]))}
+        result['with_hole' if gap else 'complete'] = rows
+    return result
+
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'market.json.gz')
+
+
+# the scenarios below replay the recorded market in FIXTURE, so their answers are the same on every run and only
+# the timings move between commits
+
+# Get.candles past one request: the newest 1000 bars, then pages walked back with endTime
+def bench_candle_paging(limit: int = 1100, latency: float = 0.005):
+    client = RecordedClient(FIXTURE, latency=latency)
+    get = Get(client, clock=client.clock)
+    symbol = get.symbols()[1]
+    client.calls.clear()
+    started = time.perf_counter()
+    klines = get.candles(symbol, '1h', limit=limit)
+    seconds = time.perf_counter() - started
+    open_times = [kline[0] for kline in klines]
+    return {'limit': limit, 'latency_seconds': latency, 'candles': len(klines), 'seconds': seconds,
+            'requests': client.requests('futures_klines'),
+            'contiguous': all(later - earlier == 3600000 for earlier, later in zip(open_times, open_times[1:]))}
+
+
+def bench_recorded_frames(bars: int = 1000):
+    client = RecordedClient(FIXTURE)
+    klines = client.futures_klines(symbol='BTCUSDT', interval='1h', limit=bars)
+    frame = Get.candles_to_df(klines)
+    ta = TechAnalysis()
+    return {'bars': len(klines), 'candles_to_df_seconds': _best(lambda: Get.candles_to_df(klines)),
+            'stoch_rsi_seconds': _best(lambda: ta.stoch_rsi(frame)),
+            'slingshot_seconds': _best(lambda: ta.slingshot(frame)),
+            'indicators_seconds': _best(lambda: Indicators().update(frame))}
+
+
+# func1 then func2 over the recorded market; the first cycle downloads every history, the next ones are the
+# steady state, with a tenth of the symbols in a trade. The scheduler runs on a fake clock that sleeping advances:
+# weight budget waits and fill polls are reported as waited_seconds instead of spent
+def bench_bot_cycle(sizes=(10, 100, 500), cycles: int = 3, latency: float = 0):
+    result = []
+    for size in sizes:
+        now = [0.0]
+
+        def sleep(delay: float):
+            now[0] += delay
+
+        client = RecordedClient(FIXTURE, symbols=size, latency=latency)
+        scheduler = RequestScheduler(client, clock=lambda: now[0], sleep=sleep)
+        get = Get(client, clock=client.clock, scheduler=scheduler)
+        bot = SlingShotBot(client, Decimal('0.01'), Decimal('0.02'), 'STOP_MARKET', required_volume=0, get=get)
+        for symbol in bot.symbols[1:1 + max(1, size // 10)]:
+            bot.new_position(symbol, 'BUY')
+        client.calls.clear()
+        started = time.perf_counter()
+        bot.func1()
+        bot.func2()
+        first = time.perf_counter() - started
+        first_requests = client.requests()
+        timings = []
+        for cycle in range(cycles):
+            client.calls.clear()
+            started = time.perf_counter()
+            bot.func1()
+            bot.func2()
+            timings.append(time.perf_counter() - started)
+        result.append({'symbols': size, 'in_trade': len(bot.registry.in_trade()), 'first_cycle_seconds': first,
+                       'first_cycle_requests': first_requests, 'cycle_seconds': min(timings),
+                       'waited_seconds': now[0],
+                       'cycle_requests': {method: client.requests(method)
+                                          for method in sorted({call[0] for call in client.calls})}})
+    return result
+
+
+# market orders and their stop losses while a share of every request fails with a 503; the scheduler clock is
+# fake and every backoff advances it
+def bench_order_retries(orders: int = 20, error_rate: float = 0.3, seed: int = 7):
+    now = [0.0]
+
+    def sleep(delay: float):
+        now[0] += delay
+
+    client = RecordedClient(FIXTURE, error_rate=error_rate, seed=seed)
+    scheduler = RequestScheduler(client, attempts=10, clock=lambda: now[0], sleep=sleep, rng=random.Random(seed))
+    client.error_rate = 0     # symbols and filters load cleanly
+    get = Get(client, clock=client.clock, scheduler=scheduler)
+    bot = SlingShotBot(client, Decimal('0.01'), Decimal('0.02'), 'STOP_MARKET', main_trend=1, get=get)
+    client.error_rate = error_rate
+    client.calls.clear()
+    started = time.perf_counter()
+    opened = 0
+    for i in range(orders):
+        symbol = bot.symbols[i % len(bot.symbols)]
+        bot.new_position(symbol, 'BUY')
+        opened += symbol.in_trade and bool(symbol.trade_data.stop_loss)
+    return {'orders': orders, 'error_rate': error_rate, 'with_stop_loss': opened,
+            'wall_seconds': time.perf_counter() - started, 'backoff_seconds': now[0], 'requests': client.requests(),
+            'stats': scheduler.stats()}
+
+
+
+# the errors a live client meets besides 5xx answers: connection resets while symbols load, which are read again, a
+# reset and a lost answer while an order goes out, which must place it once, then a 429 whose Retry-After has to
+# pause the scheduler
+def bench_request_errors(resets: int = 3, retry_after: int = 30):
+    now = [0.0]
+
+    def sleep(delay: float):
+        now[0] += delay
+
+    client = RecordedClient(FIXTURE, fill_polls=0)     # market orders fill at once, a resent one fills again
+    scheduler = RequestScheduler(client, clock=lambda: now[0], sleep=sleep, rng=random.Random(1))
+    client.errors['futures_exchange_info'] = [requests.ConnectionError('reset')] * resets
+    get = Get(client, clock=client.clock, scheduler=scheduler)
+    symbols = get.symbols()
+    # a reset before the order went out, then an order the exchange took whose answer never arrived
+    client.errors['futures_create_order'] = [requests.ConnectionError('reset')]
+    client.lost['futures_create_order'] = 1
+    order = OrderController(client, symbols[0], get).create_market_order('BUY', percent=Decimal('0.01'))
+    placed = len(client.orders)
+    # the same without a client order id to look the order up by: it must not be sent again
+    client.lost['futures_create_order'] = 1
+    try:
+        scheduler.call('futures_create_order', symbol=symbols[0].symbol, side='BUY', type='MARKET', quantity='1')
+        no_id_raised = False
+    except requests.Timeout:
+        no_id_raised = True
+    client.errors['futures_ticker'] = [(429, -1003, {'Retry-After': str(retry_after)})]
+    paused_from = now[0]
+    scheduler.call('futures_ticker')
+    paused = scheduler.paused_until - paused_from
+    result = {'symbols': len(symbols), 'order_status': order.get('status') if order else None,
+              'order_requests': client.requests('futures_create_order'), 'orders_placed': placed,
+              'no_id_orders_placed': len(client.orders) - placed, 'no_id_order_raised': no_id_raised,
+              'pause_seconds': paused, 'backoff_seconds': now[0], 'stats': scheduler.stats()}
+    result['passed'] = (bool(symbols) and result['order_status'] == 'FILLED' and placed == 1 and
+                        result['no_id_orders_placed'] == 1 and no_id_raised and paused >= retry_after)
+    return result
+
+
+# 4h bars folded from 1h ones against the exchange's own: the closed bars of the recorded fixture, then a fake clock
+# walked an hour at a time with the open bar compared as well. The synthetic market draws the high, low and volumes
+# of every bar on its own, so only open and close times and prices are compared; a fixture recorded from the live
+# exchange can be checked on every field with fields=range(12)
+def bench_resample(hours: int = 200, limit: int = 200, path: str = FIXTURE, fields=(0, 6, 1, 4)):
+    client = RecordedClient(path)
+    parity = {'fields': list(fields), 'compared': 0, 'mismatches': 0}
+    for ticker in client.tickers:
+        now = client.clock()
+        hourly = [kline for kline in client.futures_klines(symbol=ticker, interval='1h', limit=1500)
+                  if kline[6] < now]
+        native = {kline[0]: kline for kline in client.futures_klines(symbol=ticker, interval='4h', limit=1500)
+                  if kline[6] < now}
+        resampler = Resampler('1h', '4h')
+        resampler.extend(hourly)
+        for kline in resampler.klines()[1:]:     # the first bucket may start before the recorded hours
+            if kline[0] in native:
+                parity['compared'] += 1
+                parity['mismatches'] += any(kline[field] != native[kline[0]][field] for field in fields)
+    result = {'fixture': parity}
+
+    hour = 3600000
+    now = [FakeClient(1).clock() // hour * hour + hour // 2]
+    client = FakeClient(2, clock=lambda: now[0])
+    get = Get(client, clock=client.clock)
+    symbol = get.symbols()[1]
+    get.candles(symbol, '4h', limit=10)
+    deeper = len(get.candles(symbol, '4h', limit=limit))     # a shallow first read does not cap later ones
+    ta = TechAnalysis()
+    live = {'steps': hours, 'deeper_read_bars': deeper, 'mismatches': 0, 'trend_mismatches': 0, 'requests': 0,
+            'klines_transferred': 0, 'native_klines_transferred': hours * limit, 'resampled_seconds': 0.0}
+    for step in range(hours):
+        now[0] += hour
+        client.calls.clear()
+        served = client.klines_served
+        started = time.perf_counter()
+        resampled = get.candles(symbol, '4h', limit=limit)
+        live['resampled_seconds'] += time.perf_counter() - started
+        live['requests'] += client.requests()
+        live['klines_transferred'] += client.klines_served - served
+        native = client.futures_klines(symbol=symbol.symbol, interval='4h', limit=limit)
+        live['mismatches'] += ([[kline[field] for field in fields] for kline in resampled] !=
+                               [[kline[field] for field in fields] for kline in native])
+        live['trend_mismatches'] += (float(ta.slingshot(Get.candles_to_df(resampled)).iloc[-1]) !=
+                                     float(ta.slingshot(Get.candles_to_df(native)).iloc[-1]))
+    result['live'] = live
+    result['passed'] = (not parity['mismatches'] and not live['mismatches'] and not live['trend_mismatches'] and
+                        deeper == limit)
+    return result
+
+
+# a diff depth stream replayed into the local book, with the snapshot ahead of the delivered events and one event
+# lost on the way; the book has to end up equal to the exchange's. Market orders are then sized off it
+def bench_order_book(events: int = 5000, lag: int = 20, lost: int = 3000, walks: int = 10000,
+                     max_slippage: Decimal = Decimal('0.0002')):
+    client = FakeClient(2)
+    get = StreamGet(client, clock=client.clock)
+    symbol = get.symbols()[1]
+    replay = client.depth[symbol.symbol] = DepthReplay(symbol.symbol, events=events, seed=3)
+    stream = get.stream = MarketStream(get, [symbol], depth=True)    # fed by hand, snapshots load inline
+    stream.live.add(symbol.symbol)
+    for position, event in enumerate(replay.events):
+        replay.position = min(position + lag, events)
+        if position != lost:
+            stream.handle({'data': event})
+    book = stream.order_books[symbol.symbol]
+    _, bids, asks = replay.state()
+    result = {'sync': dict(book.stats(), matches=book.bids == bids and book.asks == asks,
+                           snapshot_requests=client.requests('futures_order_book'))}
+
+    book = OrderBook(symbol.symbol)
+    book.load(replay.snapshot(0))
+    started = time.perf_counter()
+    for event in replay.events:
+        book.apply(event)
+    result['sync']['apply_seconds'] = (time.perf_counter() - started) / events
+    started = time.perf_counter()
+    for i in range(walks):
+        book.fill('BUY' if i % 2 else 'SELL', quote=Decimal(20000))
+    result['sync']['fill_walk_seconds'] = (time.perf_counter() - started) / walks
+
+    result['sizing'] = {}
+    for name, cap in (('uncapped', None), ('capped', max_slippage)):
+        controller = OrderController(client, symbol, get, max_slippage=cap)
+        client.calls.clear()
+        controller.create_market_order('BUY', percent=Decimal(1))
+        estimate = controller.fill_estimate
+        order = [params for method, params in client.calls if method == 'futures_create_order'][0]
+        result['sizing'][name] = {'order_book_requests': client.requests('futures_order_book'),
+                                  'best': str(estimate['best']), 'price': str(estimate['price']),
+                                  'slippage': float(estimate['slippage']), 'levels': estimate['levels'],
+                                  'quote': str(estimate['quote']), 'quantity': str(order['quantity']),
+                                  'complete': estimate['complete']}
+        symbol.in_trade = False
+    return result
+
+
+# entries opened one request after the other against batched with their stop loss, then added to so the stop is
+# replaced; the times come from the exchange side order events. Then rejected legs and a batch whose answer is lost
+def bench_order_batching(entries: int = 4, latency: float = 0.05):
+    result = {'entries': entries, 'latency_seconds': latency}
+    for mode in ('serial', 'batched'):
+        client = FakeClient(entries + 1, latency=latency, fill_polls=1)
+        get = Get(client, clock=client.clock)
+        bot = SlingShotBot(client, Decimal('0.01'), Decimal('0.02'), 'STOP_MARKET', main_trend=1, get=get,
+                           batch_orders=mode == 'batched')
+        row = {'entry_requests': {}, 'time_to_protected_seconds': 0.0, 'naked_seconds': 0.0,
+               'replace_requests': {}, 'open_stops': 0}
+        for symbol in bot.symbols[1:]:
+            for phase in ('entry', 'replace'):
+                client.calls.clear()
+                events = len(client.user_events)
+                started = client.clock()
+                bot.new_position(symbol, 'BUY')
+                counts = row[f'{phase}_requests']
+                for method, params in client.calls:
+                    counts[method] = counts.get(method, 0) + 1 / entries
+                if phase == 'entry':
+                    orders = [event['o'] for event in client.user_events[events:]
+                              if event['e'] == 'ORDER_TRADE_UPDATE']
+                    stop_at = [order['T'] for order in orders if order['o'] == 'STOP_MARKET'][0]
+                    filled_at = [order['T'] for order in orders if order['o'] == 'MARKET' and order['X'] == 'FILLED'][0]
+                    row['time_to_protected_seconds'] += (stop_at - started) / 1000 / entries
+                    row['naked_seconds'] += max(0, stop_at - filled_at) / 1000 / entries
+        row['open_stops'] = len(client.futures_get_open_orders())
+        result[mode] = row
+
+    # one leg of a batch rejected: a refused stop goes out on its own, a refused entry takes its stop back
+    client = FakeClient(3)
+    get = Get(client, clock=client.clock)
+    bot = SlingShotBot(client, Decimal('0.01'), Decimal('0.02'), 'STOP_MARKET', main_trend=1, get=get,
+                       batch_orders=True)
+    client.rejections = {'STOP_MARKET': [-2021], 'MARKET': []}
+    bot.new_position(bot.symbols[1], 'BUY')
+    client.rejections['MARKET'].append(-2019)
+    bot.new_position(bot.symbols[2], 'BUY')
+    result['rejections'] = {'stop_rejected_in_trade': bot.symbols[1].in_trade,
+                            'stop_rejected_protected': bool(bot.symbols[1].trade_data.stop_loss),
+                            'entry_rejected_in_trade': bot.symbols[2].in_trade,
+                            'open_stops': len(client.futures_get_open_orders()),
+                            'rejected': METRICS.stats().get('order_rejections_total')}
+
+    # the exchange takes the batch and its answer times out: the retry must not open a second entry and stop
+    client = FakeClient(2)
+    get = Get(client, clock=client.clock)
+    bot = SlingShotBot(client, Decimal('0.01'), Decimal('0.02'), 'STOP_MARKET', main_trend=1, get=get,
+                       batch_orders=True)
+    client.lost['futures_place_batch_order'] = 1
+    symbol = bot.symbols[1]
+    bot.new_position(symbol, 'BUY')
+    placed = [order for order in client.orders.values() if order['symbol'] == symbol.symbol]
+    result['lost_answer'] = {'orders_placed': len(placed), 'in_trade': symbol.in_trade,
+                             'stop_loss': symbol.trade_data.stop_loss,
+                             'batch_requests': client.requests('futures_place_batch_order')}
+    result['passed'] = len(placed) == 2 and symbol.in_trade and bool(symbol.trade_data.stop_loss)
+    return result
+
+
+# a polling loop running func1 and func2 every poll against the bar clock scheduler over the same hours; both hold
+# one position from the start, with an extra fix level close enough to be crossed
+def bench_bar_scheduler(symbols: int = 20, hours: int = 4, poll: int = 120, fix_percent: Decimal = Decimal('0.003')):
+    result = {'symbols': symbols, 'hours': hours, 'poll_seconds': poll}
+    hour = 3600000
+    for mode in ('polling', 'scheduled'):
+        now = [FakeClient(1).clock() // hour * hour + hour // 2]
+        client = FakeClient(symbols, clock=lambda: now[0])
+
+        def sleep(delay: float):    # waiting out the weight budget moves the simulated time on
+            now[0] += int(delay * 1000)
+
+        requests = RequestScheduler(client, clock=lambda: now[0] / 1000, sleep=sleep)
+        get = Get(client, clock=client.clock, scheduler=requests)
+        bot = SlingShotBot(client, Decimal('0.01'), Decimal('0.02'), 'STOP_MARKET', main_trend=1, get=get,
+                           required_volume=0, required_fix_percent=fix_percent)
+        bot.new_position(bot.symbols[1], 'BUY')
+        scheduler = BarScheduler(bot, poll=poll) if mode == 'scheduled' else None
+        end = now[0] + hours * hour
+        client.calls.clear()
+        counted = {}
+        started = time.perf_counter()
+        while now[0] < end:
+            if scheduler:
+                scheduler.step()
+            else:
+                before = sum(signal.computed for signal in bot.signals.values())
+                bot.func1()
+                bot.func2()
+                key = now[0] // hour * hour
+                counted[key] = counted.get(key, 0) + sum(signal.computed for signal in bot.signals.values()) - before
+            now[0] += poll * 1000
+        row = {'seconds': time.perf_counter() - started, 'requests': client.requests(),
+               'kline_requests': client.requests('futures_klines'),
+               'throttled_seconds': sum(requests.stats()['throttled_seconds'].values()),
+               'orders': client.requests('futures_create_order'),
+               'computed_per_hour': list(counted.values()) if not scheduler else
+               [counts['computed'] for counts in scheduler.stats()]}
+        if scheduler:
+            stats = scheduler.stats()
+            row.update({'skipped_per_hour': [counts['skipped'] + counts['memoized'] for counts in stats],
+                        'bar_closes': sum(counts['bar_closes'] for counts in stats),
+                        'triggered': sum(counts['triggered'] for counts in stats)})
+        result[mode] = row
+    return result
+
+
+def _wait(condition, timeout: float = 120):
+    started = time.perf_counter()
+    while not condition() and time.perf_counter() - started < timeout:
+        time.sleep(0.05)
+    return time.perf_counter() - started
+
+
+# symbols evaluated per second with the market split over worker processes, each with its own slow fake exchange
+# connection; the largest run then loses a worker to SIGKILL and gets it back
+def bench_shards(symbols: int = 60, latency: float = 0.01, shards=(1, 2, 4), seconds: float = 5):
+    result = {'symbols': symbols, 'latency_seconds': latency, 'cpus': os.cpu_count(), 'runs': []}
+    factory = functools.partial(FakeClient, symbols, latency=latency)
+    params = {'order_percent': Decimal('0.01'), 'sl_percent': Decimal('0.02'), 'sl_type': 'STOP_MARKET',
+              'required_volume': 0}
+    for count in shards:
+        coordinator = ShardCoordinator(factory, count, params, main_trend=1).start()
+        try:
+            cycles = lambda: [shard['cycles'] for shard in coordinator.stats()['shards']]
+            warmup = _wait(lambda: len(cycles()) == count and min(cycles()) >= 2)  # the first cycle downloads
+            before = sum(shard['symbol_cycles'] for shard in coordinator.stats()['shards'])
+            started = time.perf_counter()
+            time.sleep(seconds)
+            evaluated = sum(shard['symbol_cycles'] for shard in coordinator.stats()['shards']) - before
+            run = {'shards': count, 'warmup_seconds': warmup,
+                   'symbols_per_second': evaluated / (time.perf_counter() - started),
+                   'shared_budget': coordinator.stats()['budget']}
+            if count == max(shards):
+                victim = coordinator.stats()['shards'][0]
+                owned = victim['symbols']
+                trades = {ticker: shard.index for shard in list(coordinator.shards.values())[1:]
+                          for ticker in shard.holding}
+                os.kill(victim['pid'], signal.SIGKILL)
+                run['crash'] = {'moved_symbols': owned,
+                                'reassigned_seconds': _wait(lambda: coordinator.crashes and
+                                                            len(coordinator.assignment()) == len(coordinator.tickers)),
+                                'covered_by': len(set(coordinator.assignment().values())),
+                                'restored_seconds': _wait(lambda: len(set(coordinator.assignment().values())) == count)}
+                owners = coordinator.assignment()
+                run['crash'].update({'restarts': sum(shard['restarts'] for shard in coordinator.stats()['shards']),
+                                     'rebalances': coordinator.rebalances, 'survivor_trades': len(trades),
+                                     'trades_kept_by_owner': sum(owners.get(ticker) == index
+                                                                 for ticker, index in trades.items()),
+                                     'cycle_errors': sum(shard['errors']
+                                                         for shard in coordinator.stats()['shards'])})
+            result['runs'].append(run)
+        finally:
+            coordinator.stop()
+    base = result['runs'][0]['symbols_per_second']
+    for run in result['runs']:
+        run['speedup'] = run['symbols_per_second'] / base if base else 0.0
+    return result
+
+
+BENCHMARKS = {
+    'candle_cache': bench_candle_cache,
+    'candle_frames': bench_candle_frames,
+    'indicators': bench_indicators,
+    'batch_signals': bench_batch_signals,
+    'async_scan': bench_async_scan,
+    'market_snapshot': bench_market_snapshot,
+    'scheduler': bench_scheduler,
+    'user_stream': bench_user_stream,
+    'account_state': bench_account_state,
+    'backtest': bench_backtest,
+    'sweep': bench_sweep,
+    'kline_archive': bench_kline_archive,
+    'journal': bench_journal,
+    'symbol_registry': bench_symbol_registry,
+    'trade_accounting': bench_trade_accounting,
+    'startup': bench_startup,
+    'metrics': bench_metrics,
+    'candle_paging': bench_candle_paging,
+    'recorded_frames': bench_recorded_frames,
+    'bot_cycle': bench_bot_cycle,
+    'order_retries': bench_order_retries,
+    'request_errors': bench_request_errors,
+    'backfill': bench_backfill,
+    'resample': bench_resample,
+    'order_book': bench_order_book,
+    'order_batching': bench_order_batching,
+    'bar_scheduler': bench_bar_scheduler,
+    'shards': bench_shards,
+}
+
+
+# path -> value of every timing in a result tree
+def _timings(result, path: str = ''):
+    timings = {}
+    items = result.items() if isinstance(result, dict) else enumerate(result) if isinstance(result, list) else ()
+    for key, value in items:
+        name = f'{path}.{key}' if path else str(key)
+        if isinstance(value, (dict, list)):
+            timings.update(_timings(value, name))
+        elif str(key).endswith('seconds') and isinstance(value, (int, float)) and not isinstance(value, bool):
+            timings[name] = value
+    return timings
+
+
+def compare(base: dict, results: dict, threshold: float = 0.2):
+    old, new = _timings(base['results']), _timings(results)
+    ratios = {name: new[name] / old[name] for name in sorted(new.keys() & old.keys()) if old[name] > 0}
+    return {'base_commit': base.get('commit'), 'threshold': threshold,
+            'regressions': {name: ratio for name, ratio in ratios.items() if ratio > 1 + threshold},
+            'improvements': {name: ratio for name, ratio in ratios.items() if ratio < 1 / (1 + threshold)}}
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('names', nargs='*', help=f'scenarios to run, all of them by default: {", ".join(BENCHMARKS)}')
+    parser.add_argument('--output', help='write the results, the commit and the python version to this file')
+    parser.add_argument('--compare', help='results file of an earlier run; exits with 1 on a slower timing')
+    parser.add_argument('--threshold', type=float, default=0.2, help='slowdown ratio that counts as a regression')
+    parser.add_argument('--record', action='store_true', help='record the fixture again from the synthetic client')
+    args = parser.parse_args()
+
+    if args.record:
+        client = FakeClient(6)
+        record_fixture(client, FIXTURE, client.tickers)
+    results = {name: BENCHMARKS[name]() for name in args.names or list(BENCHMARKS)}
+    document = {'commit': _commit(), 'python': sys.version.split()[0], 'time': datetime.now().isoformat(),
+                'results': results}
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(document, file, indent=2, default=str)
+    if args.compare:
+        with open(args.compare) as file:
+            document['comparison'] = compare(json.load(file), results, args.threshold)
+    print(json.dumps(document, indent=2, default=str))
+    failed = [name for name, result in results.items() if isinstance(result, dict) and result.get('passed') is False]
+    if failed:
+        print(f'failed: {", ".join(failed)}', file=sys.stderr)
+    if failed or document.get('comparison', {}).get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
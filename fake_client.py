@@ -0,0 +1,603 @@
+from getter import INTERVALS
+from decimal import *
+import asyncio
+import bisect
+import gzip
+import itertools
+import json
+import math
+import random
+import requests
+import threading
+import time
+import websockets
+import zlib
+
+
+def _api_exception(*args):
+    from binance.exceptions import BinanceAPIException
+    return BinanceAPIException(*args)
+
+
+class _Response:
+    def __init__(self, headers: dict):
+        self.headers = headers
+        self.text = ''
+
+
+class FakeClient:
+    SIDE_BUY = 'BUY'
+    SIDE_SELL = 'SELL'
+    ORDER_TYPE_MARKET = 'MARKET'
+    ORDER_TYPE_LIMIT = 'LIMIT'
+    TIME_IN_FORCE_GTC = 'GTC'
+
+    def __init__(self, symbols: int = 200, clock=None, latency: float = 0, fill_delay: float = 0,
+                 fill_polls: int = 0, jitter: float = 0, error_rate: float = 0, seed: int = 0):
+        self.tickers = ['BTCUSDT'] + [f'S{i:04d}USDT' for i in range(1, symbols)]
+        self.clock = clock if clock else lambda: int(time.time() * 1000)
+        self.latency = latency
+        self.jitter = jitter    # extra latency, uniform in [0, jitter)
+        self.error_rate = error_rate    # share of calls answered with a retryable 503
+        self.rng = random.Random(seed)
+        self.calls = []
+        self.klines_served = 0
+        self.errors = {}    # method -> (status code, error code[, headers]) or exceptions its next calls raise
+        self.orders = {}
+        self.order_ids = itertools.count(1)
+        self.fill_delay = fill_delay    # market orders stay NEW this many seconds
+        self.fill_polls = fill_polls    # or answer NEW to this many futures_get_order calls, independent of timing
+        self.unfilled = {}      # order id -> NEW answers left
+        self.user_events = []   # user data stream payloads, in the order they happened
+        self.positions = {}     # symbol -> signed position amount
+        self.holes = {}     # symbol -> (first, last) open times the exchange has no klines for
+        self.rejections = {}    # order type -> error codes the next batched orders of that type are rejected with
+        self.depth = {}     # symbol -> DepthReplay whose snapshots futures_order_book answers with
+        self.client_ids = {}    # client order id -> order id
+        self.lost = {}      # method -> number of its next calls that take effect and then time out
+
+    # every call goes through here: it is logged, waits out the latency and raises the injected errors
+    def record(self, method: str, **kwargs):
+        self.calls.append((method, kwargs))
+        if self.latency or self.jitter:
+            time.sleep(self.latency + self.rng.uniform(0, self.jitter))
+        if self.errors.get(method):
+            error = self.errors[method].pop(0)
+            if isinstance(error, Exception):
+                raise error
+            status_code, code, headers = error if len(error) == 3 else error + ({},)
+            raise _api_exception(_Response(headers), status_code, json.dumps({'code': code, 'msg': 'injected'}))
+        if self.error_rate and self.rng.random() < self.error_rate:
+            raise _api_exception(_Response({}), 503, json.dumps({'code': -1001, 'msg': 'injected'}))
+
+    def requests(self, method: str = None):
+        return sum(1 for call in self.calls if method is None or call[0] == method)
+
+    @staticmethod
+    def __seed(*parts):
+        return zlib.crc32('|'.join(str(part) for part in parts).encode())
+
+    def price(self, symbol: str, timestamp: int):
+        seed = self.__seed(symbol)
+        base = 1 + seed % 50000
+        phase = seed % 628 / 100
+        wave = 0.1 * math.sin(timestamp / 86400000 / 7 + phase) + 0.03 * math.sin(timestamp / 3600000 / 5 + phase)
+        noise = random.Random(self.__seed(symbol, timestamp // 60000)).uniform(-0.004, 0.004)
+        return base * (1 + wave + noise)
+
+    def kline(self, symbol: str, open_time: int, step: int):
+        close_time = open_time + step - 1
+        open_price = self.price(symbol, open_time)
+        close_price = self.price(symbol, min(close_time, self.clock()))
+        rnd = random.Random(self.__seed(symbol, open_time, step))
+        high = max(open_price, close_price) * (1 + rnd.uniform(0, 0.005))
+        low = min(open_price, close_price) * (1 - rnd.uniform(0, 0.005))
+        volume = rnd.uniform(1000, 100000)
+        trades = rnd.randint(100, 10000)
+        return [open_time, f'{open_price:.4f}', f'{high:.4f}', f'{low:.4f}', f'{close_price:.4f}', f'{volume:.3f}',
+                close_time, f'{volume * close_price:.2f}', trades, f'{volume / 2:.3f}',
+                f'{volume * close_price / 2:.2f}', '0']
+
+    def futures_exchange_info(self):
+        self.record('futures_exchange_info')
+        symbols = []
+        for ticker in self.tickers:
+            symbols.append({'symbol': ticker, 'status': 'TRADING', 'filters': [
+                {'filterType': 'PRICE_FILTER', 'tickSize': '0.0001', 'minPrice': '0.0001', 'maxPrice': '1000000'},
+                {'filterType': 'LOT_SIZE', 'stepSize': '0.001', 'minQty': '0.001', 'maxQty': '1000000'}]})
+        return {'serverTime': self.clock(), 'symbols': symbols}
+
+    def futures_klines(self, symbol: str, interval: str, startTime: int = None, endTime: int = None,
+                       limit: int = 500):
+        self.record('futures_klines', symbol=symbol, interval=interval, startTime=startTime, endTime=endTime,
+                      limit=limit)
+        step = INTERVALS[interval]
+        current = self.clock() // step * step
+        if startTime is not None:
+            first = -(-startTime // step) * step
+            last = min(current, first + (limit - 1) * step)
+            if endTime is not None:
+                last = min(last, endTime // step * step)
+        else:
+            last = current if endTime is None else min(current, endTime // step * step)
+            first = last - (limit - 1) * step
+        holes = self.holes.get(symbol, ())
+        klines = [self.kline(symbol, open_time, step) for open_time in range(first, last + 1, step)
+                  if not any(start <= open_time <= end for start, end in holes)]
+        self.klines_served += len(klines)
+        return klines
+
+    def futures_symbol_ticker(self, symbol: str):
+        self.record('futures_symbol_ticker', symbol=symbol)
+        return self.__ticker(symbol)
+
+    def futures_ticker(self, symbol: str = None):
+        self.record('futures_ticker', symbol=symbol)
+        if symbol:
+            return self.__ticker(symbol)
+        return [self.__ticker(ticker) for ticker in self.tickers]
+
+    def futures_order_book(self, symbol: str, limit: int = 500):
+        self.record('futures_order_book', symbol=symbol, limit=limit)
+        if symbol in self.depth:
+            return self.depth[symbol].snapshot(limit=limit)
+        price = self.price(symbol, self.clock())
+        return {'bids': [[f'{price * (1 - 0.0001 * i):.4f}', '10'] for i in range(1, limit + 1)],
+                'asks': [[f'{price * (1 + 0.0001 * i):.4f}', '10'] for i in range(1, limit + 1)]}
+
+    def futures_account_information(self):
+        self.record('futures_account_information')
+        return {'totalWalletBalance': '10000', 'totalMaintMargin': '100', 'totalMarginBalance': '10000'}
+
+    # market orders fill after fill_delay, everything else stays NEW until filled or cancelled
+    # an answer the exchange sent that never arrives: the call took effect, the caller sees a read timeout
+    def __lose(self, method: str, answer):
+        if self.lost.get(method):
+            self.lost[method] -= 1
+            raise requests.exceptions.ReadTimeout('injected')
+        return answer
+
+    # the exchange only refuses the client order id of an order that is still open; a filled one can be placed again
+    def __taken(self, client_id: str):
+        order = self.orders.get(self.client_ids.get(client_id))
+        return bool(order) and order['status'] in ('NEW', 'PARTIALLY_FILLED')
+
+    def futures_create_order(self, symbol: str, side: str, type: str, **params):
+        self.record('futures_create_order', symbol=symbol, side=side, type=type, **params)
+        if self.__taken(params.get('newClientOrderId')):
+            raise _api_exception(_Response({}), 400, json.dumps({'code': -4116, 'msg': 'ClientOrderId is duplicated.'}))
+        return self.__lose('futures_create_order', self.__create(symbol, side, type, **params))
+
+    # every order is taken on its own, a rejected one is answered with its error in its place
+    def futures_place_batch_order(self, batchOrders: list):
+        self.record('futures_place_batch_order', batchOrders=batchOrders)
+        answers = []
+        for order in batchOrders:
+            order = dict(order)
+            if self.rejections.get(order['type']):
+                answers.append({'code': self.rejections[order['type']].pop(0), 'msg': 'injected'})
+                continue
+            if self.__taken(order.get('newClientOrderId')):
+                answers.append({'code': -4116, 'msg': 'ClientOrderId is duplicated.'})
+                continue
+            order['closePosition'] = order.get('closePosition') == 'true'    # batches send strings only
+            answers.append(self.__create(order.pop('symbol'), order.pop('side'), order.pop('type'), **order))
+        return self.__lose('futures_place_batch_order', answers)
+
+    def __create(self, symbol: str, side: str, type: str, **params):
+        order_id = next(self.order_ids)
+        client_id = params.get('newClientOrderId') or f'fake{order_id}'
+        self.client_ids[client_id] = order_id
+        self.orders[order_id] = {'orderId': order_id, 'clientOrderId': client_id, 'symbol': symbol, 'side': side,
+                                 'type': type, 'status': 'NEW', 'origQty': str(params.get('quantity', 0)),
+                                 'executedQty': '0', 'avgPrice': '0', 'stopPrice': str(params.get('stopPrice', 0)),
+                                 'updateTime': self.clock(), 'closePosition': bool(params.get('closePosition'))}
+        self.__order_event(order_id, 'NEW')
+        if type == self.ORDER_TYPE_MARKET:
+            if self.fill_polls:
+                self.unfilled[order_id] = self.fill_polls
+            elif self.fill_delay:
+                threading.Timer(self.fill_delay, self.fill_order, (order_id,)).start()
+            else:
+                self.fill_order(order_id)
+        return dict(self.orders[order_id])
+
+    def fill_order(self, order_id: int):
+        order = self.orders[order_id]
+        if order['status'] != 'NEW':
+            return
+        price = self.price(order['symbol'], self.clock())
+        amount = self.positions.get(order['symbol'], Decimal(0))
+        if order['closePosition']:
+            executed = str(abs(amount))
+        else:
+            executed = order['origQty'] if order['origQty'] != '0' else '1'
+        order.update({'status': 'FILLED', 'avgPrice': f'{price:.4f}', 'updateTime': self.clock(),
+                      'executedQty': executed})
+        qty = Decimal(executed)
+        amount += qty if order['side'] == self.SIDE_BUY else -qty
+        self.positions[order['symbol']] = amount
+        self.__order_event(order_id, 'TRADE')
+        self.user_events.append({'e': 'ACCOUNT_UPDATE', 'E': self.clock(), 'T': self.clock(), 'a': {
+            'm': 'ORDER', 'B': [{'a': 'USDT', 'wb': '10000', 'cw': '10000'}], 'P': [
+                {'s': order['symbol'], 'pa': str(amount), 'ep': order['avgPrice'], 'up': '0',
+                 'mt': 'cross', 'ps': 'BOTH'}]}})
+
+    def __order_event(self, order_id: int, execution: str):
+        order = self.orders[order_id]
+        self.user_events.append({'e': 'ORDER_TRADE_UPDATE', 'E': self.clock(), 'T': self.clock(), 'o': {
+            's': order['symbol'], 'c': f'fake{order_id}', 'S': order['side'], 'o': order['type'], 'f': 'GTC',
+            'q': order['origQty'], 'p': '0', 'ap': order['avgPrice'], 'sp': order['stopPrice'], 'x': execution,
+            'X': order['status'], 'i': order_id, 'l': order['executedQty'], 'z': order['executedQty'],
+            'L': order['avgPrice'], 'T': order['updateTime'], 'R': False, 'ps': 'BOTH'}})
+
+    def futures_position_information(self, symbol: str = None):
+        self.record('futures_position_information', symbol=symbol)
+        tickers = [symbol] if symbol else self.tickers
+        return [{'symbol': ticker, 'positionAmt': str(self.positions.get(ticker, Decimal(0))), 'entryPrice': '0',
+                 'positionSide': 'BOTH'} for ticker in tickers]
+
+    def futures_get_open_orders(self, symbol: str = None):
+        self.record('futures_get_open_orders', symbol=symbol)
+        return [dict(order) for order in self.orders.values()
+                if order['status'] == 'NEW' and (symbol is None or order['symbol'] == symbol)]
+
+    def futures_stream_get_listen_key(self):
+        self.record('futures_stream_get_listen_key')
+        return 'fakelistenkey'
+
+    def futures_stream_keepalive(self, listenKey: str):
+        self.record('futures_stream_keepalive', listenKey=listenKey)
+        return {}
+
+    def futures_get_order(self, symbol: str, orderId: int = None, origClientOrderId: str = None):
+        self.record('futures_get_order', symbol=symbol, orderId=orderId, origClientOrderId=origClientOrderId)
+        if orderId is None:
+            orderId = self.client_ids.get(origClientOrderId)
+        if orderId not in self.orders:
+            raise _api_exception(_Response({}), 400, json.dumps({'code': -2013, 'msg': 'Order does not exist.'}))
+        if orderId in self.unfilled:
+            self.unfilled[orderId] -= 1
+            if self.unfilled[orderId] < 0:
+                del self.unfilled[orderId]
+                self.fill_order(orderId)
+        return dict(self.orders[orderId])
+
+    def futures_cancel_order(self, symbol: str, orderId: int):
+        self.record('futures_cancel_order', symbol=symbol, orderId=orderId)
+        if orderId not in self.orders:
+            raise _api_exception(_Response({}), 400, json.dumps({'code': -2011, 'msg': 'Unknown order sent.'}))
+        self.orders[orderId].update({'status': 'CANCELED', 'updateTime': self.clock()})
+        self.__order_event(orderId, 'CANCELED')
+        return dict(self.orders[orderId])
+
+    def __ticker(self, symbol: str):
+        now = self.clock()
+        last_price = self.price(symbol, now)
+        open_price = self.price(symbol, now - 86400000)
+        volume = random.Random(self.__seed(symbol, 'volume')).uniform(1e6, 5e8)
+        return {'symbol': symbol, 'lastPrice': f'{last_price:.4f}', 'openPrice': f'{open_price:.4f}',
+                'priceChangePercent': f'{(last_price / open_price - 1) * 100:.3f}',
+                'volume': f'{volume / last_price:.3f}', 'quoteVolume': f'{volume:.2f}', 'closeTime': now}
+
+    def stream_frames(self, tickers: list, interval: str, start_time: int, bars: int, updates: int = 4):
+        step = INTERVALS[interval]
+        frames = []
+        for open_time in range(start_time // step * step, start_time // step * step + bars * step, step):
+            for update in range(1, updates + 1):
+                event_time = open_time + step * update // updates - (1 if update == updates else 0)
+                for ticker in tickers:
+                    stream = ticker.lower()
+                    kline = self.kline(ticker, open_time, step)
+                    close_price = self.price(ticker, event_time)
+                    frames.append({'stream': f'{stream}@kline_{interval}', 'data': {
+                        'e': 'kline', 'E': event_time, 's': ticker, 'k': {
+                            't': open_time, 'T': open_time + step - 1, 's': ticker, 'i': interval, 'o': kline[1],
+                            'h': kline[2], 'l': kline[3], 'c': f'{close_price:.4f}', 'v': kline[5], 'n': kline[8],
+                            'x': update == updates, 'q': kline[7], 'V': kline[9], 'Q': kline[10]}}})
+                    ticker_data = self.__ticker(ticker)
+                    frames.append({'stream': f'{stream}@miniTicker', 'data': {
+                        'e': '24hrMiniTicker', 'E': event_time, 's': ticker, 'c': f'{close_price:.4f}',
+                        'o': ticker_data['openPrice'], 'h': f'{close_price * 1.05:.4f}',
+                        'l': f'{close_price * 0.95:.4f}', 'v': ticker_data['volume'],
+                        'q': ticker_data['quoteVolume']}})
+                    frames.append({'stream': f'{stream}@bookTicker', 'data': {
+                        'e': 'bookTicker', 'E': event_time, 's': ticker, 'b': f'{close_price * 0.9999:.4f}',
+                        'B': '10', 'a': f'{close_price * 1.0001:.4f}', 'A': '10'}})
+        return frames
+
+
+
+# one symbol's diff depth stream from a seeded random walk, with the U / u / pu update ids of binance futures;
+# position is how far the exchange is, snapshots are the book after that many events
+class DepthReplay:
+    def __init__(self, symbol: str, price: Decimal = Decimal(100), tick: Decimal = Decimal('0.01'), levels: int = 100,
+                 events: int = 2000, seed: int = 0, start_time: int = 0):
+        rng = random.Random(seed)
+        self.symbol = symbol
+        self.tick = tick
+        self.first_id = 1000
+        mid = int(price / tick)     # in ticks
+        bids = {mid - i: rng.randint(1, 100000) for i in range(1, levels + 1)}  # ticks -> lots of 0.001
+        asks = {mid + i: rng.randint(1, 100000) for i in range(1, levels + 1)}
+        self.initial = (dict(bids), dict(asks))
+        self.events = []
+        update_id = self.first_id
+        for n in range(events):
+            mid += rng.choice((-1, 0, 0, 1))
+            changes = ({}, {})
+            for _ in range(rng.randint(1, 8)):
+                side = rng.random() < 0.5
+                price = mid + rng.randint(1, levels) * (1 if side else -1)
+                changes[side][price] = 0 if rng.random() < 0.3 else rng.randint(1, 100000)
+            changes[0].update((price, 0) for price in bids if price >= mid)     # the walk crossed them
+            changes[1].update((price, 0) for price in asks if price <= mid)
+            for book, changed in zip((bids, asks), changes):
+                for price, quantity in changed.items():
+                    if quantity:
+                        book[price] = quantity
+                    else:
+                        book.pop(price, None)
+            last = update_id + rng.randint(1, 3)
+            self.events.append({'e': 'depthUpdate', 'E': start_time + 100 * n, 'T': start_time + 100 * n,
+                                's': symbol, 'U': update_id + 1, 'u': last, 'pu': update_id,
+                                'b': self.__levels(changes[0]), 'a': self.__levels(changes[1])})
+            update_id = last
+        self.position = len(self.events)
+
+    def __levels(self, changes: dict):
+        return [[str(price * self.tick), str(Decimal(quantity) / 1000)] for price, quantity in changes.items()]
+
+    # last update id and the full book after position events, prices and quantities as Decimal
+    def state(self, position: int = None):
+        position = self.position if position is None else position
+        bids, asks = ({self.tick * price: Decimal(quantity) / 1000 for price, quantity in side.items()}
+                      for side in self.initial)
+        for event in self.events[:position]:
+            for levels, changes in ((bids, event['b']), (asks, event['a'])):
+                for price, quantity in changes:
+                    price, quantity = Decimal(price), Decimal(quantity)
+                    if quantity:
+                        levels[price] = quantity
+                    else:
+                        levels.pop(price, None)
+        last_update_id = self.events[position - 1]['u'] if position else self.first_id
+        return last_update_id, bids, asks
+
+    def snapshot(self, position: int = None, limit: int = 1000):
+        last_update_id, bids, asks = self.state(position)
+        return {'lastUpdateId': last_update_id,
+                'bids': [[str(price), str(bids[price])] for price in sorted(bids, reverse=True)[:limit]],
+                'asks': [[str(price), str(asks[price])] for price in sorted(asks)[:limit]]}
+
+
+FIXTURE_VERSION = 1     # bump when the fixture layout changes
+
+
+# answers a benchmark needs from any client, real or fake, in one gzipped json file; intervals maps an interval to
+# the number of bars kept for every ticker, paged the way binance allows
+def record_fixture(client, path: str, tickers: list, intervals: dict = None, book_limit: int = 5,
+                   fill_polls: int = 1):
+    intervals = intervals if intervals else {'1h': 1100, '4h': 100}
+    exchange_info = client.futures_exchange_info()
+    wanted = set(tickers)
+    fixture = {'version': FIXTURE_VERSION, 'time': int(exchange_info.get('serverTime') or time.time() * 1000),
+               'fill_polls': fill_polls,
+               'exchange_info': {'symbols': [{'symbol': symbol['symbol'], 'status': symbol.get('status'),
+                                              'filters': symbol['filters']}
+                                             for symbol in exchange_info['symbols'] if symbol['symbol'] in wanted]},
+               'tickers': [ticker for ticker in client.futures_ticker() if ticker['symbol'] in wanted],
+               'order_books': {}, 'klines': {}}
+    for ticker in tickers:
+        book = client.futures_order_book(symbol=ticker, limit=book_limit)
+        fixture['order_books'][ticker] = {'bids': book['bids'][:book_limit], 'asks': book['asks'][:book_limit]}
+        fixture['klines'][ticker] = {}
+        for interval, bars in intervals.items():
+            klines, end_time = [], fixture['time']
+            while len(klines) < bars:
+                page = client.futures_klines(symbol=ticker, interval=interval, endTime=end_time,
+                                             limit=min(1500, bars - len(klines)))
+                if not page:
+                    break
+                klines = page + klines
+                end_time = int(page[0][0]) - 1
+            fixture['klines'][ticker][interval] = klines
+    with gzip.open(path, 'wt') as file:
+        json.dump(fixture, file, separators=(',', ':'))
+    return fixture
+
+
+# a FakeClient serving a recorded market: the clock stands still at the recording time, so every run sees the same
+# candles, tickers and books; asking for more symbols than were recorded repeats the recorded ones under new names
+class RecordedClient(FakeClient):
+    def __init__(self, path: str, symbols: int = None, latency: float = 0, jitter: float = 0, error_rate: float = 0,
+                 seed: int = 0, fill_polls: int = None):
+        with gzip.open(path, 'rt') as file:
+            fixture = json.load(file)
+        if fixture.get('version') != FIXTURE_VERSION:
+            raise ValueError(f'fixture {path} has version {fixture.get("version")}, expected {FIXTURE_VERSION}')
+        recorded = [symbol['symbol'] for symbol in fixture['exchange_info']['symbols']]
+        symbols = symbols if symbols else len(recorded)
+        super(RecordedClient, self).__init__(symbols, clock=lambda: fixture['time'], latency=latency,
+                                             fill_polls=fixture['fill_polls'] if fill_polls is None else fill_polls,
+                                             jitter=jitter, error_rate=error_rate, seed=seed)
+        self.fixture = fixture
+        self.sources = {}   # ticker -> recorded ticker
+        self.tickers = []
+        for i in range(symbols):
+            ticker = recorded[i] if i < len(recorded) else f'R{i:04d}USDT'
+            self.tickers.append(ticker)
+            self.sources[ticker] = recorded[i % len(recorded)]
+        self.filters = {symbol['symbol']: symbol for symbol in fixture['exchange_info']['symbols']}
+        self.ticker_data = {ticker['symbol']: ticker for ticker in fixture['tickers']}
+        self.open_times = {}    # (recorded ticker, interval) -> open times, for bisecting
+
+    def __series(self, symbol: str, interval: str):
+        source = self.sources[symbol]
+        klines = self.fixture['klines'][source].get(interval, [])
+        key = (source, interval)
+        if key not in self.open_times:
+            self.open_times[key] = [int(kline[0]) for kline in klines]
+        return klines, self.open_times[key]
+
+    def price(self, symbol: str, timestamp: int):
+        intervals = self.fixture['klines'][self.sources[symbol]]
+        klines, open_times = self.__series(symbol, min(intervals, key=lambda interval: INTERVALS[interval]))
+        return float(klines[max(0, bisect.bisect_right(open_times, timestamp) - 1)][4])
+
+    def futures_exchange_info(self):
+        self.record('futures_exchange_info')
+        return {'serverTime': self.clock(), 'symbols': [dict(self.filters[self.sources[ticker]], symbol=ticker)
+                                                        for ticker in self.tickers]}
+
+    def futures_klines(self, symbol: str, interval: str, startTime: int = None, endTime: int = None,
+                       limit: int = 500):
+        self.record('futures_klines', symbol=symbol, interval=interval, startTime=startTime, endTime=endTime,
+                    limit=limit)
+        klines, open_times = self.__series(symbol, interval)
+        stop = len(klines) if endTime is None else bisect.bisect_right(open_times, endTime)
+        if startTime is not None:
+            start = bisect.bisect_left(open_times, startTime)
+            stop = min(stop, start + limit)
+        else:
+            start = max(0, stop - limit)
+        served = [list(kline) for kline in klines[start:stop]]
+        self.klines_served += len(served)
+        return served
+
+    def __ticker(self, symbol: str):
+        return dict(self.ticker_data[self.sources[symbol]], symbol=symbol)
+
+    def futures_symbol_ticker(self, symbol: str):
+        self.record('futures_symbol_ticker', symbol=symbol)
+        return self.__ticker(symbol)
+
+    def futures_ticker(self, symbol: str = None):
+        self.record('futures_ticker', symbol=symbol)
+        if symbol:
+            return self.__ticker(symbol)
+        return [self.__ticker(ticker) for ticker in self.tickers]
+
+    def futures_order_book(self, symbol: str, limit: int = 500):
+        self.record('futures_order_book', symbol=symbol, limit=limit)
+        book = self.fixture['order_books'][self.sources[symbol]]
+        return {'bids': book['bids'][:limit], 'asks': book['asks'][:limit]}
+
+class AsyncFakeClient:      # AsyncClient stand-in over a FakeClient, with artificial per-request latency
+    def __init__(self, client: FakeClient, latency: float = 0.02):
+        self.client = client
+        self.latency = latency
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __call(self, method: str, **params):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            return getattr(self.client, method)(**params)
+        finally:
+            self.in_flight -= 1
+
+    async def futures_exchange_info(self):
+        return await self.__call('futures_exchange_info')
+
+    async def futures_klines(self, **params):
+        return await self.__call('futures_klines', **params)
+
+    async def futures_symbol_ticker(self, **params):
+        return await self.__call('futures_symbol_ticker', **params)
+
+    async def futures_ticker(self, **params):
+        return await self.__call('futures_ticker', **params)
+
+
+# stands in for the futures market stream and replays recorded combined-stream frames; with user=True it serves
+# a user data stream instead, following the frame list as it grows (FakeClient.user_events)
+class FakeStreamServer:
+    def __init__(self, frames: list, host: str = '127.0.0.1', port: int = 0, drop_after: int = None,
+                 skip_on_drop: int = 0, delay: float = 0, user: bool = False):
+        self.frames = frames
+        self.user = user
+        self.host = host
+        self.port = port
+        self.drop_after = drop_after
+        self.skip_on_drop = skip_on_drop
+        self.delay = delay
+        self.position = 0
+        self.connections = 0
+        self.subscriptions = []
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.__ready = threading.Event()
+
+    @property
+    def url(self):
+        return f'ws://{self.host}:{self.port}'
+
+    async def __user_handler(self, socket):
+        sent = 0
+        while not socket.closed:
+            if self.position >= len(self.frames):
+                await asyncio.sleep(0.001)
+                continue
+            frame = self.frames[self.position]
+            self.position += 1
+            await socket.send(json.dumps(frame))
+            sent += 1
+            if self.drop_after and sent >= self.drop_after:
+                self.position += self.skip_on_drop
+                await socket.close()
+                return
+
+    async def __handler(self, socket, path=None):
+        self.connections += 1
+        if self.user:
+            return await self.__user_handler(socket)
+        request = json.loads(await socket.recv())
+        streams = set(request['params'])
+        self.subscriptions.append(request['params'])
+        await socket.send(json.dumps({'result': None, 'id': request['id']}))
+
+        sent = 0
+        while self.position < len(self.frames):
+            frame = self.frames[self.position]
+            self.position += 1
+            if frame['stream'] not in streams:
+                continue
+            await socket.send(json.dumps(frame))
+            sent += 1
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            if self.drop_after and sent >= self.drop_after:
+                self.position += self.skip_on_drop
+                await socket.close()
+                return
+        await socket.wait_closed()
+
+    async def __serve(self):
+        self.server = await websockets.serve(self.__handler, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.__ready.set()
+        await self.server.wait_closed()
+
+    def __run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.__serve())
+
+    def start(self):
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+        self.__ready.wait(5)
+        return self.url
+
+    def replayed(self):
+        return self.position >= len(self.frames)
+
+    def stop(self):
+        if self.server:
+            self.loop.call_soon_threadsafe(self.server.close)
+        if self.thread:
+            self.thread.join(5)
@@ -1,107 +1,835 @@
 from decimal import *
-from binance.client import Client
+from lazy import LazyModule
+from metrics import METRICS
+from rate_limiter import RequestScheduler, WeightBudget, request_weight
 from symbol import Symbol
-import pandas as pd
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+import numpy as np
+import asyncio
+import json
+import os
+import threading
+import time
+
+if TYPE_CHECKING:
+    from binance import AsyncClient
+    from binance.client import Client
+
+pd = LazyModule('pandas')
+
+INTERVALS = {'1m': 60000, '3m': 180000, '5m': 300000, '15m': 900000, '30m': 1800000, '1h': 3600000,
+             '2h': 7200000, '4h': 14400000, '6h': 21600000, '8h': 28800000, '12h': 43200000, '1d': 86400000,
+             '3d': 259200000, '1w': 604800000}
+
+CANDLE_COLUMNS = [('open_time', np.int64), ('close_time', np.int64), ('high', np.float64), ('low', np.float64),
+                  ('open', np.float64), ('close', np.float64), ('volume', np.float64), ('cash_volume', np.float64),
+                  ('trades', np.int64)]
+
+RESAMPLE = {'2h': '1h', '4h': '1h', '1d': '1h'}     # intervals Get builds from cached lower ones
+
+EXCHANGE_CACHE_VERSION = 1     # bump when the cached layout or the filter parsing changes
+
+
+class CandleCache:
+    def __init__(self, depth: int = 1000):
+        self.depth = depth
+        self.store = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()     # market streams write from their own thread
+
+    def klines(self, symbol: str, interval: str):
+        return self.store.get((symbol, interval))
+
+    def update(self, symbol: str, interval: str, klines: list):
+        with self.lock:
+            cached = self.store.get((symbol, interval))
+            if cached is None:
+                cached = self.store[(symbol, interval)] = deque(maxlen=self.depth)
+            if klines:
+                first_open = int(klines[0][0])
+                while cached and int(cached[-1][0]) >= first_open:   # drop the still-open bar, it comes back updated
+                    cached.pop()
+                cached.extend(klines)
+            return cached
+
+    # futures_klines parameters for the next top-up: only bars from the last cached one, or a full warm-up
+    def request(self, symbol: str, interval: str, now: int):
+        cached = self.store.get((symbol, interval))
+        if cached:
+            since = int(cached[-1][0])
+            missing = (now - since) // INTERVALS[interval] + 1
+            if missing < self.depth:
+                self.hits += 1
+                return {'startTime': since, 'limit': missing + 1}
+            self.clear(symbol, interval)
+        self.misses += 1
+        return {'limit': self.depth}
+
+    def last(self, symbol: str, interval: str, limit: int):
+        with self.lock:
+            cached = self.store.get((symbol, interval))
+            if not cached:
+                return []
+            return list(cached)[-limit:]
+
+    def clear(self, symbol: str = None, interval: str = None):
+        with self.lock:
+            for key in list(self.store):
+                if (symbol is None or key[0] == symbol) and (interval is None or key[1] == interval):
+                    del self.store[key]
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'series': len(self.store),
+                'klines': sum(len(klines) for klines in self.store.values())}
+
+
+# higher timeframe klines folded from closed lower ones the way the exchange builds them from trades: first open,
+# highest high, lowest low, last close, summed volumes and trade counts. Buckets start on multiples of the interval,
+# so only intervals that divide a day (or are one) qualify. Volumes are summed as Decimal to keep the exchange digits
+class Resampler:
+    def __init__(self, source: str, target: str, depth: int = 1000):
+        self.source = source
+        self.target = target
+        self.source_step = INTERVALS[source]
+        self.step = INTERVALS[target]
+        if self.step <= self.source_step or self.step % self.source_step or INTERVALS['1d'] % self.step:
+            raise ValueError(f'{target} klines cannot be built from {source} klines')
+        self.bars = deque(maxlen=depth)     # closed higher bars
+        self.partial = None     # the bucket the closed lower bars have reached so far
+        self.last_open = None   # open time of the last lower bar folded in
+        self.limit = 0      # the most higher bars a read has asked for, the history folded goes back that far
+        self.lock = threading.Lock()
+
+    def reset(self):
+        self.bars.clear()
+        self.partial = None
+        self.last_open = None
+
+    @staticmethod
+    def merge(bar: list, kline: list):
+        return [bar[0], bar[1], kline[2] if float(kline[2]) > float(bar[2]) else bar[2],
+                kline[3] if float(kline[3]) < float(bar[3]) else bar[3], kline[4],
+                str(Decimal(bar[5]) + Decimal(kline[5])), bar[6], str(Decimal(bar[7]) + Decimal(kline[7])),
+                bar[8] + int(kline[8]), str(Decimal(bar[9]) + Decimal(kline[9])),
+                str(Decimal(bar[10]) + Decimal(kline[10])), bar[11]]
+
+    def __start(self, kline: list):
+        bucket = int(kline[0]) // self.step * self.step
+        return [bucket, kline[1], kline[2], kline[3], kline[4], kline[5], bucket + self.step - 1, kline[7],
+                int(kline[8]), kline[9], kline[10], kline[11]]
+
+    # one closed lower bar; bars at or before the last one folded in are skipped
+    def add(self, kline: list):
+        open_time = int(kline[0])
+        if self.last_open is not None and open_time <= self.last_open:
+            return False
+        partial = self.partial
+        if partial is not None and open_time > partial[6]:     # lower bars were missing at the end of the bucket
+            self.bars.append(partial)
+            partial = None
+        self.partial = self.__start(kline) if partial is None else self.merge(partial, kline)
+        self.last_open = open_time
+        if open_time + self.source_step > self.partial[6]:
+            self.bars.append(self.partial)
+            self.partial = None
+        return True
+
+    def extend(self, klines: list):
+        return sum(1 for kline in klines if self.add(kline))
+
+    # closed higher bars followed by the one the still-open lower bar belongs to, as futures_klines answers
+    def klines(self, open_kline: list = None, limit: int = None):
+        klines = list(self.bars)
+        partial = self.partial
+        if open_kline:
+            if partial is not None and int(open_kline[0]) > partial[6]:
+                klines.append(partial)
+                partial = None
+            klines.append(self.__start(open_kline) if partial is None else self.merge(partial, open_kline))
+        elif partial is not None:
+            klines.append(partial)
+        return klines[-limit:] if limit else klines
+
+
+# closed klines on disk, one append-only binary file per CANDLE_COLUMNS column under path/symbol/interval, read
+# through memory maps; holes.bin keeps (first, last) open times the exchange has no bars for
+class KlineArchive:
+    def __init__(self, path: str):
+        self.path = path
+        self.maps = {}      # (symbol, interval) -> {column: read-only memmap}
+        self.lock = threading.RLock()
+        self.appended = 0
+        self.rewrites = 0
+
+    def __dir(self, symbol: str, interval: str):
+        return os.path.join(self.path, symbol, interval)
+
+    @staticmethod
+    def to_columns(klines: list):
+        raw = np.array([kline[:9] for kline in klines], dtype=object)
+        order = {'open_time': 0, 'close_time': 6, 'high': 2, 'low': 3, 'open': 1, 'close': 4, 'volume': 5,
+                 'cash_volume': 7, 'trades': 8}
+        return {column: raw[:, order[column]].astype(dtype) for column, dtype in CANDLE_COLUMNS}
+
+    # binance kline lists again, prices as strings
+    @staticmethod
+    def to_klines(columns: dict):
+        rows = zip(columns['open_time'].tolist(), columns['open'].tolist(), columns['high'].tolist(),
+                   columns['low'].tolist(), columns['close'].tolist(), columns['volume'].tolist(),
+                   columns['close_time'].tolist(), columns['cash_volume'].tolist(), columns['trades'].tolist())
+        return [[open_time, repr(open_price), repr(high), repr(low), repr(close), repr(volume), close_time,
+                 repr(cash_volume), trades, '0', '0', '0']
+                for open_time, open_price, high, low, close, volume, close_time, cash_volume, trades in rows]
+
+    # an append torn by a crash leaves columns of different lengths, they are cut back to the shortest
+    def columns(self, symbol: str, interval: str):
+        with self.lock:
+            key = (symbol, interval)
+            if key in self.maps:
+                return self.maps[key]
+            folder = self.__dir(symbol, interval)
+            sizes = {}
+            for column, dtype in CANDLE_COLUMNS:
+                file = os.path.join(folder, f'{column}.bin')
+                sizes[column] = os.path.getsize(file) // np.dtype(dtype).itemsize if os.path.exists(file) else 0
+            count = min(sizes.values())
+            columns = {}
+            for column, dtype in CANDLE_COLUMNS:
+                file = os.path.join(folder, f'{column}.bin')
+                if sizes[column] > count:
+                    os.truncate(file, count * np.dtype(dtype).itemsize)
+                columns[column] = np.memmap(file, dtype, 'r', shape=(count,)) if count else np.empty(0, dtype)
+            self.maps[key] = columns
+            return columns
+
+    def __index(self, columns: dict, start: int = None, end: int = None):
+        open_times = columns['open_time']
+        first = 0 if start is None else int(np.searchsorted(open_times, start))
+        last = len(open_times) if end is None else int(np.searchsorted(open_times, end, side='right'))
+        return first, last
+
+    # zero-copy column views of the bars opened in [start, end]
+    def read(self, symbol: str, interval: str, start: int = None, end: int = None):
+        columns = self.columns(symbol, interval)
+        first, last = self.__index(columns, start, end)
+        return {column: values[first:last] for column, values in columns.items()}
+
+    def last(self, symbol: str, interval: str, limit: int):
+        columns = self.columns(symbol, interval)
+        return {column: values[-limit:] for column, values in columns.items()}
+
+    def write(self, symbol: str, interval: str, klines: list):
+        if not klines:
+            return 0
+        with self.lock:
+            new = self.to_columns(klines)
+            stored = self.columns(symbol, interval)
+            last = int(stored['open_time'][-1]) if len(stored['open_time']) else None
+            newer = new['open_time'] > last if last is not None else np.ones(len(klines), dtype=bool)
+            older = new['open_time'][~newer]
+            known = np.isin(older, stored['open_time'])
+            folder = self.__dir(symbol, interval)
+            os.makedirs(folder, exist_ok=True)
+
+            if not known.all():     # backfill or repair in front of the last bar: merge and rewrite
+                merged = {column: np.concatenate((stored[column], new[column])) for column in stored}
+                open_times, first = np.unique(merged['open_time'][::-1], return_index=True)
+                keep = len(merged['open_time']) - 1 - first     # the latest copy of a bar wins
+                for column, dtype in CANDLE_COLUMNS:
+                    file = os.path.join(folder, f'{column}.bin')
+                    merged[column][keep].astype(dtype).tofile(file + '.tmp')
+                self.maps.pop((symbol, interval), None)
+                for column, dtype in CANDLE_COLUMNS:
+                    file = os.path.join(folder, f'{column}.bin')
+                    os.replace(file + '.tmp', file)
+                self.rewrites += 1
+                return len(klines)
+
+            if newer.any():
+                order = np.argsort(new['open_time'][newer], kind='stable')
+                self.maps.pop((symbol, interval), None)
+                for column, dtype in CANDLE_COLUMNS:
+                    with open(os.path.join(folder, f'{column}.bin'), 'ab') as file:
+                        file.write(new[column][newer][order].astype(dtype).tobytes())
+                self.appended += int(newer.sum())
+            return int(newer.sum())
+
+    def holes(self, symbol: str, interval: str):
+        file = os.path.join(self.__dir(symbol, interval), 'holes.bin')
+        if not os.path.exists(file):
+            return np.empty((0, 2), dtype=np.int64)
+        return np.fromfile(file, dtype=np.int64).reshape(-1, 2)
+
+    def mark_hole(self, symbol: str, interval: str, start: int, end: int):
+        folder = self.__dir(symbol, interval)
+        os.makedirs(folder, exist_ok=True)
+        with self.lock, open(os.path.join(folder, 'holes.bin'), 'ab') as file:
+            file.write(np.array([start, end], dtype=np.int64).tobytes())
+
+    # (first, last) open times in [start, end] that are neither archived nor known holes
+    def missing(self, symbol: str, interval: str, start: int, end: int):
+        step = INTERVALS[interval]
+        columns = self.columns(symbol, interval)
+        first, last = self.__index(columns, start, end)
+        open_times = np.asarray(columns['open_time'][first:last])
+        bounds = np.concatenate(([start - step], open_times, [end + step]))
+        gaps = np.nonzero(np.diff(bounds) > step)[0]
+        ranges = [(int(bounds[i]) + step, int(bounds[i + 1]) - step) for i in gaps]
+
+        for hole_start, hole_end in self.holes(symbol, interval).tolist():
+            covered = []
+            for first_open, last_open in ranges:
+                if hole_end < first_open or hole_start > last_open:
+                    covered.append((first_open, last_open))
+                    continue
+                if first_open < hole_start:
+                    covered.append((first_open, hole_start - step))
+                if last_open > hole_end:
+                    covered.append((hole_end + step, last_open))
+            ranges = covered
+        return ranges
+
+    # gaps between archived bars, the ones a repair would fetch
+    def gaps(self, symbol: str, interval: str):
+        open_times = self.columns(symbol, interval)['open_time']
+        if len(open_times) < 2:
+            return []
+        return self.missing(symbol, interval, int(open_times[0]), int(open_times[-1]))
+
+    def stats(self):
+        return {'series': len(self.maps), 'appended': self.appended, 'rewrites': self.rewrites}
+
+
+# symbols and their filters on disk, so a start does not wait for futures_exchange_info; a stale file is still
+# served while Get refreshes it in the background
+class ExchangeInfoCache:
+    def __init__(self, path: str, ttl: float = 3600, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.clock = clock
+        self.loads = 0
+        self.saves = 0
+
+    # the parts parse_symbols reads, a small fraction of the full answer
+    @staticmethod
+    def slim(exchange_info: dict):
+        return {'symbols': [{'symbol': symbol['symbol'], 'status': symbol.get('status'), 'filters': symbol['filters']}
+                            for symbol in exchange_info['symbols']]}
+
+    # (exchange info, age in seconds), or (None, None) when there is no usable file
+    def load(self):
+        try:
+            with open(self.path) as file:
+                cached = json.load(file)
+        except:
+            return None, None
+        if cached.get('version') != EXCHANGE_CACHE_VERSION:
+            return None, None
+        self.loads += 1
+        return cached['exchange_info'], self.clock() - cached['saved']
+
+    def fresh(self, age: float):
+        return age is not None and age < self.ttl
+
+    def save(self, exchange_info: dict):
+        temporary = f'{self.path}.{os.getpid()}.tmp'
+        with open(temporary, 'w') as file:
+            json.dump({'version': EXCHANGE_CACHE_VERSION, 'saved': self.clock(),
+                       'exchange_info': self.slim(exchange_info)}, file)
+        os.replace(temporary, self.path)
+        self.saves += 1
+
+
+class MarketSnapshot:    # all-symbols 24h ticker, fetched once per ttl instead of once per symbol
+    def __init__(self, ttl: float = 60):
+        self.ttl = ttl
+        self.tickers = {}
+        self.updated = None
+        self.refreshes = 0
+
+    @staticmethod
+    def parse(ticker: dict):
+        return {'quote_volume': Decimal(ticker['quoteVolume']),
+                'price_change_percent': Decimal(ticker['priceChangePercent']),
+                'last_price': Decimal(ticker['lastPrice'])}
+
+    def expired(self, now: int):
+        return self.updated is None or now - self.updated >= self.ttl * 1000
+
+    def update(self, tickers: list, now: int):
+        self.tickers = {ticker['symbol']: self.parse(ticker) for ticker in tickers}
+        self.updated = now
+        self.refreshes += 1
+        return self.tickers
+
+
+class AccountState:     # wallet and margin figures order sizing reads, refreshed per ttl or after our own fills
+    def __init__(self, ttl: float = 30):
+        self.ttl = ttl
+        self.balance = None
+        self.maint_margin = None
+        self.margin_balance = None
+        self.updated = None     # time of the last full account read
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.applied = 0
+        self.ages = deque(maxlen=1000)   # age of the figures handed out, one entry per read
+
+    def expired(self, now: int):
+        return self.updated is None or now - self.updated >= self.ttl * 1000
+
+    def invalidate(self):
+        self.updated = None
+
+    def update(self, account_info: dict, now: int):
+        self.balance = Decimal(account_info['totalWalletBalance'])
+        self.maint_margin = Decimal(account_info['totalMaintMargin'])
+        self.margin_balance = Decimal(account_info['totalMarginBalance'])
+        self.updated = now
+
+    # ACCOUNT_UPDATE balances from the user data stream; maintenance margin keeps its last full read
+    def apply(self, balances: dict, asset: str = 'USDT'):
+        with self.lock:
+            if asset not in balances or self.balance is None:
+                return
+            wallet = balances[asset]['wallet']
+            self.margin_balance += wallet - self.balance
+            self.balance = wallet
+            self.applied += 1
+
+    def margin_ratio(self):
+        return self.maint_margin / self.margin_balance if self.margin_balance else Decimal(1)
+
+    def stats(self, now: int = None):
+        reads = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / reads if reads else 0.0,
+                'applied': self.applied, 'age_ms': now - self.updated if now and self.updated else None,
+                'mean_served_age_ms': sum(self.ages) / len(self.ages) if self.ages else 0.0,
+                'max_served_age_ms': max(self.ages) if self.ages else 0}
 
 
 class Get:
-    def __init__(self, client: Client):
+    def __init__(self, client: 'Client', cache_depth: int = 1000, clock=None, snapshot_ttl: float = 60,
+                 scheduler: RequestScheduler = None, account_ttl: float = 30, archive: KlineArchive = None,
+                 exchange_cache: ExchangeInfoCache = None, backfill_workers: int = 4, resample: dict = None):
         self.client = client
+        self.archive = archive
+        self.exchange_cache = exchange_cache
+        self.refresh_thread = None
+        self.scheduler = scheduler if scheduler else RequestScheduler(client)
+        self.cache = CandleCache(cache_depth)
+        self.clock = clock if clock else lambda: int(time.time() * 1000)
+        self.snapshot = MarketSnapshot(snapshot_ttl)
+        self.account_state = AccountState(account_ttl)
+        self.backfill_workers = backfill_workers     # pages of one deep history fetched at once
+        self.executor = None
+        self.executor_lock = threading.Lock()
+        self.backfill_holes = 0     # bars the exchange has no kline for, inside the requested windows
+        self.resample = RESAMPLE if resample is None else resample
+        self.resamplers = {}    # (symbol, interval) -> Resampler
 
     @staticmethod
-    def __candles_to_df(candles: list):
-        open_time = [int(candle[0]) for candle in candles]
-        close_time = [int(candle[6]) for candle in candles]
-        high_price = [Decimal(candle[2]) for candle in candles]
-        low_price = [Decimal(candle[3]) for candle in candles]
-        open_price = [Decimal(candle[3]) for candle in candles]
-        close_price = [Decimal(candle[4]) for candle in candles]
-        volume = [Decimal(candle[5]) for candle in candles]
-        cash_volume = [Decimal(candle[7]) for candle in candles]
-        trades_number = [int(candle[8]) for candle in candles]
-
-        data = {'open_time': open_time, 'close_time': close_time, 'high': high_price, 'low': low_price,
-                'open': open_price, 'close': close_price, 'volume': volume, 'cash_volume': cash_volume,
-                'trades': trades_number}
-        return pd.DataFrame.from_dict(data)
+    def candles_to_df(candles: list):
+        if not candles:
+            return pd.DataFrame({column: np.empty(0, dtype=dtype) for column, dtype in CANDLE_COLUMNS})
 
-    def symbols(self):
-        symbols = []
-        exchange_info = None
-        while not exchange_info:
-            try:
-                exchange_info = self.client.futures_exchange_info()
-            except:
-                pass
+        raw = np.array([candle[:9] for candle in candles], dtype=object)
+        times = raw[:, [0, 6, 8]].astype(np.int64)
+        prices = raw[:, [2, 3, 1, 4, 5, 7]].astype(np.float64)
+
+        data = {'open_time': times[:, 0], 'close_time': times[:, 1], 'high': prices[:, 0], 'low': prices[:, 1],
+                'open': prices[:, 2], 'close': prices[:, 3], 'volume': prices[:, 4], 'cash_volume': prices[:, 5],
+                'trades': times[:, 2]}
+        return pd.DataFrame(data)
 
+    @staticmethod
+    def parse_symbols(exchange_info: dict):
+        symbols = []
         for symbol in exchange_info['symbols']:
             ticker = str(symbol['symbol'])
             if not ticker.endswith('USDT'):
                 continue
 
-            tick_size = Decimal(symbol['filters'][0]['tickSize'])
-            min_qty = Decimal(symbol['filters'][1]['minQty'])
-            step_size = Decimal(symbol['filters'][1]['stepSize'])
+            filters = {item['filterType']: item for item in symbol['filters']}
+            tick_size = Decimal(filters['PRICE_FILTER']['tickSize'])
+            min_qty = Decimal(filters['LOT_SIZE']['minQty'])
+            step_size = Decimal(filters['LOT_SIZE']['stepSize'])
 
             pair = Symbol(symbol=ticker, price_step=tick_size, lot_step=step_size, min_qty=min_qty)
             symbols.append(pair)
 
         return symbols
 
-    def candles(self, symbol: Symbol, interval: str, end_time=None, limit=1000, to_df=False):
-        klines = []
-        while limit > 1000:
-            try:
-                if not end_time:
-                    last_klines = self.client.futures_klines(symbol=symbol.symbol, interval=interval, limit=1000)
-                else:
-                    last_klines = self.client.futures_klines(symbol=symbol.symbol, interval=interval, endTime=end_time,
-                                                             limit=1000)
-
-                if len(last_klines) < 1000:
-                    limit = len(last_klines)
+    def symbols(self):
+        if self.exchange_cache:
+            exchange_info, age = self.exchange_cache.load()
+            if exchange_info is not None:
+                symbols = self.parse_symbols(exchange_info)
+                if not self.exchange_cache.fresh(age):
+                    self.refresh_thread = threading.Thread(target=self.__refresh_symbols, args=(symbols,),
+                                                           daemon=True)
+                    self.refresh_thread.start()
+                return symbols
+        exchange_info = self.scheduler.call('futures_exchange_info', attempts=0)
+        if self.exchange_cache:
+            self.exchange_cache.save(exchange_info)
+        return self.parse_symbols(exchange_info)
+
+    # changed filters reach symbols that are not in trade; new listings wait for the next start
+    def __refresh_symbols(self, symbols: list):
+        try:
+            exchange_info = self.scheduler.call('futures_exchange_info')
+            self.exchange_cache.save(exchange_info)
+        except:
+            return
+        fresh = {symbol.symbol: symbol for symbol in self.parse_symbols(exchange_info)}
+        for symbol in symbols:
+            new = fresh.get(symbol.symbol)
+            if not new or symbol.in_trade:
+                continue
+            if (new.price_step, new.lot_step, new.min_qty) != (symbol.price_step, symbol.lot_step, symbol.min_qty):
+                symbol.set_filters(new.price_step, new.lot_step, new.min_qty)
+
+    def __cached_candles(self, symbol: Symbol, interval: str, limit: int):
+        if self.archive and not self.cache.klines(symbol.symbol, interval):    # restart: warm up from disk
+            archived = self.archive.last(symbol.symbol, interval, self.cache.depth)
+            if len(archived['open_time']):
+                self.cache.update(symbol.symbol, interval, KlineArchive.to_klines(archived))
+
+        now = self.clock()
+        params = self.cache.request(symbol.symbol, interval, now)
+        try:
+            klines = self.scheduler.call('futures_klines', symbol=symbol.symbol, interval=interval, **params)
+        except:
+            return None
+
+        self.cache.update(symbol.symbol, interval, klines)
+        if self.archive:
+            self.archive.write(symbol.symbol, interval, [kline for kline in klines if int(kline[6]) < now])
+        return self.cache.last(symbol.symbol, interval, limit)
+
+    # fetches closed bars of the (first, last) open time ranges into the archive, returns how many were stored
+    def __fill(self, symbol: Symbol, interval: str, ranges: list, now: int):
+        step = INTERVALS[interval]
+        stored = 0
+        for start, end in ranges:
+            while start <= end:
+                try:
+                    klines = self.scheduler.call('futures_klines', symbol=symbol.symbol, interval=interval,
+                                                 startTime=start, endTime=end + step - 1, limit=1000)
+                except:
+                    return None
+                klines = [kline for kline in klines if int(kline[6]) < now]
+                if not klines:
+                    self.archive.mark_hole(symbol.symbol, interval, start, end)
                     break
+                if int(klines[0][0]) > start:   # not listed yet or a maintenance window
+                    self.archive.mark_hole(symbol.symbol, interval, start, int(klines[0][0]) - step)
+                stored += self.archive.write(symbol.symbol, interval, klines)
+                start = int(klines[-1][0]) + step
+        return stored
+
+    def repair(self, symbol: Symbol, interval: str):
+        return self.__fill(symbol, interval, self.archive.gaps(symbol.symbol, interval), self.clock())
 
-                end_time = int(last_klines[0][0]) - 1
-                limit -= 1000
-                last_klines.extend(klines)
-                klines = last_klines.copy()
+    # closed bars come from the archive, only its missing ranges and the still-open bar are fetched
+    def __archived_candles(self, symbol: Symbol, interval: str, end_time: int, limit: int, to_df: bool):
+        step = INTERVALS[interval]
+        now = self.clock()
+        current = now // step * step
+        last_open = min(end_time // step * step, current) if end_time else current
+        first_open = last_open - (limit - 1) * step
+        last_closed = min(last_open, current - step)
+
+        if self.__fill(symbol, interval, self.archive.missing(symbol.symbol, interval, first_open, last_closed),
+                       now) is None:
+            return None
+
+        columns = self.archive.read(symbol.symbol, interval, first_open, last_closed)
+        open_bar = []
+        if last_open == current:
+            try:
+                open_bar = self.scheduler.call('futures_klines', symbol=symbol.symbol, interval=interval,
+                                               startTime=current, limit=1)
             except:
-                return [] if to_df else pd.DataFrame()
+                open_bar = []
+        if to_df:
+            frame = pd.DataFrame({column: np.array(values) for column, values in columns.items()})
+            return pd.concat([frame, self.candles_to_df(open_bar)], ignore_index=True) if open_bar else frame
+        return KlineArchive.to_klines(columns) + open_bar
+
+    # every page window follows from the interval, so the pages are fetched side by side through the scheduler and
+    # each one lands in its own slots of one buffer; bars the exchange does not have leave their slots empty
+    # instead of ending the history
+    def __backfill(self, symbol: Symbol, interval: str, end_time: int, limit: int, page: int = 1000):
+        if interval not in INTERVALS:     # no fixed length to lay the pages out by, one page only
+            try:
+                return self.scheduler.call('futures_klines', symbol=symbol.symbol, interval=interval,
+                                           limit=min(limit, page), **({'endTime': end_time} if end_time else {}))
+            except:
+                return None
+        step = INTERVALS[interval]
+        current = self.clock() // step * step
+        last_open = min(end_time // step * step, current) if end_time else current
+        first_open = last_open - (limit - 1) * step
+        windows = [(start, min(start + (page - 1) * step, last_open))
+                   for start in range(first_open, last_open + 1, page * step)]
+        buffer = [None] * limit
+
+        def fetch(window: tuple):
+            start, end = window
+            for kline in self.scheduler.call('futures_klines', symbol=symbol.symbol, interval=interval,
+                                             startTime=start, endTime=end + step - 1, limit=page):
+                offset, remainder = divmod(int(kline[0]) - first_open, step)
+                if not remainder and 0 <= offset < limit:
+                    buffer[offset] = kline
 
-        limit = max(limit, 10)
         try:
-            if not end_time:
-                last_klines = self.client.futures_klines(symbol=symbol, interval=interval, limit=limit)
+            if len(windows) == 1 or self.backfill_workers <= 1:
+                for window in windows:
+                    fetch(window)
             else:
-                last_klines = self.client.futures_klines(symbol=symbol, interval=interval, endTime=end_time, limit=limit)
-            last_klines.extend(klines)
-            klines = last_klines.copy()
+                with self.executor_lock:
+                    if self.executor is None:
+                        self.executor = ThreadPoolExecutor(self.backfill_workers, thread_name_prefix='backfill')
+                list(self.executor.map(fetch, windows))
         except:
-            return [] if to_df else pd.DataFrame()
+            return None
+        klines = [kline for kline in buffer if kline is not None]
+        self.backfill_holes += limit - len(klines)
+        return klines
 
+    # the first read folds a deep lower history once, later ones only the lower bars closed since; a read deeper than
+    # every earlier one folds the history again from that far back
+    def __resampled_candles(self, symbol: Symbol, interval: str, limit: int):
+        key = (symbol.symbol, interval)
+        resampler = self.resamplers.get(key)
+        if resampler is None:
+            resampler = self.resamplers.setdefault(key, Resampler(self.resample[interval], interval,
+                                                                  self.cache.depth))
+        now = self.clock()
+        with resampler.lock:
+            ratio = resampler.step // resampler.source_step
+            if resampler.last_open is None or limit > resampler.limit:
+                resampler.reset()
+                resampler.limit = limit
+                missing = (limit + 1) * ratio
+            else:
+                missing = (now - resampler.last_open) // resampler.source_step + 1
+            klines = self.candles(symbol, resampler.source, limit=missing)
+            if not klines:
+                return None
+            open_kline = klines[-1] if int(klines[-1][6]) >= now else None
+            resampler.extend(klines[:-1] if open_kline else klines)
+            return resampler.klines(open_kline, limit)
+
+    @METRICS.timed('get_seconds', call='candles')
+    def candles(self, symbol: Symbol, interval: str, end_time=None, limit=1000, to_df=False):
+        if not end_time and limit <= self.cache.depth and interval in self.resample:
+            klines = self.__resampled_candles(symbol, interval, limit)
+            if klines is None:
+                return pd.DataFrame() if to_df else []
+            return self.candles_to_df(klines) if to_df else klines
+
+        if not end_time and limit <= self.cache.depth and interval in INTERVALS:
+            klines = self.__cached_candles(symbol, interval, max(limit, 10))
+            if klines is None:
+                return pd.DataFrame() if to_df else []
+            if to_df:
+                return self.candles_to_df(klines)
+            return klines
+
+        if self.archive and interval in INTERVALS:
+            candles = self.__archived_candles(symbol, interval, end_time, max(limit, 10), to_df)
+            if candles is None:
+                return pd.DataFrame() if to_df else []
+            return candles
+
+        klines = self.__backfill(symbol, interval, end_time, max(limit, 10))
+        if klines is None:
+            return pd.DataFrame() if to_df else []
         if to_df:
-            return self.__candles_to_df(klines)
+            return self.candles_to_df(klines)
         return klines
 
-    def volume(self, symbol: Symbol):
-        volume = None
-        while not volume:
+    def market(self):
+        if self.snapshot.expired(self.clock()):
             try:
-                ticker = self.client.futures_symbol_ticker(symbol=symbol.symbol)
-                volume = Decimal(ticker['quoteVolume'])
+                self.snapshot.update(self.scheduler.call('futures_ticker'), self.clock())
             except:
                 pass
-        return volume
+        return self.snapshot.tickers
+
+    # returns the cached AccountState, None when it could not be read
+    def account(self):
+        state = self.account_state
+        with state.lock:
+            now = self.clock()
+            if state.expired(now):
+                try:
+                    state.update(self.scheduler.call('futures_account_information'), now)
+                except:
+                    return None
+                state.misses += 1
+            else:
+                state.hits += 1
+            state.ages.append(now - state.updated)
+        return state
 
+    def ticker(self, symbol: Symbol):
+        ticker = self.market().get(symbol.symbol)
+        if not ticker:     # listed after the last snapshot
+            try:
+                ticker = MarketSnapshot.parse(self.scheduler.call('futures_ticker', symbol=symbol.symbol))
+            except:
+                return None
+        return ticker
+
+    @METRICS.timed('get_seconds', call='volume')
+    def volume(self, symbol: Symbol):
+        ticker = self.ticker(symbol)
+        return ticker['quote_volume'] if ticker else Decimal(0)
+
+    @METRICS.timed('get_seconds', call='volatility')
     def volatility(self, symbol: Symbol):
-        volatility = None
-        while not volatility:
+        ticker = self.ticker(symbol)
+        return ticker['price_change_percent'] if ticker else Decimal(0)
+
+    # a local book kept from the depth stream; plain REST reads have none
+    def order_book(self, symbol: Symbol):
+        return None
+
+    def price(self, symbol: Symbol, trend='LONG'):
+        try:
+            order_book = self.scheduler.call('futures_order_book', symbol=symbol.symbol, limit=5)
+        except:
+            return None
+
+        if trend == 'LONG':
+            price = Decimal(order_book['asks'][0][0])
+        else:
+            price = Decimal(order_book['bids'][0][0])
+        return price
+
+
+class AsyncGet:
+    def __init__(self, client: 'AsyncClient', budget: WeightBudget = None, cache: CandleCache = None, clock=None,
+                 retry_delay: float = 0.5, snapshot: MarketSnapshot = None):
+        self.client = client
+        self.budget = budget if budget else WeightBudget()
+        self.cache = cache if cache else CandleCache()
+        self.clock = clock if clock else lambda: int(time.time() * 1000)
+        self.retry_delay = retry_delay
+        self.snapshot = snapshot if snapshot else MarketSnapshot()
+        self.__refresh = None
+
+    async def request(self, method: str, **params):
+        queued = time.perf_counter()
+        await self.budget.acquire(request_weight(method, **params))
+        started = time.perf_counter()
+        METRICS.observe('rest_wait_seconds', started - queued, method=method)
+        try:
+            return await getattr(self.client, method)(**params)
+        except Exception as error:
+            METRICS.count('rest_errors_total', method=method, code=getattr(error, 'code', type(error).__name__))
+            raise
+        finally:
+            METRICS.observe('rest_request_seconds', time.perf_counter() - started, method=method)
+
+    async def symbols(self):
+        exchange_info = None
+        while not exchange_info:
             try:
-                ticker = self.client.futures_symbol_ticker(symbol=symbol.symbol)
-                volatility = Decimal(ticker['priceChangePercent'])
+                exchange_info = await self.request('futures_exchange_info')
+            except:
+                METRICS.count('rest_retries_total', method='futures_exchange_info')
+                await asyncio.sleep(self.retry_delay)
+        return Get.parse_symbols(exchange_info)
+
+    @METRICS.timed('get_seconds', call='async_candles')
+    async def candles(self, symbol: Symbol, interval: str, end_time=None, limit=1000, to_df=False):
+        cached = not end_time and limit <= self.cache.depth and interval in INTERVALS
+        try:
+            if cached:
+                params = self.cache.request(symbol.symbol, interval, self.clock())
+                klines = await self.request('futures_klines', symbol=symbol.symbol, interval=interval, **params)
+            else:
+                klines = await self.__backfill(symbol, interval, end_time, max(limit, 10))
+        except:
+            return pd.DataFrame() if to_df else []
+
+        if cached:
+            self.cache.update(symbol.symbol, interval, klines)
+            klines = self.cache.last(symbol.symbol, interval, max(limit, 10))
+        if to_df:
+            return Get.candles_to_df(klines)
+        return klines
+
+    # Get's fixed windows of page bars, requested together under the weight budget
+    async def __backfill(self, symbol: Symbol, interval: str, end_time: int, limit: int, page: int = 1000):
+        if interval not in INTERVALS:     # no fixed length to lay the pages out by, one page only
+            return await self.request('futures_klines', symbol=symbol.symbol, interval=interval,
+                                      limit=min(limit, page), **({'endTime': end_time} if end_time else {}))
+        step = INTERVALS[interval]
+        current = self.clock() // step * step
+        last_open = min(end_time // step * step, current) if end_time else current
+        first_open = last_open - (limit - 1) * step
+        windows = [(start, min(start + (page - 1) * step, last_open))
+                   for start in range(first_open, last_open + 1, page * step)]
+        pages = await asyncio.gather(*[self.request('futures_klines', symbol=symbol.symbol, interval=interval,
+                                                    startTime=start, endTime=end + step - 1, limit=page)
+                                       for start, end in windows])
+        buffer = [None] * limit
+        for klines in pages:
+            for kline in klines:
+                offset, remainder = divmod(int(kline[0]) - first_open, step)
+                if not remainder and 0 <= offset < limit:
+                    buffer[offset] = kline
+        return [kline for kline in buffer if kline is not None]
+
+    async def market(self):
+        if self.snapshot.expired(self.clock()):
+            if not self.__refresh:      # concurrent scans share one in-flight refresh
+                self.__refresh = asyncio.ensure_future(self.request('futures_ticker'))
+            refresh = self.__refresh
+            try:
+                tickers = await refresh
+                if self.snapshot.expired(self.clock()):
+                    self.snapshot.update(tickers, self.clock())
             except:
                 pass
-        return volatility
+            finally:
+                if self.__refresh is refresh:
+                    self.__refresh = None
+        return self.snapshot.tickers
+
+    # as Get.ticker: None when the symbol is not in the snapshot and cannot be read on its own either
+    async def ticker(self, symbol: Symbol):
+        ticker = (await self.market()).get(symbol.symbol)
+        if not ticker:     # listed after the last snapshot
+            try:
+                ticker = MarketSnapshot.parse(await self.request('futures_ticker', symbol=symbol.symbol))
+            except:
+                return None
+        return ticker
+
+    @METRICS.timed('get_seconds', call='async_volume')
+    async def volume(self, symbol: Symbol):
+        ticker = await self.ticker(symbol)
+        return ticker['quote_volume'] if ticker else Decimal(0)
 
+    @METRICS.timed('get_seconds', call='async_volatility')
+    async def volatility(self, symbol: Symbol):
+        ticker = await self.ticker(symbol)
+        return ticker['price_change_percent'] if ticker else Decimal(0)
 
+    async def price(self, symbol: Symbol, trend='LONG'):
+        try:
+            order_book = await self.request('futures_order_book', symbol=symbol.symbol, limit=5)
+        except:
+            return None
+        return Decimal(order_book['asks'][0][0] if trend == 'LONG' else order_book['bids'][0][0])
@@ -0,0 +1,213 @@
+from metrics import METRICS
+from collections import deque
+from typing import TYPE_CHECKING
+import numpy as np
+import math
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+nan = float('nan')
+
+
+# every indicator takes one value per bar; commit=False evaluates the still-open bar without changing the state
+class EMA:
+    def __init__(self, period: int = None, alpha: float = None):
+        self.alpha = alpha if alpha else 2 / (period + 1)
+        self.value = nan
+
+    def update(self, x: float, commit: bool = True):
+        if math.isnan(x):
+            return self.value
+        if math.isnan(self.value):
+            value = x
+        else:
+            value = (1 - self.alpha) * self.value + self.alpha * x
+        if commit:
+            self.value = value
+        return value
+
+
+class RSI:     # Wilder averages seeded with the first delta, as finta RSI(adjust=False)
+    def __init__(self, period: int = 14):
+        self.gain = EMA(alpha=1 / period)
+        self.loss = EMA(alpha=1 / period)
+        self.last = nan
+
+    def update(self, x: float, commit: bool = True):
+        delta = x - self.last
+        if commit:
+            self.last = x
+        if math.isnan(delta):
+            return nan
+        gain = self.gain.update(max(delta, 0.0), commit)
+        loss = self.loss.update(max(-delta, 0.0), commit)
+        if loss == 0:
+            return nan if gain == 0 else 100.0
+        return 100 - 100 / (1 + gain / loss)
+
+
+class SMA:
+    def __init__(self, period: int):
+        self.period = period
+        self.window = deque(maxlen=period - 1)
+
+    def update(self, x: float, commit: bool = True):
+        if len(self.window) < self.period - 1:
+            value = nan
+        else:
+            value = (sum(self.window) + x) / self.period
+        if commit and self.period > 1:
+            self.window.append(x)
+        return value
+
+
+class RollingMinMax:   # monotonic queues of (index, value), amortised O(1) per bar
+    def __init__(self, period: int):
+        self.period = period
+        self.count = 0
+        self.nans = deque()
+        self.lows = deque()
+        self.highs = deque()
+
+    def update(self, x: float, commit: bool = True):
+        if self.count + 1 < self.period or math.isnan(x) or self.nans:
+            result = (nan, nan)
+        else:
+            low = min(self.lows[0][1], x) if self.lows else x
+            high = max(self.highs[0][1], x) if self.highs else x
+            result = (low, high)
+
+        if commit:
+            if math.isnan(x):
+                self.nans.append(self.count)
+            else:
+                while self.lows and self.lows[-1][1] >= x:
+                    self.lows.pop()
+                self.lows.append((self.count, x))
+                while self.highs and self.highs[-1][1] <= x:
+                    self.highs.pop()
+                self.highs.append((self.count, x))
+            self.count += 1
+
+            start = self.count - self.period + 1
+            while self.nans and self.nans[0] < start:
+                self.nans.popleft()
+            while self.lows and self.lows[0][0] < start:
+                self.lows.popleft()
+            while self.highs and self.highs[0][0] < start:
+                self.highs.popleft()
+        return result
+
+
+class StochRSI:
+    def __init__(self, length: int = 14, smooth_k: int = 3, smooth_d: int = 3):
+        self.rsi = RSI(length)
+        self.range = RollingMinMax(length)
+        self.k = SMA(smooth_k)
+        self.d = SMA(smooth_d)
+
+    def update(self, x: float, commit: bool = True):
+        rsi = self.rsi.update(x, commit)
+        low, high = self.range.update(rsi, commit)
+        stoch = (rsi - low) / (high - low) * 100 if high != low else nan
+        k = self.k.update(stoch, commit)
+        d = self.d.update(k, commit)
+        return k, d
+
+
+class Indicators:
+    def __init__(self, fast_length: int = 38, slow_length: int = 62, stoch_length: int = 14):
+        self.fast_length = fast_length
+        self.slow_length = slow_length
+        self.stoch_length = stoch_length
+        self.reset()
+
+    def reset(self):
+        self.fast = EMA(self.fast_length)
+        self.slow = EMA(self.slow_length)
+        self.stoch = StochRSI(self.stoch_length)
+        self.open_time = None   # open time of the last committed (closed) bar
+        self.last_close = nan
+        self.values = {}
+
+    def __bar(self, close: float, commit: bool):
+        fast = self.fast.update(close, commit)
+        slow = self.slow.update(close, commit)
+        k, d = self.stoch.update(close, commit)
+        return fast - slow, k, d
+
+    def bar(self, open_time: int, close: float, closed: bool):
+        if closed:
+            if self.open_time is not None and open_time <= self.open_time:
+                return self.values
+            self.__bar(close, True)
+            self.open_time = open_time
+            self.last_close = close
+            return self.values
+
+        trend, k, d = self.__bar(close, False)
+        self.values = {'open_time': open_time, 'close': close, 'trend': trend, 'slow_ema': self.slow.value,
+                       'last_close': self.last_close, 'k': k, 'd': d}
+        return self.values
+
+    # the last candle is the still-open bar, every other one is closed
+    @METRICS.timed('indicator_seconds', indicator='incremental')
+    def update(self, candles: 'pd.DataFrame'):
+        open_times = candles['open_time'].to_numpy()
+        closes = candles['close'].to_numpy(dtype=np.float64)
+        if self.open_time is not None and not open_times[0] <= self.open_time < open_times[-1]:
+            self.reset()
+
+        start = 0 if self.open_time is None else int(np.searchsorted(open_times, self.open_time, side='right'))
+        for open_time, close in zip(open_times[start:-1].tolist(), closes[start:-1].tolist()):
+            self.bar(open_time, close, True)
+        return self.bar(int(open_times[-1]), float(closes[-1]), False)
+
+
+# (symbols x bars) variants: one pass along the time axis, vectorised across symbols
+def ema_matrix(x: np.ndarray, period: int = None, alpha: float = None):
+    alpha = alpha if alpha else 2 / (period + 1)
+    columns = np.ascontiguousarray(x.T)
+    out = np.empty_like(columns)
+    out[0] = columns[0]
+    for t in range(1, columns.shape[0]):
+        out[t] = (1 - alpha) * out[t - 1] + alpha * columns[t]
+    return out.T
+
+
+def rsi_matrix(closes: np.ndarray, period: int = 14):
+    delta = np.diff(closes, axis=1)
+    gain = ema_matrix(np.maximum(delta, 0.0), alpha=1 / period)
+    loss = ema_matrix(np.maximum(-delta, 0.0), alpha=1 / period)
+    rsi = np.full(closes.shape, nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsi[:, 1:] = 100 - 100 / (1 + gain / loss)
+    return rsi
+
+
+def rolling_matrix(x: np.ndarray, period: int, reduce):
+    out = np.full(x.shape, nan)
+    if x.shape[1] >= period:
+        out[:, period - 1:] = reduce(np.lib.stride_tricks.sliding_window_view(x, period, axis=1), axis=-1)
+    return out
+
+
+def stoch_rsi_matrix(closes: np.ndarray, length: int = 14, smooth_k: int = 3, smooth_d: int = 3):
+    rsi = rsi_matrix(closes, length)
+    low = rolling_matrix(rsi, length, np.min)
+    high = rolling_matrix(rsi, length, np.max)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stoch = (rsi - low) / (high - low) * 100
+    k = rolling_matrix(stoch, smooth_k, np.mean)
+    d = rolling_matrix(k, smooth_d, np.mean)
+    return k, d
+
+
+@METRICS.timed('indicator_seconds', indicator='matrix')
+def matrix_values(closes: np.ndarray, fast_length: int = 38, slow_length: int = 62, stoch_length: int = 14):
+    fast = ema_matrix(closes, fast_length)
+    slow = ema_matrix(closes, slow_length)
+    k, d = stoch_rsi_matrix(closes, stoch_length)
+    return {'close': closes[:, -1], 'trend': fast[:, -1] - slow[:, -1], 'slow_ema': slow[:, -2],
+            'last_close': closes[:, -2], 'k': k[:, -1], 'd': d[:, -1]}
@@ -0,0 +1,133 @@
+from symbol import TradeData
+
+from datetime import datetime
+from decimal import *
+import json
+import sqlite3
+import threading
+import time
+
+
+# every event carries the full trade state after it, so restoring is reading the last state of every symbol;
+# snapshot() folds the log into one row per symbol
+class TradeJournal:
+    def __init__(self, path: str, snapshot_every: int = 1000):
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=FULL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY, time REAL, symbol TEXT, '
+                                'kind TEXT, state TEXT)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS trades (id INTEGER PRIMARY KEY, symbol TEXT, '
+                                'statistics TEXT)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS snapshot (symbol TEXT PRIMARY KEY, state TEXT, '
+                                'event INTEGER)')
+        self.events = self.connection.execute('SELECT COUNT(*) FROM events').fetchone()[0]
+        self.snapshots = 0
+
+    @staticmethod
+    def __encode(value):
+        if isinstance(value, Decimal):
+            return {'d': str(value)}
+        if isinstance(value, datetime):
+            return {'t': value.isoformat()}
+        return value
+
+    @staticmethod
+    def __decode(value):
+        if isinstance(value, dict) and 'd' in value:
+            return Decimal(value['d'])
+        if isinstance(value, dict) and 't' in value:
+            return datetime.fromisoformat(value['t'])
+        return value
+
+    def dumps(self, trade_data: TradeData):
+        if trade_data is None:
+            return None
+        names = [name for cls in type(trade_data).__mro__ for name in getattr(cls, '__slots__', ())]
+        return json.dumps({name: self.__encode(getattr(trade_data, name)) for name in names
+                           if name != 'clock' and hasattr(trade_data, name)})
+
+    def loads(self, state: str, clock=datetime.now):
+        trade_data = TradeData.__new__(TradeData)
+        for name, value in json.loads(state).items():
+            setattr(trade_data, 'take_profit_price' if name == 'rake_profit_price' else name, self.__decode(value))
+        trade_data.clock = clock
+        return trade_data
+
+    def record(self, symbol: str, kind: str, trade_data: TradeData = None, statistics: dict = None):
+        with self.lock:
+            connection = self.connection
+            connection.execute('BEGIN')
+            try:
+                connection.execute('INSERT INTO events (time, symbol, kind, state) VALUES (?, ?, ?, ?)',
+                                   (time.time(), symbol, kind, self.dumps(trade_data)))
+                if statistics:      # closed trades outlive the compaction of the event log
+                    connection.execute('INSERT INTO trades (symbol, statistics) VALUES (?, ?)',
+                                       (symbol, json.dumps({name: self.__encode(value)
+                                                            for name, value in statistics.items()})))
+                connection.execute('COMMIT')
+            except:
+                self.__rollback()
+                raise
+            self.events += 1
+            if self.snapshot_every and self.events >= self.snapshot_every:
+                self.__snapshot()
+
+    def __snapshot(self):
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            last = connection.execute('SELECT MAX(id) FROM events').fetchone()[0]
+            if last is not None:
+                connection.execute('INSERT OR REPLACE INTO snapshot (symbol, state, event) '
+                                   'SELECT symbol, state, id FROM events WHERE id IN '
+                                   '(SELECT MAX(id) FROM events GROUP BY symbol)')
+                connection.execute('DELETE FROM snapshot WHERE state IS NULL')
+                connection.execute('DELETE FROM events WHERE id <= ?', (last,))
+            connection.execute('COMMIT')
+        except:
+            self.__rollback()
+            raise
+        self.events = 0
+        self.snapshots += 1
+
+    # a failed statement may have ended the transaction already, a second error would hide the first
+    def __rollback(self):
+        if self.connection.in_transaction:
+            self.connection.execute('ROLLBACK')
+
+    def snapshot(self):
+        with self.lock:
+            self.__snapshot()
+
+    # symbol -> last trade state, None for symbols whose last event closed the trade
+    def states(self):
+        with self.lock:
+            rows = self.connection.execute('SELECT symbol, state FROM snapshot').fetchall()
+            rows += self.connection.execute('SELECT symbol, state FROM events WHERE id IN '
+                                            '(SELECT MAX(id) FROM events GROUP BY symbol) ORDER BY id').fetchall()
+        return dict(rows)
+
+    def restore(self, symbols: list):
+        states = self.states()
+        restored = []
+        for symbol in symbols:
+            state = states.get(symbol.symbol)
+            if state:
+                symbol.trade_data = self.loads(state, symbol.clock)
+                symbol.in_trade = True
+                restored.append(symbol)
+        return restored
+
+    def closed_trades(self):
+        with self.lock:
+            rows = self.connection.execute('SELECT symbol, statistics FROM trades ORDER BY id').fetchall()
+        return [dict({name: self.__decode(value) for name, value in json.loads(statistics).items()}, symbol=symbol)
+                for symbol, statistics in rows]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,26 @@
+import importlib
+import sys
+import threading
+
+
+# a module imported on first attribute access, for heavy dependencies that are not needed to start the bot
+class LazyModule:
+    def __init__(self, name: str):
+        self.__dict__['_lazy_name'] = name
+        self.__dict__['_lazy_lock'] = threading.Lock()
+
+    def __getattr__(self, attribute: str):
+        with self._lazy_lock:
+            module = importlib.import_module(self._lazy_name)
+            self.__dict__.update(vars(module))     # later lookups no longer come through here
+        return getattr(module, attribute)
+
+    def loaded(self):
+        return self._lazy_name in sys.modules
+
+
+# binance.exceptions is only looked at once something imported it; an error from a client that never loaded the
+# binance package cannot be a BinanceAPIException
+def api_error(error: BaseException):
+    exceptions = sys.modules.get('binance.exceptions')
+    return exceptions is not None and isinstance(error, exceptions.BinanceAPIException)
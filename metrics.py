@@ -0,0 +1,215 @@
+from bisect import bisect_left
+import functools
+import inspect
+import threading
+import time
+
+NAMESPACE = 'slingshot'
+
+# upper bounds in seconds, from a cached candle read to a slow order round trip
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'count', 'sum', 'max', 'lock')
+
+    def __init__(self, bounds: tuple = BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)     # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    # interpolated inside the bucket like prometheus histogram_quantile, capped by the largest value seen
+    def quantile(self, q: float):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                low = self.bounds[i - 1] if i else 0.0
+                high = self.bounds[i] if i < len(self.bounds) else self.max
+                return min(low + (high - low) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+    def stats(self):
+        return {'count': self.count, 'sum': self.sum, 'mean': self.sum / self.count if self.count else 0.0,
+                'p50': self.quantile(0.5), 'p99': self.quantile(0.99), 'max': self.max}
+
+
+def _labels(labels: dict):
+    return tuple(sorted(labels.items()))
+
+
+def _format(labels: tuple, extra: str = ''):
+    parts = [f'{name}="{value}"' for name, value in labels]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+# histograms and counters keyed by name and labels; the instrumented code resolves its histogram once where it can,
+# so a timed call costs two clock reads, a bisect and an uncontended lock
+class Metrics:
+    def __init__(self, enabled: bool = True, clock=time.perf_counter):
+        self.enabled = enabled
+        self.clock = clock
+        self.histograms = {}    # (name, labels) -> Histogram
+        self.counters = {}      # (name, labels) -> value
+        self.lock = threading.Lock()
+
+    def histogram(self, name: str, **labels):
+        key = (name, _labels(labels))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(key, Histogram())
+        return histogram
+
+    def observe(self, name: str, value: float, **labels):
+        if self.enabled:
+            self.histogram(name, **labels).observe(value)
+
+    def count(self, name: str, value: int = 1, **labels):
+        if self.enabled:
+            key = (name, _labels(labels))
+            with self.lock:
+                self.counters[key] = self.counters.get(key, 0) + value
+
+    # decorator recording the run time of every call, coroutine functions included
+    def timed(self, name: str, **labels):
+        def decorator(func):
+            histogram = self.histogram(name, **labels)
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    if not self.enabled:
+                        return await func(*args, **kwargs)
+                    started = self.clock()
+                    try:
+                        return await func(*args, **kwargs)
+                    finally:
+                        histogram.observe(self.clock() - started)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                started = self.clock()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    histogram.observe(self.clock() - started)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        with self.lock:
+            for histogram in self.histograms.values():
+                histogram.__init__(histogram.bounds)
+            self.counters.clear()
+
+    # name -> list of label dicts with their figures, for the bot itself and for benchmarks
+    def stats(self):
+        result = {}
+        with self.lock:
+            histograms = list(self.histograms.items())
+            counters = list(self.counters.items())
+        for (name, labels), histogram in histograms:
+            if histogram.count:
+                result.setdefault(name, []).append(dict(histogram.stats(), labels=dict(labels)))
+        for (name, labels), value in counters:
+            result.setdefault(name, []).append({'value': value, 'labels': dict(labels)})
+        return result
+
+    # prometheus text exposition format 0.0.4
+    def render(self):
+        with self.lock:
+            histograms = sorted(self.histograms.items(), key=lambda item: (item[0][0], str(item[0][1])))
+            counters = sorted(self.counters.items(), key=lambda item: (item[0][0], str(item[0][1])))
+        lines = []
+        last = None
+        for (name, labels), histogram in histograms:
+            if not histogram.count:
+                continue
+            name = f'{NAMESPACE}_{name}'
+            if name != last:
+                lines.append(f'# TYPE {name} histogram')
+                last = name
+            with histogram.lock:
+                counts, total, count = list(histogram.counts), histogram.sum, histogram.count
+            cumulative = 0
+            for bound, bucket in zip(histogram.bounds + ('+Inf',), counts):
+                cumulative += bucket
+                le = 'le="%s"' % bound
+                lines.append(f'{name}_bucket{_format(labels, le)} {cumulative}')
+            lines.append(f'{name}_sum{_format(labels)} {total!r}')
+            lines.append(f'{name}_count{_format(labels)} {count}')
+        for (name, labels), value in counters:
+            name = f'{NAMESPACE}_{name}'
+            if name != last:
+                lines.append(f'# TYPE {name} counter')
+                last = name
+            lines.append(f'{name}{_format(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = Metrics()     # the process wide registry every module records into
+
+
+class MetricsServer:    # GET /metrics on a local port for a prometheus scraper
+    def __init__(self, metrics: Metrics = METRICS, host: str = '127.0.0.1', port: int = 9108):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.port}/metrics'
+
+    def start(self):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer     # only a scraped bot pays for it
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]   # port 0 picks a free one
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -0,0 +1,142 @@
+from bisect import bisect_left, insort
+from collections import deque
+from decimal import *
+import threading
+
+
+# one symbol's book from a futures_order_book snapshot and the <symbol>@depth diff stream. Binance futures rules:
+# events older than the snapshot are dropped, the first one applied spans the snapshot's lastUpdateId and every
+# later one names the previous one in pu; anything else means events were missed and the book waits for a new
+# snapshot, buffering meanwhile
+class OrderBook:
+    def __init__(self, symbol: str, buffer: int = 1000):
+        self.symbol = symbol
+        self.bids = {}      # price -> quantity
+        self.asks = {}
+        self.bid_prices = []    # ascending, best bid last
+        self.ask_prices = []    # ascending, best ask first
+        self.last_update_id = None     # None until a snapshot is loaded
+        self.synced = False
+        self.buffer = deque(maxlen=buffer)
+        self.lock = threading.Lock()
+        self.updates = 0
+        self.dropped = 0
+        self.resyncs = 0
+        self.snapshots = 0
+
+    @staticmethod
+    def __set(levels: dict, prices: list, changes: list):
+        for price, quantity in changes:
+            price, quantity = Decimal(price), Decimal(quantity)
+            if not quantity:
+                if levels.pop(price, None) is not None:
+                    del prices[bisect_left(prices, price)]
+            else:
+                if price not in levels:
+                    insort(prices, price)
+                levels[price] = quantity
+
+    def __clear(self):
+        self.bids, self.asks, self.bid_prices, self.ask_prices = {}, {}, [], []
+        self.last_update_id = None
+        self.synced = False
+        self.resyncs += 1
+
+    def reset(self):
+        with self.lock:
+            self.__clear()
+
+    # False when the book needs a snapshot before it can go on
+    def __apply(self, event: dict):
+        if self.last_update_id is None:
+            self.buffer.append(event)
+            return False
+        first, last = int(event['U']), int(event['u'])
+        if last < self.last_update_id:
+            self.dropped += 1
+            return True
+        if not self.synced:
+            if first > self.last_update_id:    # futures: the first event spans the snapshot, U <= lastUpdateId <= u
+                self.__clear()
+                self.buffer.append(event)
+                return False
+            self.synced = True
+        elif int(event['pu']) != self.last_update_id:
+            self.__clear()
+            self.buffer.append(event)
+            return False
+        self.__set(self.bids, self.bid_prices, event['b'])
+        self.__set(self.asks, self.ask_prices, event['a'])
+        self.last_update_id = last
+        self.updates += 1
+        return True
+
+    def apply(self, event: dict):
+        with self.lock:
+            return self.__apply(event)
+
+    # the buffered events are replayed on top; False when they do not connect to the snapshot
+    def load(self, snapshot: dict):
+        with self.lock:
+            self.bids, self.asks, self.bid_prices, self.ask_prices = {}, {}, [], []
+            self.__set(self.bids, self.bid_prices, snapshot['bids'])
+            self.__set(self.asks, self.ask_prices, snapshot['asks'])
+            self.last_update_id = int(snapshot['lastUpdateId'])
+            self.synced = False
+            self.snapshots += 1
+            buffered = list(self.buffer)
+            self.buffer.clear()
+            for event in buffered:
+                if not self.__apply(event):
+                    return False
+            return True
+
+    def best_bid(self):
+        prices = self.bid_prices
+        return prices[-1] if prices else None
+
+    def best_ask(self):
+        prices = self.ask_prices
+        return prices[0] if prices else None
+
+    # walk of the side a market order takes from, level by level until quote (or qty) is filled or the next level
+    # lies further than max_slippage from the best price; the average price is what the order would pay
+    def fill(self, side: str, quote: Decimal = None, qty: Decimal = None, max_slippage: Decimal = None):
+        with self.lock:
+            if side == 'BUY':
+                levels, prices = self.asks, self.ask_prices
+            else:
+                levels, prices = self.bids, reversed(self.bid_prices)
+            best = None
+            filled_qty = filled_quote = Decimal(0)
+            count = 0
+            complete = False
+            for price in prices:
+                if best is None:
+                    best = price
+                    if max_slippage is not None:
+                        bound = best * (1 + max_slippage) if side == 'BUY' else best * (1 - max_slippage)
+                elif max_slippage is not None and (price > bound if side == 'BUY' else price < bound):
+                    break
+                take = levels[price]
+                count += 1
+                if quote is not None and filled_quote + take * price >= quote:
+                    take = (quote - filled_quote) / price
+                    complete = True
+                elif qty is not None and filled_qty + take >= qty:
+                    take = qty - filled_qty
+                    complete = True
+                filled_qty += take
+                filled_quote += take * price
+                if complete:
+                    break
+        if not filled_qty:
+            return None
+        price = filled_quote / filled_qty
+        slippage = price / best - 1 if side == 'BUY' else 1 - price / best
+        return {'price': price, 'qty': filled_qty, 'quote': filled_quote, 'best': best, 'slippage': slippage,
+                'levels': count, 'complete': complete}
+
+    def stats(self):
+        return {'bids': len(self.bids), 'asks': len(self.asks), 'synced': self.synced, 'updates': self.updates,
+                'dropped': self.dropped, 'resyncs': self.resyncs, 'snapshots': self.snapshots}
@@ -1,113 +1,223 @@
-from binance.client import Client
-from binance.exceptions import BinanceAPIException
+from getter import Get
+from lazy import api_error
+from metrics import METRICS
 from symbol import Symbol
+from user_stream import UserStream, FINAL_STATUSES
+from concurrent.futures import TimeoutError
 from decimal import *
+from typing import TYPE_CHECKING
+import uuid
+
+if TYPE_CHECKING:
+    from binance.client import Client
+
+BATCH_SIZE = 5      # orders per batchOrders request
+DUPLICATE_CODES = (-4015, -4116)    # the client order id is taken: an earlier attempt of the order got through
+
+
+# an order the exchange took, as opposed to the {'code', 'msg'} a batch answers a rejected order with
+def accepted(answer: dict):
+    return bool(answer) and 'orderId' in answer
 
 
 class BaseOrderController:
-    def __init__(self, client: Client, symbol: Symbol):
+    def __init__(self, client: 'Client', symbol: Symbol, get: Get = None, user_stream: UserStream = None,
+                 fill_timeout: float = 10, max_slippage: Decimal = None):
         self.client = client
         self.symbol = symbol
+        self.get = get if get else Get(client)
+        self.scheduler = self.get.scheduler
+        self.user_stream = user_stream
+        self.fill_timeout = fill_timeout
+        self.sizing_age = None     # age in ms of the account figures the last order was sized with
+        self.max_slippage = max_slippage    # market orders are cut to what fills within it, given a local book
+        self.fill_estimate = None   # the local book walk the last market order was sized with
 
     def __get_price(self, trend='LONG'):
-        try:
-            order_book = self.client.futures_order_book(symbol=self.symbol.symbol, limit=5)
-        except:
-            return None
-
-        if trend == 'LONG':
-            price = Decimal(order_book['asks'][0][0])
-        else:
-            price = Decimal(order_book['bids'][0][0])
-        return price
+        return self.get.price(self.symbol, trend)
 
     def __define_quote_qty(self, percent: Decimal):
-        try:
-            account_info = self.client.futures_account_information()
-        except:
+        account = self.get.account()
+        if not account:
             return None
-        balance = Decimal(account_info['totalWalletBalance'])
-        maint_margin = Decimal(account_info['totalMaintMargin'])
-        total_margin = Decimal(account_info['totalMarginBalance'])
+        balance = account.balance
+        margin_ratio = account.margin_ratio()
+        self.sizing_age = account.ages[-1]
 
-        if maint_margin/total_margin < Decimal('0.6'):
+        if margin_ratio < Decimal('0.6'):
             qty = (balance * percent).quantize(Decimal('0.01'))
-        elif maint_margin/total_margin < Decimal('0.7'):
+        elif margin_ratio < Decimal('0.7'):
             qty = (balance * percent / 2).quantize(Decimal('0.01'))
-        elif maint_margin/total_margin < Decimal('0.8'):
+        elif margin_ratio < Decimal('0.8'):
             qty = (balance * percent / 4).quantize(Decimal('0.01'))
         else:
             qty = Decimal('0')
         return qty
 
-    def __buy_market(self, symbol: Symbol, percent: Decimal = None, qty: Decimal = None):
+    # quantity and the price it is expected to fill at
+    def __market_size(self, side: str, percent: Decimal):
+        quote_qty = self.__define_quote_qty(percent=percent)
+        if not quote_qty:
+            return None, None
+        book = self.get.order_book(self.symbol)
+        if book:    # sized at the average price the order would fill at, without a request
+            self.fill_estimate = book.fill(side, quote=quote_qty, max_slippage=self.max_slippage)
+            if not self.fill_estimate:
+                return None, None
+            price, quote_qty = self.fill_estimate['price'], self.fill_estimate['quote']
+        else:
+            price = self.__get_price('LONG' if side == 'BUY' else 'SHORT')
+            if not price:
+                return None, None
+        return self.symbol.quantity(price, quote_qty), price
+
+    # price and quantity are defined once, retries of the order itself are left to the scheduler
+    def __market_order(self, side: str, percent: Decimal = None, qty: Decimal = None, attempts=10):
         if not qty:
-            price = self.__get_price('LONG')
-            quote_qty = self.__define_quote_qty(percent=percent)
-            if not price or not quote_qty:
+            qty = self.__market_size(side, percent)[0]
+            if not qty:
                 return None
-            qty = symbol.quantity(price, quote_qty)
 
         try:
-            order = self.client.futures_create_order(symbol=symbol.symbol, side=self.client.SIDE_BUY, quantity=qty,
-                                                     type=self.client.ORDER_TYPE_MARKET)
+            order = self.__create_order(attempts, quantity=qty, type=self.client.ORDER_TYPE_MARKET,
+                                        side=self.client.SIDE_BUY if side == 'BUY' else self.client.SIDE_SELL)
         except:
             order = None
         return order
 
-    def __sell_market(self, symbol: Symbol, percent: Decimal = None, qty: Decimal = None):
-        if not qty:
-            price = self.__get_price('SHORT')
-            quote_qty = self.__define_quote_qty(percent=percent)
-            if not price or not quote_qty:
-                return None
-            qty = symbol.quantity(price, quote_qty)
+    # every order goes out with a client order id, single or batched. A failure that may have placed it is only
+    # retried after a lookup by that id found nothing, and an id refused as taken is read back as the order it names
+    def __create_order(self, attempts: int, **request):
+        request = self.__identify(dict(request, symbol=self.symbol.symbol))
+        try:
+            return self.scheduler.call('futures_create_order', attempts=attempts,
+                                       lookup=lambda: self.__lookup(request['newClientOrderId']), **request)
+        except Exception as error:
+            if not api_error(error):
+                raise
+            answer = self.__settle(request, {'code': int(error.code)})
+            if not accepted(answer):
+                raise
+            return answer
+
+    @staticmethod
+    def __identify(request: dict):
+        return dict(request, newClientOrderId=uuid.uuid4().hex)
+
+    # the answer to an identified order; a lost one or a duplicate is read back by the client order id
+    def __settle(self, request: dict, answer: dict):
+        if not answer or answer.get('code') in DUPLICATE_CODES:
+            return self.__placed(request['newClientOrderId']) or answer
+        return answer
 
+    # the order a client order id was placed as, None when the exchange has none; raises when it cannot tell
+    def __lookup(self, client_order_id: str):
         try:
-            order = self.client.futures_create_order(symbol=symbol.symbol, side=self.client.SIDE_SELL, quantity=qty,
-                                                     type=self.client.ORDER_TYPE_MARKET)
-        except:
-            order = None
-        return order
+            return self.scheduler.call('futures_get_order', symbol=self.symbol.symbol,
+                                       origClientOrderId=client_order_id)
+        except Exception as error:
+            if api_error(error) and int(error.code) == -2013:    # Order does not exist
+                return None
+            raise
+
+    def __filled(self, order_id: int):
+        order_info = self.get_order_info(order_id, filling_wait=True)
+        stream = self.user_stream
+        if not (stream and stream.live and stream.account):    # the stream updates balances in place
+            self.get.account_state.invalidate()
+        return order_info
 
+    @METRICS.timed('order_seconds', call='create_market_order')
     def create_market_order(self,  side: str, percent: Decimal = None, qty: Decimal = None, attempts=10):
-        order = None
         if not percent and not qty:
             return None
-        elif percent:
-            request = {'symbol': self.symbol, 'percent': percent}
-        else:
-            request = {'symbol': self.symbol, 'qty': qty}
-
-        for i in range(attempts):
-            if side == 'BUY':
-                order = self.__buy_market(**request)
-            else:
-                order = self.__sell_market(**request)
-            if order:
-                break
+        order = self.__market_order(side, percent, qty, attempts)
         if not order:
             return None
         else:
-            order_info = self.get_order_info(order['orderId'], filling_wait=True)
-            return order_info
+            return self.__filled(order['orderId'])
+
+    # batchOrders takes every value as a string
+    def __batch_order(self, request: dict):
+        order = {'symbol': self.symbol.symbol}
+        for key, value in request.items():
+            order[key] = ('true' if value else 'false') if isinstance(value, bool) else str(value)
+        return order
 
+    # up to BATCH_SIZE orders a request. The exchange takes each order on its own, so the answers line up with the
+    # requests: the order, the {'code', 'msg'} it was rejected with, or None when the request itself failed.
+    # The legs are identified and settled like single orders, a failed batch is only sent again when none of its
+    # orders got through
+    @METRICS.timed('order_seconds', call='place_orders')
+    def place_orders(self, requests: list, attempts=10):
+        answers = []
+        for start in range(0, len(requests), BATCH_SIZE):
+            batch = [self.__batch_order(self.__identify(request)) for request in requests[start:start + BATCH_SIZE]]
+            try:
+                answered = self.scheduler.call('futures_place_batch_order', attempts=attempts, batchOrders=batch,
+                                               lookup=lambda: self.__lookup_batch(batch))
+            except:
+                answered = [None] * len(batch)
+            answers += [self.__settle(order, answer) for order, answer in zip(batch, answered)]
+        for answer in answers:
+            if answer and not accepted(answer):
+                METRICS.count('order_rejections_total', code=answer.get('code'))
+        return answers
+
+    # the orders of a batch that got through, None when none did
+    def __lookup_batch(self, batch: list):
+        answers = [self.__lookup(order['newClientOrderId']) for order in batch]
+        return answers if any(answers) else None
+
+    # the order a client order id was placed as, None when the exchange has none or it cannot be read
+    def __placed(self, client_order_id: str):
+        try:
+            return self.__lookup(client_order_id)
+        except:
+            return None
+
+    # the entry and its stop loss in one request, so the position is protected from the moment it exists. The stop
+    # is priced off the expected fill, averaged into the trade when adding to it; a stop it replaces is cancelled once
+    # the entry filled, the new one when the entry was rejected or did not fill. Answers the fill and the stop
+    @METRICS.timed('order_seconds', call='create_protected_market_order')
+    def create_protected_market_order(self, side: str, percent: Decimal, sl_percent: Decimal,
+                                      order_type: str = 'STOP_MARKET', replace: int = None, attempts=10):
+        qty, price = self.__market_size(side, percent)
+        if not qty:
+            return None, None
+        if self.symbol.in_trade:
+            current_qty = self.symbol.trade_data.current_quantity
+            price = (self.symbol.trade_data.current_price * current_qty + price * qty) / (current_qty + qty)
+        entry = {'side': side, 'type': self.client.ORDER_TYPE_MARKET, 'quantity': qty}
+        stop = self.__stop_loss_request(side, self.symbol.sl_price(sl_percent, price, side), sl_percent, order_type)
+        entry, stop = self.place_orders([entry, stop], attempts)
+        stop = self.__order_info(stop) if accepted(stop) else None
+        order_info = self.__filled(entry['orderId']) if accepted(entry) else None
+        if not order_info or not order_info['qty']:
+            if stop:
+                self.cancel_order(stop['id'], attempts)
+            return order_info, None
+        if stop and replace:
+            self.cancel_order(replace, attempts)
+        return order_info, stop
+
+    @METRICS.timed('order_seconds', call='create_limit_order')
     def create_limit_order(self, price: Decimal, percent: Decimal, side: str, attempts=10):
-        order = None
         price = price.quantize(self.symbol.price_step, rounding=ROUND_UP)
         quote_qty = self.__define_quote_qty(percent)
+        if not quote_qty:
+            return None
         qty = self.symbol.quantity(price, quote_qty)
-        for i in range(attempts):
-            try:
-                order = self.client.futures_create_order(symbol=self.symbol.symbol, side=side, quantity=qty,
-                                                         type=self.client.ORDER_TYPE_LIMIT,
-                                                         price=price, timeInForce=self.client.TIME_IN_FORCE_GTC)
-            except:
-                pass
+        try:
+            order = self.__create_order(attempts, side=side, quantity=qty, type=self.client.ORDER_TYPE_LIMIT,
+                                        price=price, timeInForce=self.client.TIME_IN_FORCE_GTC)
+        except:
+            order = None
         if order:
             return self.get_order_info(order['orderId'])
         return None
 
+    @METRICS.timed('order_seconds', call='create_stop_loss_order')
     def create_stop_loss_order(self, price: Decimal = None, sl_percent: Decimal = None, attempts=10,
                                replace_old=False, order_type: str = 'STOP_MARKET'):
         if not price:
@@ -115,76 +225,91 @@ class BaseOrderController:
                 return None
             price = self.symbol.sl_price(sl_percent)
 
-        if self.symbol.trade_data.side == self.client.SIDE_SELL:
-            close_side = self.client.SIDE_BUY
-        else:
-            close_side = self.client.SIDE_SELL
-        order = None
+        request = self.__stop_loss_request(self.symbol.trade_data.side, price, sl_percent, order_type)
+        try:
+            order = self.__create_order(attempts, **request)
+        except:
+            order = None
+        if not order:
+            return None
+        if replace_old:     # the new stop is in place before the old one goes
+            canceled = self.cancel_order(self.symbol.trade_data.stop_loss, attempts)
+            if not canceled:
+                pass
+        return self.__order_info(order)     # the answer carries everything a read of the order would
 
-        # creating order request for different stop loss types: market and trailing
-        request = {'symbol': self.symbol.symbol, 'side': close_side, 'type': order_type, 'closePosition': True}
+    # creating order request for different stop loss types: market and trailing
+    def __stop_loss_request(self, side: str, price: Decimal, sl_percent: Decimal, order_type: str):
+        close_side = self.client.SIDE_BUY if side == self.client.SIDE_SELL else self.client.SIDE_SELL
+        request = {'side': close_side, 'type': order_type, 'closePosition': True}
         if order_type == 'STOP_MARKET':
             request['stopPrice'] = price
         if order_type == 'TRAILING_STOP_MARKET':
             request['callbackRate'] = sl_percent
+        return request
 
-        for i in range(attempts):
-            try:
-                order = self.client.futures_create_order(**request)
-                break
-            except:
-                pass
-        if not order:
-            return None
-        if replace_old:
-            canceled = self.cancel_order( self.symbol.trade_data.stop_loss, attempts)
-            if not canceled:
-                pass
-        return self.get_order_info(order['orderId'])
-
+    @METRICS.timed('order_seconds', call='cancel_order')
     def cancel_order(self, order_id: int, attempts=10):
-        canceled = None
-        for i in range(attempts):
-            try:
-                canceled = self.client.futures_cancel_order(symbol=self.symbol.symbol, orderId=order_id)
-                break
-            except:
-                pass
+        try:
+            canceled = self.scheduler.call('futures_cancel_order', attempts=attempts, symbol=self.symbol.symbol,
+                                           orderId=order_id)
+        except:
+            canceled = None
         return canceled
 
-    def get_order_info(self, order_id: int, filling_wait=False):
+    # fills are awaited on the user data stream while it is live, REST polling backs off up to max_poll_delay
+    @METRICS.timed('order_seconds', call='get_order_info')
+    def get_order_info(self, order_id: int, filling_wait=False, poll_delay: float = 0.1, max_poll_delay: float = 2):
+        stream = self.user_stream
+        if stream and filling_wait and stream.live:
+            try:
+                return stream.wait_fill(self.symbol.symbol, order_id).result(self.fill_timeout)
+            except TimeoutError:
+                METRICS.count('order_fill_timeouts_total')     # falls back to polling
+        elif stream and not filling_wait and stream.tracking(order_id):
+            return stream.orders[order_id]
+
         order = None
         if filling_wait:
-            waited = False
-            while not waited:
+            delay = poll_delay
+            while True:
                 try:
-                    order = self.client.futures_get_order(symbol=self.symbol.symbol, orderId=order_id)
-                    if order["status"] == 'FILLED':
-                        waited = True
-                except BinanceAPIException as error:
-                    if int(error.code) == -2013:    # Order does not exist
+                    order = self.scheduler.call('futures_get_order', attempts=1, symbol=self.symbol.symbol,
+                                                orderId=order_id)
+                    if order["status"] in FINAL_STATUSES:    # a cancelled or expired order never fills
                         break
-                except:
-                    pass
+                except Exception as error:
+                    if api_error(error) and int(error.code) == -2013:    # Order does not exist
+                        break
+                METRICS.count('order_fill_polls_total')
+                self.scheduler.sleep(delay)
+                delay = min(delay * 2, max_poll_delay)
         else:
             try:
-                order = self.client.futures_get_order(symbol=self.symbol.symbol, orderId=order_id)
+                order = self.scheduler.call('futures_get_order', symbol=self.symbol.symbol, orderId=order_id)
             except:
                 order = None
 
         if order:
-            order_info = {
-                'status': order['status'],
-                'qty': Decimal(order['executedQty']),
-                'price': Decimal(order['avgPrice']),
-                'id': int(order['orderId']),
-                'stop_price': Decimal(order['stopPrice']),
-                'side': order['side']
-            }
-            return order_info
+            return self.__order_info(order)
         else:
             return {}
 
+    def __order_info(self, order: dict):
+        order_info = {
+            'status': order['status'],
+            'qty': Decimal(order['executedQty']),
+            'price': Decimal(order['avgPrice']),
+            'id': int(order['orderId']),
+            'stop_price': Decimal(order['stopPrice']),
+            'side': order['side']
+        }
+        stream = self.user_stream
+        if stream:      # the stream keeps the order up to date from here on, the caller handles this answer
+            stream.update(dict(order_info, symbol=self.symbol.symbol, time=int(order.get('updateTime', 0))),
+                          notify=False)
+        return order_info
+
 
 class OrderController(BaseOrderController):
     def fix_position(self, parts: int):
@@ -0,0 +1,234 @@
+from lazy import api_error
+from metrics import METRICS
+
+from collections import deque
+import asyncio
+import heapq
+import itertools
+import random
+import threading
+import time
+
+WEIGHT_LIMIT = 2400     # binance futures request weight per minute and IP
+ORDER_LIMIT_10S = 300   # orders per 10 seconds and account
+ORDER_LIMIT_1M = 1200   # orders per minute and account
+
+PRIORITY_ORDER = 0      # order placement, stop losses and cancels go before everything else
+PRIORITY_ACCOUNT = 1
+PRIORITY_MARKET = 2
+
+# the order book is only read to price orders, so it goes ahead of candles and tickers
+PRIORITIES = {'futures_create_order': PRIORITY_ORDER, 'futures_cancel_order': PRIORITY_ORDER,
+              'futures_place_batch_order': PRIORITY_ORDER,
+              'futures_get_order': PRIORITY_ACCOUNT, 'futures_account_information': PRIORITY_ACCOUNT,
+              'futures_get_open_orders': PRIORITY_ACCOUNT, 'futures_position_information': PRIORITY_ACCOUNT,
+              'futures_order_book': PRIORITY_ACCOUNT}
+ORDER_METHODS = {'futures_create_order', 'futures_place_batch_order'}
+
+# errors that will not go away by asking again; -4015 and -4116 refuse a client order id that is taken already
+FATAL_CODES = {-1100, -1102, -1111, -1121, -2011, -2013, -2019, -2021, -2022, -4003, -4015, -4116, -4164}
+
+WEIGHTS = {'futures_exchange_info': 1, 'futures_account_information': 5, 'futures_get_order': 1,
+           'futures_cancel_order': 1, 'futures_create_order': 0, 'futures_place_batch_order': 5,
+           'futures_position_information': 5}
+
+
+def request_weight(method: str, **params):
+    if method == 'futures_klines':
+        limit = params.get('limit') or 500
+        if limit < 100:
+            return 1
+        if limit < 500:
+            return 2
+        if limit <= 1000:
+            return 5
+        return 10
+    if method == 'futures_order_book':
+        limit = params.get('limit') or 500
+        if limit <= 50:
+            return 2
+        if limit <= 100:
+            return 5
+        if limit <= 500:
+            return 10
+        return 20
+    if method == 'futures_symbol_ticker':
+        return 1 if params.get('symbol') else 2
+    if method in ('futures_ticker', 'futures_get_open_orders'):
+        return 1 if params.get('symbol') else 40
+    return WEIGHTS.get(method, 1)
+
+
+class WeightBudget:
+    def __init__(self, limit: int = WEIGHT_LIMIT, window: float = 60, clock=time.monotonic):
+        self.limit = limit
+        self.window = window
+        self.clock = clock
+        self.spent = deque()     # (time, weight)
+        self.used = 0
+        self.requests = 0
+        self.throttled = 0.0
+        self.lock = threading.Lock()
+
+    def __expire(self, now: float):
+        while self.spent and self.spent[0][0] <= now - self.window:
+            self.used -= self.spent.popleft()[1]
+
+    def delay(self, weight: int, now: float = None):
+        now = self.clock() if now is None else now
+        with self.lock:
+            self.__expire(now)
+            excess = self.used + weight - self.limit
+            if excess <= 0:
+                return 0.0
+            for spent_at, spent in self.spent:
+                excess -= spent
+                if excess <= 0:
+                    return spent_at + self.window - now
+            return self.window
+
+    def spend(self, weight: int, now: float = None):
+        now = self.clock() if now is None else now
+        with self.lock:
+            self.spent.append((now, weight))
+            self.used += weight
+            self.requests += 1
+
+    async def acquire(self, weight: int):
+        delay = self.delay(weight)
+        while delay > 0:
+            self.throttled += delay
+            await asyncio.sleep(delay)
+            delay = self.delay(weight)
+        self.spend(weight)
+
+    def stats(self):
+        return {'used_weight': self.used, 'limit': self.limit, 'requests': self.requests,
+                'throttled_seconds': self.throttled}
+
+
+class RequestScheduler:
+    def __init__(self, client, weight_limit: int = WEIGHT_LIMIT, order_limit_10s: int = ORDER_LIMIT_10S,
+                 order_limit_1m: int = ORDER_LIMIT_1M, attempts: int = 5, base_delay: float = 0.2,
+                 max_delay: float = 30, clock=time.monotonic, sleep=time.sleep, rng: random.Random = None):
+        self.client = client
+        self.weights = WeightBudget(weight_limit, 60, clock)
+        self.orders = [WeightBudget(order_limit_10s, 10, clock), WeightBudget(order_limit_1m, 60, clock)]
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.clock = clock
+        self.sleep = sleep
+        self.rng = rng if rng else random.Random()
+
+        self.condition = threading.Condition()
+        self.queue = []      # heap of (priority, sequence) tickets waiting for budget
+        self.sequence = itertools.count()
+        self.paused_until = 0.0     # set by 418/429 answers
+        self.max_queue_depth = 0
+        self.throttled = {PRIORITY_ORDER: 0.0, PRIORITY_ACCOUNT: 0.0, PRIORITY_MARKET: 0.0}
+        self.requests = {PRIORITY_ORDER: 0, PRIORITY_ACCOUNT: 0, PRIORITY_MARKET: 0}
+        self.retries = 0
+        self.failures = 0
+
+    def backoff(self, attempt: int):
+        cap = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return cap / 2 + self.rng.uniform(0, cap / 2)
+
+    def __delay(self, weight: int, orders: int):
+        now = self.clock()
+        delay = max(self.weights.delay(weight, now), self.paused_until - now)
+        if orders:
+            delay = max([delay] + [budget.delay(orders, now) for budget in self.orders])
+        return delay
+
+    # the wait before weight and orders fit in the budgets, both spent when there is none
+    def reserve(self, weight: int, orders: int):
+        delay = self.__delay(weight, orders)
+        if delay <= 0:
+            self.weights.spend(weight)
+            if orders:
+                for budget in self.orders:
+                    budget.spend(orders)
+        return delay
+
+    def __admit(self, method: str, priority: int, params: dict):
+        weight = request_weight(method, **params)
+        orders = 0
+        if method in ORDER_METHODS:     # every order of a batch counts against the order limits
+            orders = len(params.get('batchOrders') or [None])
+        with self.condition:
+            ticket = (priority, next(self.sequence))
+            heapq.heappush(self.queue, ticket)
+            self.max_queue_depth = max(self.max_queue_depth, len(self.queue))
+            while True:
+                if self.queue[0] != ticket:
+                    self.condition.wait()
+                    continue
+                delay = self.reserve(weight, orders)
+                if delay <= 0:
+                    break
+                self.throttled[priority] += delay
+                self.condition.release()     # the head of the queue sleeps, the others wait for it
+                try:
+                    self.sleep(delay)
+                finally:
+                    self.condition.acquire()
+            heapq.heappop(self.queue)
+            self.requests[priority] += 1
+            self.condition.notify_all()
+
+    # an order call that failed without an answer from the exchange may still have placed the order, so it is only
+    # sent again after lookup() found no trace of it; lookup answers the placed order or None and raises when it
+    # cannot tell. Without a lookup such a failure is not retried
+    def call(self, method: str, priority: int = None, attempts: int = None, lookup=None, **params):
+        priority = PRIORITIES.get(method, PRIORITY_MARKET) if priority is None else priority
+        attempts = self.attempts if attempts is None else attempts    # 0 retries until the call succeeds
+        attempt = 0
+        while True:
+            queued = time.perf_counter()
+            self.__admit(method, priority, params)
+            started = time.perf_counter()
+            METRICS.observe('rest_wait_seconds', started - queued, method=method)
+            try:
+                response = getattr(self.client, method)(**params)
+                METRICS.observe('rest_request_seconds', time.perf_counter() - started, method=method)
+                return response
+            except Exception as error:
+                METRICS.observe('rest_request_seconds', time.perf_counter() - started, method=method)
+                if api_error(error):
+                    METRICS.count('rest_errors_total', method=method, code=error.code)
+                    if error.code in FATAL_CODES:
+                        METRICS.count('rest_failures_total', method=method)
+                        raise
+                    if error.status_code in (418, 429):
+                        retry_after = getattr(error.response, 'headers', {}).get('Retry-After')
+                        pause = float(retry_after) if retry_after else self.backoff(attempt)
+                        self.paused_until = max(self.paused_until, self.clock() + pause)
+                else:
+                    METRICS.count('rest_errors_total', method=method, code=type(error).__name__)
+                if method in ORDER_METHODS and (not api_error(error) or error.status_code >= 500):
+                    placed = lookup() if lookup else None
+                    if placed:
+                        return placed
+                    if not lookup:
+                        METRICS.count('rest_failures_total', method=method)
+                        raise
+                last_error = error
+            attempt += 1
+            if attempts and attempt >= attempts:
+                self.failures += 1
+                METRICS.count('rest_failures_total', method=method)
+                raise last_error
+            self.retries += 1
+            METRICS.count('rest_retries_total', method=method)
+            self.sleep(self.backoff(attempt - 1))
+
+    def queue_depth(self):
+        return len(self.queue)
+
+    def stats(self):
+        return {'queue_depth': len(self.queue), 'max_queue_depth': self.max_queue_depth,
+                'used_weight': self.weights.used, 'orders_10s': self.orders[0].used,
+                'requests': dict(self.requests), 'throttled_seconds': dict(self.throttled),
+                'retries': self.retries, 'failures': self.failures}
@@ -0,0 +1,300 @@
+from getter import Get
+from indicators import Indicators
+from rate_limiter import RequestScheduler, ORDER_METHODS, WEIGHT_LIMIT
+from slingshot_bot import SlingShotBot
+
+from collections import deque
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import wait
+import os
+import threading
+import time
+import zlib
+
+
+# ticker -> shard by rendezvous hashing: a shard that goes away hands over only its own symbols, and takes the same
+# ones back when it returns
+def partition(tickers: list, shards: list):
+    assignment = {shard: [] for shard in shards}
+    if shards:
+        for ticker in tickers:
+            owner = max(shards, key=lambda shard: zlib.crc32(f'{ticker}|{shard}'.encode()))
+            assignment[owner].append(ticker)
+    return assignment
+
+
+class ShardChannel:     # a worker's end of its pipe; pushes that arrive while a request waits for its reply are queued
+    def __init__(self, connection):
+        self.connection = connection
+        self.lock = threading.Lock()
+        self.queue = deque()
+
+    def send(self, message: tuple):
+        with self.lock:
+            self.connection.send(message)
+
+    def request(self, message: tuple):
+        with self.lock:
+            self.connection.send(message)
+            while True:
+                answer = self.connection.recv()
+                if answer[0] == 'reply':
+                    return answer[1]
+                self.queue.append(answer)
+
+    # queued and arriving pushes, waiting up to timeout for the first one
+    def pushes(self, timeout: float = 0):
+        with self.lock:
+            while self.connection.poll(0 if self.queue else timeout):
+                self.queue.append(self.connection.recv())
+            pushes = list(self.queue)
+            self.queue.clear()
+        return pushes
+
+
+# a worker's scheduler: the weight and order budgets, the 418/429 pause and the account figures are the coordinator's,
+# so every shard together stays inside the limits of one IP and account
+class ShardScheduler(RequestScheduler):
+    def __init__(self, client, channel: ShardChannel, **kwargs):
+        super(ShardScheduler, self).__init__(client, **kwargs)
+        self.channel = channel
+
+    def reserve(self, weight: int, orders: int):
+        return self.channel.request(('reserve', weight, orders, self.paused_until))
+
+    def call(self, method: str, priority: int = None, attempts: int = None, lookup=None, **params):
+        if method == 'futures_account_information':     # one read per ttl for all shards
+            return self.channel.request(('account',))
+        response = super(ShardScheduler, self).call(method, priority, attempts, lookup, **params)
+        if method in ORDER_METHODS:     # our own orders change the margin figures
+            self.channel.send(('ordered',))
+        return response
+
+
+# one shard: its own client, candle cache and bot over the symbols it is assigned, cycling func1 and func2. The bot
+# lives as long as the process: a new assignment adds and removes symbols, and one in trade stays until it closes
+def _work(index: int, client_factory, connection, bot_params: dict, interval: float):
+    channel = ShardChannel(connection)
+    client = client_factory()
+    get = Get(client, scheduler=ShardScheduler(client, channel))
+    channel.send(('ready', index, os.getpid()))
+    bot = None
+    while True:
+        for message in channel.pushes(interval if bot and bot.symbols else 1):
+            if message[0] == 'stop':
+                return
+            if message[0] == 'assign':
+                tickers, trend = message[1], message[2]
+                if bot:
+                    channel.send(('holding', bot.assign(tickers)))
+                elif tickers:
+                    bot = SlingShotBot(client, get=get, main_trend=trend, tickers=tickers, **bot_params)
+            elif message[0] == 'trend' and bot:
+                bot.main_trend = message[1]
+                for signal in bot.signals.values():
+                    signal.main_trend = message[1]
+        if bot and bot.symbols:
+            started = time.perf_counter()
+            errors = 0
+            for cycle in (bot.func1, bot.func2):
+                try:
+                    cycle()
+                except:
+                    errors += 1
+            channel.send(('cycle', time.perf_counter() - started, len(bot.symbols), errors,
+                          [symbol.symbol for symbol in bot.registry.in_trade()]))
+
+
+class Shard:
+    def __init__(self, index: int, process: Process, connection, restarts: int = 0):
+        self.index = index
+        self.process = process
+        self.connection = connection
+        self.restarts = restarts
+        self.pid = None
+        self.ready = False
+        self.tickers = None     # the last assignment sent
+        self.holding = set()    # tickers in trade, which stay with this shard whatever the partition says
+        self.cycles = 0
+        self.errors = 0     # func1 and func2 calls that raised
+        self.symbol_cycles = 0
+        self.cycle_seconds = 0.0
+
+
+# splits the market over worker processes and keeps what they share: the main trend, the account figures and the
+# rate limit budgets, answered over one pipe per worker. A worker that dies has its symbols spread over the others
+# and is started again; once it is back the symbols return to it, except those another shard holds a trade in.
+# The trades of a dead worker move with its symbols through the journal, when bot_params has one
+class ShardCoordinator:
+    def __init__(self, client_factory, shards: int = None, bot_params: dict = None, interval: float = 0,
+                 main_trend: int = None, trend_ttl: float = 3600, weight_limit: int = WEIGHT_LIMIT,
+                 account_ttl: float = 30, max_restarts: int = 3):
+        self.client_factory = client_factory    # called in every process, the coordinator's own reads included
+        self.count = shards if shards else os.cpu_count()
+        self.bot_params = bot_params if bot_params else {}
+        self.interval = interval    # seconds a worker waits between cycles
+        self.main_trend = main_trend
+        self.fixed_trend = main_trend is not None
+        self.trend_ttl = trend_ttl
+        self.trend_updated = None
+        self.weight_limit = weight_limit
+        self.account_ttl = account_ttl
+        self.max_restarts = max_restarts
+        self.shards = {}    # index -> Shard
+        self.tickers = []
+        self.trend_symbol = None
+        self.get = None
+        self.thread = None
+        self.stopped = False
+        self.crashes = 0
+        self.rebalances = 0
+
+    def start(self):
+        client = self.client_factory()
+        self.get = Get(client, scheduler=RequestScheduler(client, weight_limit=self.weight_limit),
+                       account_ttl=self.account_ttl)
+        symbols = self.get.symbols()
+        self.tickers = [symbol.symbol for symbol in symbols]
+        self.trend_symbol = next((symbol for symbol in symbols if symbol.symbol == 'BTCUSDT'), None)
+        self.__update_trend()
+        for index in range(self.count):
+            self.__spawn(index)
+        self.stopped = False
+        self.thread = threading.Thread(target=self.__serve, daemon=True)
+        self.thread.start()
+        return self
+
+    def __spawn(self, index: int, restarts: int = 0):
+        connection, worker_connection = Pipe()
+        process = Process(target=_work, args=(index, self.client_factory, worker_connection, self.bot_params,
+                                              self.interval), daemon=True)
+        process.start()
+        worker_connection.close()
+        self.shards[index] = Shard(index, process, connection, restarts)
+
+    def __update_trend(self):
+        if self.fixed_trend or (self.trend_updated and time.monotonic() - self.trend_updated < self.trend_ttl):
+            return
+        if self.trend_symbol:
+            candles = self.get.candles(self.trend_symbol, '4h', to_df=True)
+            trend = -1 if Indicators().update(candles)['trend'] < 0 else 1
+            changed = trend != self.main_trend
+            self.main_trend = trend
+            if changed:
+                self.__broadcast(('trend', trend))
+        self.trend_updated = time.monotonic()
+
+    def __broadcast(self, message: tuple):
+        for shard in self.shards.values():
+            if shard.ready:
+                try:
+                    shard.connection.send(message)
+                except:
+                    pass
+
+    def __rebalance(self):
+        live = [shard for shard in self.shards.values() if shard.ready]
+        pinned = {ticker: shard.index for shard in live for ticker in shard.holding}
+        assignment = partition([ticker for ticker in self.tickers if ticker not in pinned],
+                               [shard.index for shard in live])
+        for ticker, index in pinned.items():
+            assignment[index].append(ticker)
+        for shard in live:
+            tickers = assignment[shard.index]
+            if tickers != shard.tickers:
+                shard.tickers = tickers
+                try:
+                    shard.connection.send(('assign', tickers, self.main_trend))
+                except:
+                    pass
+        self.rebalances += 1
+
+    def __account(self):
+        state = self.get.account()
+        if not state:
+            return None
+        return {'totalWalletBalance': str(state.balance), 'totalMaintMargin': str(state.maint_margin),
+                'totalMarginBalance': str(state.margin_balance)}
+
+    def __handle(self, shard: Shard, message: tuple):
+        kind = message[0]
+        if kind == 'reserve':
+            weight, orders, paused_until = message[1:]
+            scheduler = self.get.scheduler
+            with scheduler.condition:
+                scheduler.paused_until = max(scheduler.paused_until, paused_until)     # a 429 pauses every shard
+                delay = scheduler.reserve(weight, orders)
+            shard.connection.send(('reply', delay))
+        elif kind == 'account':
+            shard.connection.send(('reply', self.__account()))
+        elif kind == 'ordered':
+            self.get.account_state.invalidate()
+        elif kind == 'cycle':
+            shard.cycles += 1
+            shard.cycle_seconds += message[1]
+            shard.symbol_cycles += message[2]
+            shard.errors += message[3]
+            shard.holding = set(message[4])
+        elif kind == 'holding':     # kept out of an assignment for their trades, nobody else may trade them
+            shard.holding.update(message[1])
+            owners = self.assignment()
+            if any(owners.get(ticker, shard.index) != shard.index for ticker in message[1]):
+                self.__rebalance()
+        elif kind == 'ready':
+            shard.pid = message[2]
+            shard.ready = True
+            self.__rebalance()
+
+    def __crashed(self, shard: Shard):
+        self.crashes += 1
+        shard.ready = False
+        shard.connection.close()
+        del self.shards[shard.index]
+        self.__rebalance()
+        if shard.restarts < self.max_restarts:
+            self.__spawn(shard.index, shard.restarts + 1)
+
+    def __serve(self):
+        while not self.stopped:
+            shards = list(self.shards.values())
+            ready = wait([shard.connection for shard in shards] + [shard.process.sentinel for shard in shards], 1)
+            for shard in shards:
+                if shard.connection in ready:
+                    try:
+                        while shard.connection.poll():
+                            self.__handle(shard, shard.connection.recv())
+                    except (EOFError, OSError):
+                        pass    # the sentinel tells
+                if shard.process.sentinel in ready and not self.stopped:
+                    self.__crashed(shard)
+            self.__update_trend()
+
+    def stop(self, timeout: float = 5):
+        self.stopped = True
+        if self.thread:
+            self.thread.join()
+        for shard in self.shards.values():
+            try:
+                shard.connection.send(('stop',))
+            except:
+                pass
+        for shard in self.shards.values():
+            shard.process.join(timeout)
+            if shard.process.is_alive():
+                shard.process.terminate()
+            shard.connection.close()
+
+    # which shard owns a ticker now, for the live ones
+    def assignment(self):
+        return {ticker: shard.index for shard in self.shards.values() if shard.ready and shard.tickers
+                for ticker in shard.tickers}
+
+    def stats(self):
+        return {'shards': [{'index': shard.index, 'pid': shard.pid, 'ready': shard.ready,
+                            'symbols': len(shard.tickers) if shard.tickers else 0, 'cycles': shard.cycles,
+                            'symbol_cycles': shard.symbol_cycles, 'errors': shard.errors,
+                            'holding': len(shard.holding), 'restarts': shard.restarts,
+                            'mean_cycle_seconds': shard.cycle_seconds / shard.cycles if shard.cycles else 0.0}
+                           for shard in self.shards.values()],
+                'crashes': self.crashes, 'rebalances': self.rebalances, 'main_trend': self.main_trend,
+                'budget': self.get.scheduler.weights.stats() if self.get else None}
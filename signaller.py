@@ -1,24 +1,14 @@
-import pandas as pd
-from finta import TA
-from getter import Get
+import asyncio
+import numpy as np
+from getter import Get, INTERVALS
+from indicators import Indicators, matrix_values
+from metrics import METRICS
 from symbol import Symbol
 from decimal import *
+from typing import TYPE_CHECKING
 
-
-class TechAnalysis(TA):
-    def slingshot(self, ohlc: pd.DataFrame, fast_length: int = 38, slow_length: int = 62):
-        ema_slow = self.EMA(ohlc, slow_length, adjust=False)
-        ema_fast = self.__ewm(ohlc, fast_length, adjust=False)
-        trend = (ema_fast - ema_slow).dropna()
-        return trend
-
-    def stoch_rsi(self, ohlc: pd.DataFrame, length: int = 14):
-        smooth_k, smooth_d = 3, 3
-        rsi1 = self.RSI(ohlc, length, adjust=False)
-        stoch = self.STOCH(pd.DataFrame({'close': rsi1, 'high': rsi1, 'low': rsi1}), length)
-        k = self.SMA(pd.DataFrame(stoch, columns=['stoch']), smooth_k, column='stoch')
-        d = self.SMA(pd.DataFrame(k, columns=['k']), smooth_d, column='k')
-        return k, d
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 class BaseSignal:
@@ -30,42 +20,57 @@ class BaseSignal:
         self.required_volume = required_volume
         self.required_volatility = required_volatility
         self.extra_fix_signal_percent = extra_fix_signal_percent
-        self.TA = TechAnalysis()
 
-    def __open_signal(self, candles: pd.DataFrame):
+    @property
+    def TA(self):   # finta and the frame based analysis load on first use
+        from tech_analysis import TechAnalysis
+        return TechAnalysis()
+
+    def __open_signal(self, candles: 'pd.DataFrame'):
         return 'NEUTRAL'
 
-    def __close_signal(self, candles: pd.DataFrame):
+    def __close_signal(self, candles: 'pd.DataFrame'):
         return 'NEUTRAL'
 
-    def __fix_signal(self, candles: pd.DataFrame):
+    def __fix_signal(self, candles: 'pd.DataFrame'):
         return 'NEUTRAL'
 
 
 class Signal(BaseSignal):
-    def __stoch_signal(self, candles: pd.DataFrame):
-        k_line, d_line = self.TA.stoch_rsi(candles)
+    def __init__(self, symbol: Symbol, get: Get, trend, required_volume: Decimal, required_volatility: Decimal,
+                 extra_fix_signal_percent: Decimal, fast_length: int = 38, slow_length: int = 62,
+                 stoch_length: int = 14, upper: float = 80, lower: float = 20, memoize: bool = False):
+        super(Signal, self).__init__(symbol, get, trend, required_volume, required_volatility,
+                                     extra_fix_signal_percent)
+        self.indicators = Indicators(fast_length, slow_length, stoch_length)
+        self.upper = upper
+        self.lower = lower
+        self.memoize = memoize  # decide on the indicators of the last closed bar, computed once per bar
+        self.memo = {}      # interval -> (open time of the last closed bar, its indicator values)
+        self.entry_bar = None   # open time of the closed bar the entry was last decided on
+        self.computed = 0   # indicator evaluations
+        self.skipped = 0    # evaluations answered from the memo or not due
 
-        if d_line[d_line.size - 1] > k_line[k_line.size - 1] > 80:
+    def __stoch_signal(self, values: dict):
+        k_line, d_line = values['k'], values['d']
+
+        if d_line > k_line > self.upper:
             return 'SELL'
-        if d_line[d_line.size - 1] < k_line[k_line.size - 1] < 20:
+        if d_line < k_line < self.lower:
             return 'BUY'
-        if d_line[d_line.size - 1] < k_line[k_line.size - 1]:
+        if d_line < k_line:
             return 'CLOSE_BUY'
-        if d_line[d_line.size - 1] > k_line[k_line.size - 1]:
+        if d_line > k_line:
             return 'CLOSE_SELL'
         else:
             return 'NEUTRAL'
 
-    def __slingshot_signal(self, candles: pd.DataFrame):
-        trend = self.TA.slingshot(candles)
-        current_trend = trend.iloc[trend.size - 1]
-
-        if current_trend * self.main_trend > 0:
-            slow_ema = self.TA.EMA(candles, 62, adjust=False)
-            last_slow_ema = slow_ema.iloc[slow_ema.size - 2]
+    def __slingshot_signal(self, values: dict):
+        current_trend = values['trend']
 
-            last_close = candles['close'].iloc[candles['close'].size - 2]
+        if self.main_trend and current_trend * self.main_trend > 0:     # no entries while the trend is unknown
+            last_slow_ema = values['slow_ema']
+            last_close = values['last_close']
 
             if current_trend > 0:
                 if last_close < last_slow_ema:
@@ -75,9 +80,9 @@ class Signal(BaseSignal):
                     return 'SELL'
         return 'NEUTRAL'
 
-    def __open_signal(self, candles: pd.DataFrame):
-        signal1 = self.__stoch_signal(candles)
-        signal2 = self.__slingshot_signal(candles)
+    def __open_signal(self, values: dict):
+        signal1 = self.__stoch_signal(values)
+        signal2 = self.__slingshot_signal(values)
 
         if signal1 == 'BUY' and signal2 == 'BUY':
             return 'BUY'
@@ -86,38 +91,37 @@ class Signal(BaseSignal):
         else:
             return 'NEUTRAL'
 
-    def __fix_signal(self, candles: pd.DataFrame):
+    def __fix_signal(self, values: dict):
         if self.symbol.trade_data.fix_allowed():
-            signal = self.__stoch_signal(candles)
+            signal = self.__stoch_signal(values)
             if signal == 'BUY' and self.symbol.trade_data.close_side == 'BUY':
                 return 'BUY'
             elif signal == 'SELL' and self.symbol.trade_data.close_side == 'SELL':
                 return 'SELL'
         return 'NEUTRAL'
 
+    # side and price an extra fix fires at: above it when closing with a SELL, below it with a BUY
+    def extra_fix_trigger(self):
+        trade_data = self.symbol.trade_data
+        reference = trade_data.last_fix_price if trade_data.last_fix_price else trade_data.current_price
+        if trade_data.close_side == 'SELL':
+            return 'SELL', (1 + self.extra_fix_signal_percent) * reference
+        if trade_data.close_side == 'BUY':
+            return 'BUY', (1 - self.extra_fix_signal_percent) * reference
+        return 'NEUTRAL', None
+
     def __extra_fix_signal(self, price):    # valid even if symbol.trade_data.fix_allowed() == False
-        if self.symbol.trade_data.close_side == 'SELL':
-            if not self.symbol.trade_data.last_fix_price:
-                if price > (1 + self.extra_fix_signal_percent) * self.symbol.trade_data.current_price:
-                    return 'SELL'
-            else:
-                if price > (1 + self.extra_fix_signal_percent) * self.symbol.trade_data.last_fix_price:
-                    return 'SELL'
-        if self.symbol.trade_data.close_side == 'BUY':
-            if not self.symbol.trade_data.last_fix_price:
-                if price < (1 - self.extra_fix_signal_percent) * self.symbol.trade_data.current_price:
-                    return 'BUY'
-            else:
-                if price < (1 - self.extra_fix_signal_percent) * self.symbol.trade_data.last_fix_price:
-                    return 'BUY'
+        side, trigger = self.extra_fix_trigger()
+        if side == 'SELL' and price > trigger or side == 'BUY' and price < trigger:
+            return side
         return 'NEUTRAL'
 
-    def __close_signal(self, candles: pd.DataFrame):
-        signal = self.__stoch_signal(candles)
-        trend = self.TA.slingshot(candles)
-        if self.symbol.trade_data.close_side == 'SELL' and trend.iloc[trend.size - 1] < 0 and signal == 'CLOSE_SELL':
+    def __close_signal(self, values: dict):
+        signal = self.__stoch_signal(values)
+        trend = values['trend']
+        if self.symbol.trade_data.close_side == 'SELL' and trend < 0 and signal == 'CLOSE_SELL':
             return 'SELL'
-        elif self.symbol.trade_data.close_side == 'BUY' and trend.iloc[trend.size - 1] > 0 and signal == 'CLOSE_BUY':
+        elif self.symbol.trade_data.close_side == 'BUY' and trend > 0 and signal == 'CLOSE_BUY':
             return 'BUY'
         return 'NEUTRAL'
 
@@ -133,27 +137,126 @@ class Signal(BaseSignal):
     # def get_trend(self):
     #     return self.main_trend
 
+    def entry_signal(self, values: dict) -> str:
+        price = Decimal(str(values['close']))
+        if self.symbol.trade_or_addon_allowed(price):
+            side = 'BUY' if self.main_trend == 1 else 'SELL'
+            if self.__stoch_signal(values) == side and self.__slingshot_signal(values) == side:
+                return side
+        return 'NEUTRAL'
+
+    def market_allowed(self, volume: Decimal, volatility: Decimal) -> bool:
+        return volume > self.required_volume and abs(volatility) > self.required_volatility
+
+    # the extra fix compares price, the close of the bar the values were computed on unless given
+    def exit_signal(self, values: dict, price: Decimal = None) -> str:
+        if not self.symbol.in_trade:
+            return 'NEUTRAL'
+        close_signal = self.__close_signal(values)
+        if close_signal != 'NEUTRAL':
+            return 'CLOSE'
+        fix_signal = self.__fix_signal(values)
+        if fix_signal != 'NEUTRAL':
+            return 'FIX'
+        return self.__extra_fix_signal(price if price else Decimal(str(values['close'])))
+
+    def __signal(self, values: dict, create: bool, close: bool, price: Decimal = None) -> str:
+        if create:
+            # indicators go first: volume and volatility cost a request each
+            signal = self.entry_signal(values)
+            if signal != 'NEUTRAL' and self.market_allowed(self.get.volume(self.symbol),
+                                                            self.get.volatility(self.symbol)):
+                return signal
+        if close:
+            return self.exit_signal(values, price)
+        return 'NEUTRAL'
+
+    # memoized values carry the close of the bar's first evaluation; the live ticker, or the open bar when it has
+    # none, is what the extra fix has to compare
+    def live_price(self):
+        ticker = self.get.ticker(self.symbol)
+        if ticker:
+            return ticker['last_price']
+        candles = self.get.candles(self.symbol, '1h', limit=1)
+        return Decimal(str(candles[-1][4])) if candles else None
+
+    def closed_bar(self, interval: str = '1h'):
+        step = INTERVALS[interval]
+        return self.get.clock() // step * step - step
+
+    # with memoize an entry is decided once per closed bar, a call it is not due for counts as skipped
+    def entry_due(self):
+        if not self.memoize or self.entry_bar != self.closed_bar():
+            return True
+        self.skipped += 1
+        return False
+
+    # indicators of the last closed bar, from its first evaluation on; a history that does not reach the bar yet is
+    # evaluated again on the next call
+    def bar_values(self, interval: str = '1h'):
+        closed = self.closed_bar(interval)
+        memo = self.memo.get(interval)
+        if memo and memo[0] == closed:
+            self.skipped += 1
+            return memo[1]
+        candles = self.get.candles(self.symbol, interval, to_df=True)
+        values = self.indicators.update(candles)
+        self.computed += 1
+        if len(candles) > 1 and int(candles['open_time'].iloc[-2]) >= closed:
+            self.memo[interval] = (closed, values)     # replaces the previous bar's
+        return values
+
+    @METRICS.timed('signal_seconds', mode='sync')
     def slingshot_signal(self, create: bool, close: bool) -> str:
+        if self.memoize:
+            create = create and self.entry_due()
+            if not create and not close:
+                return 'NEUTRAL'
+            values = self.bar_values()
+            closed = self.closed_bar()
+            if create and self.memo.get('1h', (None,))[0] == closed:   # decided on the closed bar, not an older one
+                self.entry_bar = closed
+            price = self.live_price() if close and self.symbol.in_trade else None
+            return self.__signal(values, create, close, price)
         candles = self.get.candles(self.symbol, '1h', to_df=True)
-        closes = candles['close']
-        price = closes.iloc[closes.size - 1]
+        values = self.indicators.update(candles)
+        self.computed += 1
+        return self.__signal(values, create, close)
+
+    # closes is an aligned (symbols x bars) matrix whose rows follow signals and whose last column is the open bar;
+    # memoizing signals keep the row only when closed_open, the open time of the column before, is their closed bar
+    @staticmethod
+    @METRICS.timed('signal_seconds', mode='batch')
+    def batch_signals(signals: list, closes: np.ndarray, create: bool, close: bool,
+                      closed_open: int = None) -> np.ndarray:
+        indicators = signals[0].indicators if signals else Indicators()
+        values = matrix_values(closes, indicators.fast_length, indicators.slow_length, indicators.stoch_length)
+        result = []
+        for i, signal in enumerate(signals):
+            row = {name: float(column[i]) for name, column in values.items()}
+            signal.computed += 1
+            if signal.memoize and closed_open is not None and closed_open == signal.closed_bar():
+                signal.memo['1h'] = (closed_open, row)
+                if create:
+                    signal.entry_bar = closed_open
+            result.append(signal.__signal(row, create, close))
+        return np.array(result)
+
+
+class AsyncSignal(Signal):     # same decisions, fed by an AsyncGet
+    @METRICS.timed('signal_seconds', mode='async')
+    async def slingshot_signal(self, create: bool, close: bool) -> str:
+        candles = await self.get.candles(self.symbol, '1h', to_df=True)
+        if candles.empty:
+            return 'NEUTRAL'
+        values = self.indicators.update(candles)
         if create:
-            if self.symbol.trade_or_addon_allowed(price):
-                if self.get.volume(self.symbol) > self.required_volume and abs(self.get.volatility(self.symbol)) > self.required_volatility:
-                    if self.main_trend == 1:
-                        if self.__stoch_signal(candles) == 'BUY' and self.__slingshot_signal(candles) == 'BUY':
-                            return 'BUY'
-                    else:
-                        if self.__stoch_signal(candles) == 'SELL' and self.__slingshot_signal(candles) == 'SELL':
-                            return 'SELL'
+            signal = self.entry_signal(values)
+            if signal != 'NEUTRAL':
+                volume, volatility = await asyncio.gather(self.get.volume(self.symbol),
+                                                          self.get.volatility(self.symbol))
+                if self.market_allowed(volume, volatility):
+                    return signal
         if close:
-            if self.symbol.in_trade:
-                close_signal = self.__close_signal(candles)
-                if close_signal != 'NEUTRAL':
-                    return 'CLOSE'
-                fix_signal = self.__fix_signal(candles)
-                if fix_signal != 'NEUTRAL':
-                    return 'FIX'
-                extra_fix_signal = self.__extra_fix_signal(price)
-                return extra_fix_signal
+            return self.exit_signal(values)
         return 'NEUTRAL'
@@ -1,129 +1,371 @@
-from getter import Get
-from signaller import Signal
+from getter import Get, AsyncGet, INTERVALS
+from journal import TradeJournal
+from metrics import METRICS
+from rate_limiter import WeightBudget
+from signaller import Signal, AsyncSignal
+from indicators import Indicators
 from order_controller import OrderController
-from symbol import Symbol
+from symbol import Symbol, SymbolRegistry
+from user_stream import UserStream
 
-from binance.client import Client
 from decimal import *
+from typing import TYPE_CHECKING
+import numpy as np
+import asyncio
+import threading
+import time
+
+if TYPE_CHECKING:
+    from binance import AsyncClient
+    from binance.client import Client
 
 
 class SlingShotBot:
-    def __init__(self, client: Client, order_percent: Decimal, sl_percent: Decimal, sl_type: str,
+    def __init__(self, client: 'Client', order_percent: Decimal, sl_percent: Decimal, sl_type: str,
                  main_trend: int = None, required_volume: Decimal = 80000000, required_volatility: Decimal = 0,
-                 required_fix_percent: Decimal = Decimal('0.08'), max_fix_times: int = 6):
-        self.get = Get(client)
-        self.order_controller = OrderController(client)
-        self.signal = Signal(self.get, main_trend, required_volume, required_volatility, required_fix_percent)
+                 required_fix_percent: Decimal = Decimal('0.08'), max_fix_times: int = 6, get: Get = None,
+                 user_stream: UserStream = None, signal_params: dict = None, journal: TradeJournal = None,
+                 max_slippage: Decimal = None, batch_orders: bool = False, tickers: list = None):
+        self.get = get if get else Get(client)
+        self.journal = journal
+        self.user_stream = user_stream
+        self.signal_params = signal_params if signal_params else {}    # lengths and stoch thresholds of Signal
         self.order_percent = order_percent
         self.sl_percent = sl_percent
         self.sl_type = sl_type
         self.symbols = self.get.symbols()
+        if tickers is not None:     # a shard of the market
+            tickers = set(tickers)
+            self.symbols = [symbol for symbol in self.symbols if symbol.symbol in tickers]
+        self.registry = SymbolRegistry(self.symbols)
         self.max_fix_times = max_fix_times
+        self.batch_orders = batch_orders    # entries go out together with their stop loss
 
-        if main_trend:
-            self.main_trend = main_trend
-        else:
-            self.main_trend = self.set_trend()
+        self.main_trend = main_trend    # read from the 4h BTCUSDT candles on the first entry scan when not given
+
+        self.client = client
+        self.required_volume = required_volume
+        self.required_volatility = required_volatility
+        self.required_fix_percent = required_fix_percent
+        self.max_slippage = max_slippage
+        self.signals = {}
+        self.order_controllers = {}
+        self.locks = {}     # stream pushes and the trading cycle change a symbol's trade one at a time
+        self.__track(self.symbols)
+        if user_stream:
+            user_stream.add_listener(self.on_order)
+        self.restored = self.restore_data() if journal else {}
+
+    def __track(self, symbols: list):
+        for symbol in symbols:
+            symbol.journal = self.journal
+            self.locks[symbol.symbol] = threading.RLock()
+            self.signals[symbol.symbol] = Signal(symbol, self.get, self.main_trend, self.required_volume,
+                                                 self.required_volatility, self.required_fix_percent,
+                                                 **self.signal_params)
+            self.order_controllers[symbol.symbol] = OrderController(self.client, symbol, self.get, self.user_stream,
+                                                                    max_slippage=self.max_slippage)
 
+    # a new share of the market for a shard: the symbols it keeps hold their state, a symbol in trade is kept until
+    # the trade ends, and added symbols take their trade from the journal; returns the tickers kept for their trades
+    def assign(self, tickers: list):
+        wanted = set(tickers)
+        held = {symbol.symbol for symbol in self.symbols}
+        kept = [symbol for symbol in self.symbols if symbol.symbol in wanted or symbol.in_trade]
+        added = [symbol for symbol in self.get.symbols() if symbol.symbol in wanted and symbol.symbol not in held]
+        keep = {symbol.symbol for symbol in kept}
+        for symbol in self.symbols:
+            if symbol.symbol not in keep:
+                del self.signals[symbol.symbol], self.order_controllers[symbol.symbol], self.locks[symbol.symbol]
+        if added and self.journal:
+            self.journal.restore(added)
+        self.__track(added)
+        self.symbols = kept + added
+        self.registry = SymbolRegistry(self.symbols)
+        return [symbol.symbol for symbol in kept if symbol.symbol not in wanted]
+
+    # trades from the journal, checked against every position and open order in two requests
     def restore_data(self):
-        pass
+        restored = self.journal.restore(self.symbols)
+        report = {'restored': len(restored), 'closed': [], 'stop_loss_replaced': [], 'quantity_mismatch': [],
+                  'unknown_positions': []}
+        try:
+            positions = self.get.scheduler.call('futures_position_information')
+            open_orders = self.get.scheduler.call('futures_get_open_orders')
+        except:
+            report['reconciled'] = False
+            return report
+        amounts = {position['symbol']: Decimal(position['positionAmt']) for position in positions}
+        order_ids = {int(order['orderId']) for order in open_orders}
+
+        for symbol in restored:
+            amount = amounts.get(symbol.symbol, Decimal(0))
+            if not amount:      # closed while the bot was down, by its stop loss or by hand
+                stop_loss = {}
+                if symbol.trade_data.stop_loss:
+                    stop_loss = self.order_controllers[symbol.symbol].get_order_info(symbol.trade_data.stop_loss)
+                if stop_loss.get('status') == 'FILLED':
+                    symbol.update_trade_data(order=stop_loss)
+                symbol.stop_trade()
+                report['closed'].append(symbol.symbol)
+                continue
+            if abs(amount) != symbol.trade_data.current_quantity:
+                report['quantity_mismatch'].append(symbol.symbol)
+            if symbol.trade_data.stop_loss not in order_ids:
+                self.place_stop_loss(symbol)
+                report['stop_loss_replaced'].append(symbol.symbol)
+
+        tickers = {symbol.symbol for symbol in restored}
+        report['unknown_positions'] = [ticker for ticker, amount in amounts.items() if amount and ticker not in tickers]
+        report['reconciled'] = True
+        return report
 
     def set_trend(self):
-        for symbol in self.symbols:
-            if symbol.symbol == 'BTCUSDT':
-                return self.signal.set_trend(symbol)
-
-    def new_position(self, symbol: Symbol):
-        signal = self.signal.slingshot_signal(symbol)
-        if signal:
-            order = self.order_controller.create_market_order(symbol, signal, self.order_percent)
-            if order:
-                if not symbol.in_trade:
-                    sl_order = self.order_controller.create_stop_loss_order(symbol, sl_percent=self.sl_percent,
-                                                                            order_type=self.sl_type)
-                    try:
-                        symbol.start_trade(signal, order['qty'], order['price'], sl_order['stopPrice'],
-                                           sl_order['id'], self.sl_type)
-                    except KeyError:
-                        symbol.start_trade(signal, order['qty'], order['price'], None, None, self.sl_type)
-                else:
-                    sl_update = symbol.update(signal, order['qty'], order['price'])
-                    if sl_update['stop_loss']:
-                        sl_order = self.order_controller.create_stop_loss_order(symbol,
-                                                                                price=sl_update['stop_loss'],
-                                                                                replace_old=True,
+        symbol = self.registry.get('BTCUSDT')
+        if symbol:
+            trend = Indicators().update(self.get.candles(symbol, '4h', to_df=True))['trend']
+            return -1 if trend < 0 else 1
+
+    def ensure_trend(self):
+        if self.main_trend is None:
+            self.main_trend = self.set_trend()
+            for signal in self.signals.values():
+                signal.main_trend = self.main_trend
+        return self.main_trend
+
+    def place_stop_loss(self, symbol: Symbol, replace_old=False):
+        sl_order = self.order_controllers[symbol.symbol].create_stop_loss_order(sl_percent=self.sl_percent,
+                                                                                replace_old=replace_old,
                                                                                 order_type=self.sl_type)
-                        symbol.update_stop_loss(sl_order['id'], sl_order['stop_price'])
+        if sl_order:
+            symbol.update_trade_data(new_sl={'order_id': sl_order['id'], 'price': sl_order['stop_price']})
+        return sl_order
+
+    def new_position(self, symbol: Symbol, signal: str = None):
+        if signal is None:
+            self.ensure_trend()
+            signal = self.signals[symbol.symbol].slingshot_signal(create=True, close=False)
+        if signal not in ('BUY', 'SELL'):
+            return
+        with self.locks[symbol.symbol]:
+            self.__new_position(symbol, signal)
+
+    def __new_position(self, symbol: Symbol, signal: str):
+        if self.batch_orders:
+            return self.__new_protected_position(symbol, signal)
+        order = self.order_controllers[symbol.symbol].create_market_order(signal, percent=self.order_percent)
+        if not order or not order['qty']:
+            return
+        if not symbol.in_trade:
+            symbol.start_trade(signal, order['qty'], order['price'], stop_loss_type=self.sl_type)
+            self.place_stop_loss(symbol)
+        else:
+            symbol.update_trade_data(order=order)
+            self.place_stop_loss(symbol, replace_old=True)
+
+    def __new_protected_position(self, symbol: Symbol, signal: str):
+        replace = symbol.trade_data.stop_loss if symbol.in_trade else None
+        order, sl_order = self.order_controllers[symbol.symbol].create_protected_market_order(
+            signal, self.order_percent, self.sl_percent, self.sl_type, replace)
+        if not order or not order['qty']:
+            return
+        if not symbol.in_trade:
+            symbol.start_trade(signal, order['qty'], order['price'], stop_loss_type=self.sl_type)
+        else:
+            symbol.update_trade_data(order=order)
+        if sl_order:
+            symbol.update_trade_data(new_sl={'order_id': sl_order['id'], 'price': sl_order['stop_price']})
+        else:   # the stop alone was rejected, it goes out on its own
+            self.place_stop_loss(symbol, replace_old=bool(replace))
+
+    def check_position(self, symbol: Symbol, signal: str = None):
+        with self.locks[symbol.symbol]:
+            if symbol.in_trade:
+                return self.__check_position(symbol, signal)
 
-    def check_position(self, symbol: Symbol):
+    def __check_position(self, symbol: Symbol, signal: str = None):
         result = self.check_stop_loss(symbol)
         if result:
             return result
-        signal = self.signal.slingshot_signal(symbol)
-        if signal == 'FIX':
-            result = self.fix_position(symbol)
-            if result:
-                return result
-        elif signal == 'CLOSE':
-            result = self.close_position(symbol)
-            if result:
-                return result
+        if signal is None:
+            signal = self.signals[symbol.symbol].slingshot_signal(create=False, close=True)
+        if signal == 'CLOSE':
+            return self.close_position(symbol)
+        elif signal != 'NEUTRAL':   # FIX or an extra fix returned as the close side
+            return self.fix_position(symbol)
+
+    # stop loss fills pushed by the user data stream; a symbol busy in the cycle picks the fill up from the book
+    def on_order(self, order: dict):
+        controller = self.order_controllers.get(order['symbol'])
+        if not controller or order['status'] != 'FILLED':
+            return
+        symbol = controller.symbol
+        lock = self.locks[symbol.symbol]
+        if not lock.acquire(blocking=False):
+            return
+        try:
+            if symbol.in_trade and symbol.trade_data.stop_loss == order['id']:
+                symbol.update_trade_data(order=order)
+                symbol.stop_trade()
+        finally:
+            lock.release()
 
     def check_stop_loss(self, symbol: Symbol):
         if not symbol.trade_data.stop_loss:  # in case failed to place stop loss earlier
-            sl_order = self.order_controller.create_stop_loss_order(symbol, sl_percent=self.sl_percent,
-                                                                    order_type=self.sl_type)
-            if sl_order:
-                symbol.update_stop_loss(sl_order['id'], sl_order['stop_price'])
-
-        if symbol.trade_data.stop_loss:
-            stop_loss = self.order_controller.get_order_info(symbol, symbol.trade_data.stop_loss)
-            try:
-                status = stop_loss['status']
-                if status == 'FILLED':
-                    qty = stop_loss['qty']
-                    side = stop_loss['side']
-                    price = stop_loss['price']
-                    result = symbol.update(side, qty, price)['result']  # should save it into statistics
-                    return result
-            except KeyError:
-                pass
+            self.place_stop_loss(symbol)
+
+        if symbol.trade_data.stop_loss:     # served from the user data stream book while it tracks the order
+            stop_loss = self.order_controllers[symbol.symbol].get_order_info(symbol.trade_data.stop_loss)
+            if stop_loss.get('status') == 'FILLED':
+                symbol.update_trade_data(order=stop_loss)
+                return symbol.stop_trade()
 
     def fix_position(self, symbol: Symbol):
-        fix = self.order_controller.fix_position(symbol, self.max_fix_times)
-        try:
-            update = symbol.update(fix['side'], fix['qty'], fix['price'])
-
-            if update['closed']:
-                result = update['result']
-                self.order_controller.cancel_order(symbol, symbol.trade_data.stop_loss)
-                symbol.close_position()
-                return result
-            elif update['stop_loss']:
-                sl_order = self.order_controller.create_stop_loss_order(symbol, price=update['stop_loss'],
-                                                                        replace_old=True,
-                                                                        order_type=self.sl_type)
-                symbol.update_stop_loss(sl_order['id'], sl_order['stopPrice'])
-        except KeyError:
-            pass
+        controller = self.order_controllers[symbol.symbol]
+        fix = controller.fix_position(self.max_fix_times)
+        if not fix:
+            return
+        symbol.update_trade_data(order=fix)
+        if symbol.trade_data.current_quantity == 0:
+            controller.cancel_order(symbol.trade_data.stop_loss)
+            return symbol.stop_trade()
 
     def close_position(self, symbol: Symbol):
-        close = self.order_controller.close_position(symbol)
-        try:
-            result = symbol.update(close['side'], close['qty'], close['price'])['result']
-            symbol.close_position()
-            return result
-        except KeyError:
-            pass
+        controller = self.order_controllers[symbol.symbol]
+        close = controller.close_position()
+        if not close:
+            return
+        symbol.update_trade_data(order=close)
+        controller.cancel_order(symbol.trade_data.stop_loss)
+        return symbol.stop_trade()
 
-    def func1(self):
+    # volume and volatility filter over one 24h ticker snapshot, before any candles are downloaded
+    def market_candidates(self, market: dict):
+        candidates = []
         for symbol in self.symbols:
+            ticker = market.get(symbol.symbol)
+            if not ticker or self.signals[symbol.symbol].market_allowed(ticker['quote_volume'],
+                                                                        ticker['price_change_percent']):
+                candidates.append(symbol)
+        return candidates
+
+    # symbols whose 1h history is complete and ends on the same bar go through Signal.batch_signals, with the open
+    # time of that last bar
+    def __aligned_closes(self, symbols: list, limit: int = 1000):
+        aligned, rows, rest = [], [], []
+        last_open = None
+        for symbol in symbols:
+            candles = self.get.candles(symbol, '1h', limit=limit, to_df=True)
+            if len(candles) < limit:
+                rest.append(symbol)
+                continue
+            open_time = int(candles['open_time'].iloc[-1])
+            if last_open is None or open_time > last_open:
+                rest.extend(aligned)
+                aligned, rows, last_open = [], [], open_time
+            if open_time < last_open:
+                rest.append(symbol)
+                continue
+            aligned.append(symbol)
+            rows.append(candles['close'].to_numpy())
+        return aligned, np.vstack(rows) if rows else np.empty((0, limit)), rest, last_open
+
+    # the aligned symbols share one batch evaluation, their own time is the order handling after it
+    @METRICS.timed('cycle_seconds', loop='entry')
+    def func1(self):
+        self.ensure_trend()
+        candidates = [symbol for symbol in self.market_candidates(self.get.market())
+                      if self.signals[symbol.symbol].entry_due()]    # memoized signals decide once per bar
+        aligned, closes, rest, last_open = self.__aligned_closes(candidates)
+        if aligned:
+            signals = Signal.batch_signals([self.signals[symbol.symbol] for symbol in aligned], closes,
+                                           create=True, close=False, closed_open=last_open - INTERVALS['1h'])
+            for symbol, signal in zip(aligned, signals):
+                started = time.perf_counter()
+                self.new_position(symbol, str(signal))
+                METRICS.observe('symbol_cycle_seconds', time.perf_counter() - started, symbol=symbol.symbol,
+                                phase='entry')
+        for symbol in rest:
+            started = time.perf_counter()
             self.new_position(symbol)
+            METRICS.observe('symbol_cycle_seconds', time.perf_counter() - started, symbol=symbol.symbol,
+                            phase='entry')
 
+    @METRICS.timed('cycle_seconds', loop='exit')
     def func2(self):
+        for symbol in self.registry.in_trade():
+            started = time.perf_counter()
+            result = self.check_position(symbol)
+            METRICS.observe('symbol_cycle_seconds', time.perf_counter() - started, symbol=symbol.symbol,
+                            phase='exit')
+
+
+class AsyncSlingShotBot(SlingShotBot):
+    def __init__(self, client: 'Client', async_client: 'AsyncClient', order_percent: Decimal, sl_percent: Decimal,
+                 sl_type: str, main_trend: int = None, required_volume: Decimal = 80000000,
+                 required_volatility: Decimal = 0, required_fix_percent: Decimal = Decimal('0.08'),
+                 max_fix_times: int = 6, get: Get = None, concurrency: int = 20, budget: WeightBudget = None,
+                 user_stream: UserStream = None, signal_params: dict = None, journal: TradeJournal = None,
+                 max_slippage: Decimal = None, batch_orders: bool = False):
+        super(AsyncSlingShotBot, self).__init__(client, order_percent, sl_percent, sl_type, main_trend,
+                                                required_volume, required_volatility, required_fix_percent,
+                                                max_fix_times, get, user_stream, signal_params, journal,
+                                                max_slippage, batch_orders)
+        budget = budget if budget else self.get.scheduler.weights     # one weight budget for sync and async reads
+        self.async_get = AsyncGet(async_client, budget, self.get.cache, self.get.clock, snapshot=self.get.snapshot)
+        self.concurrency = concurrency
+        self.async_signals = {}
         for symbol in self.symbols:
-            if symbol.in_trade:
-                result = self.check_position(symbol)
+            self.async_signals[symbol.symbol] = AsyncSignal(symbol, self.async_get, self.main_trend, required_volume,
+                                                            required_volatility, required_fix_percent,
+                                                            **self.signal_params)
+        self.last_cycle = {}
+
+    def ensure_trend(self):
+        trend = super(AsyncSlingShotBot, self).ensure_trend()
+        for signal in self.async_signals.values():
+            signal.main_trend = trend
+        return trend
+
+    # orders stay on the blocking OrderController and run in the default executor
+    async def __scan_symbol(self, symbol: Symbol, semaphore: asyncio.Semaphore, create: bool, close: bool):
+        async with semaphore:
+            started = time.perf_counter()
+            loop = asyncio.get_event_loop()
+            signal = self.async_signals[symbol.symbol]
+            if close and symbol.in_trade:
+                await loop.run_in_executor(None, self.check_position, symbol,
+                                           await signal.slingshot_signal(create=False, close=True))
+            if create:
+                entry = await signal.slingshot_signal(create=True, close=False)
+                if entry in ('BUY', 'SELL'):
+                    await loop.run_in_executor(None, self.new_position, symbol, entry)
+            latency = time.perf_counter() - started
+            METRICS.observe('symbol_cycle_seconds', latency, symbol=symbol.symbol, phase='scan')
+            return latency
 
+    @METRICS.timed('cycle_seconds', loop='scan')
+    async def scan(self, create: bool = True, close: bool = True):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        if create and self.main_trend is None:
+            await asyncio.get_event_loop().run_in_executor(None, self.ensure_trend)
+        candidates = set(self.market_candidates(await self.async_get.market())) if create else set()
+        if close:
+            candidates.update(self.registry.in_trade())
+        symbols = sorted(candidates, key=lambda symbol: symbol.index)
+        throttled = self.async_get.budget.throttled
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*[self.__scan_symbol(symbol, semaphore, create, close)
+                                           for symbol in symbols])
+        wall = time.perf_counter() - started
+        self.last_cycle = {'symbols': len(symbols), 'wall_seconds': wall,
+                           'p50_seconds': float(np.percentile(latencies, 50)) if latencies else 0.0,
+                           'p99_seconds': float(np.percentile(latencies, 99)) if latencies else 0.0,
+                           'throttled_seconds': self.async_get.budget.throttled - throttled}
+        return self.last_cycle
 
+    async def func1(self):
+        return await self.scan(create=True, close=False)
 
+    async def func2(self):
+        return await self.scan(create=False, close=True)
@@ -0,0 +1,242 @@
+from getter import Get, INTERVALS
+from order_book import OrderBook
+from rate_limiter import RequestScheduler
+from symbol import Symbol
+
+from decimal import *
+from typing import TYPE_CHECKING
+import asyncio
+import json
+import threading
+import websockets
+
+if TYPE_CHECKING:
+    from binance.client import Client
+
+
+class MarketStream:
+    def __init__(self, get: Get, symbols: list, interval: str = '1h', url: str = 'wss://fstream.binance.com',
+                 streams_per_connection: int = 200, reconnect_delay: float = 1, max_reconnect_delay: float = 60,
+                 depth: bool = False, depth_limit: int = 1000):
+        self.get = get
+        self.symbols = {symbol.symbol: symbol for symbol in symbols}
+        self.interval = interval
+        self.url = url
+        self.streams_per_connection = streams_per_connection
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.depth = depth      # keep a local order book of every symbol from the diff depth stream
+        self.depth_limit = depth_limit     # levels of the snapshots the books start from
+
+        self.tickers = {}   # symbol -> last miniTicker
+        self.books = {}     # symbol -> last bookTicker
+        self.order_books = {}   # symbol -> OrderBook
+        self.resyncing = set()  # symbols waiting for a snapshot
+        self.live = set()   # symbols whose connection is subscribed
+        self.stale = set(self.symbols)  # symbols whose klines have to be resynced over REST
+        self.messages = 0
+        self.reconnects = 0
+        self.gaps = 0
+
+        self.loop = None
+        self.thread = None
+        self.sockets = set()
+        self.stopped = False
+
+    def streams(self):
+        streams = []
+        for ticker in self.symbols:
+            ticker = ticker.lower()
+            streams += [f'{ticker}@kline_{self.interval}', f'{ticker}@miniTicker', f'{ticker}@bookTicker']
+            if self.depth:
+                streams.append(f'{ticker}@depth@100ms')
+        return streams
+
+    @staticmethod
+    def __stream_symbol(stream: str):
+        return stream.split('@')[0].upper()
+
+    def synced(self, symbol: str):
+        return symbol in self.live and symbol not in self.stale
+
+    def resynced(self, symbol: str):
+        self.stale.discard(symbol)
+
+    def handle(self, message: dict):
+        data = message.get('data')
+        if not data:     # subscription replies
+            return
+        self.messages += 1
+        event = data.get('e')
+        if event == 'kline':
+            self.__on_kline(data)
+        elif event == 'depthUpdate':
+            self.__on_depth(data)
+        elif event == '24hrMiniTicker':
+            self.tickers[data['s']] = {'last_price': Decimal(data['c']), 'open_price': Decimal(data['o']),
+                                       'quote_volume': Decimal(data['q']), 'time': int(data['E'])}
+        elif 'b' in data and 'a' in data:    # bookTicker payloads carry no 'e' on futures
+            self.books[data['s']] = {'bid': Decimal(data['b']), 'bid_qty': Decimal(data['B']),
+                                     'ask': Decimal(data['a']), 'ask_qty': Decimal(data['A']),
+                                     'time': int(data.get('E', 0))}
+
+    def __on_kline(self, data: dict):
+        symbol, k = data['s'], data['k']
+        if symbol in self.stale:
+            return
+        cached = self.get.cache.klines(symbol, k['i'])
+        if not cached:
+            self.stale.add(symbol)
+            return
+        if int(k['t']) - int(cached[-1][0]) > INTERVALS[k['i']]:    # missed at least one bar
+            self.gaps += 1
+            self.stale.add(symbol)
+            return
+        kline = [int(k['t']), k['o'], k['h'], k['l'], k['c'], k['v'], int(k['T']), k['q'], int(k['n']), k['V'],
+                 k['Q'], '0']
+        self.get.cache.update(symbol, k['i'], [kline])
+
+    def __on_depth(self, data: dict):
+        book = self.order_books.get(data['s'])
+        if book is None:
+            book = self.order_books[data['s']] = OrderBook(data['s'])
+        if not book.apply(data):
+            self.__resync(book)
+
+    # snapshots go through the scheduler off the stream loop, the book buffers the events that arrive meanwhile
+    def __resync(self, book: OrderBook):
+        if book.symbol in self.resyncing:
+            return
+        self.resyncing.add(book.symbol)
+        if self.loop and self.loop.is_running():
+            self.loop.run_in_executor(None, self.__load, book)
+        else:
+            self.__load(book)
+
+    def __load(self, book: OrderBook):
+        try:
+            snapshot = self.get.scheduler.call('futures_order_book', symbol=book.symbol, limit=self.depth_limit)
+        except:
+            return
+        finally:
+            self.resyncing.discard(book.symbol)
+        book.load(snapshot)     # when the buffered events do not connect, the next event asks again
+
+    # a synced local book, for pricing orders without a request
+    def order_book(self, symbol: str):
+        book = self.order_books.get(symbol)
+        if book and book.synced and symbol in self.live:
+            return book
+
+    async def __connection(self, streams: list, request_id: int):
+        symbols = {self.__stream_symbol(stream) for stream in streams}
+        delay = self.reconnect_delay
+        while not self.stopped:
+            try:
+                async with websockets.connect(f'{self.url}/stream') as socket:
+                    self.sockets.add(socket)
+                    await socket.send(json.dumps({'method': 'SUBSCRIBE', 'params': streams, 'id': request_id}))
+                    self.live |= symbols
+                    delay = self.reconnect_delay
+                    async for message in socket:
+                        self.handle(json.loads(message))
+            except Exception:
+                pass
+            finally:
+                self.sockets = {socket for socket in self.sockets if not socket.closed}
+
+            # klines may have been missed while disconnected: readers go back to REST until the gap is filled
+            self.live -= symbols
+            self.stale |= symbols
+            for symbol in symbols:      # depth events were missed as well
+                if symbol in self.order_books:
+                    self.order_books[symbol].reset()
+            if self.stopped:
+                break
+            self.reconnects += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    async def run(self):
+        streams = self.streams()
+        chunks = [streams[i:i + self.streams_per_connection]
+                  for i in range(0, len(streams), self.streams_per_connection)]
+        await asyncio.gather(*[self.__connection(chunk, i + 1) for i, chunk in enumerate(chunks)])
+
+    def __run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.run())
+        self.loop.close()
+
+    def start(self):
+        self.stopped = False
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout: float = 5):
+        self.stopped = True
+        if self.loop and self.loop.is_running():
+            for socket in list(self.sockets):
+                asyncio.run_coroutine_threadsafe(socket.close(), self.loop)
+        if self.thread:
+            self.thread.join(timeout)
+
+    def stats(self):
+        return {'messages': self.messages, 'reconnects': self.reconnects, 'gaps': self.gaps,
+                'live': len(self.live), 'stale': len(self.stale),
+                'order_books': sum(1 for book in self.order_books.values() if book.synced),
+                'book_resyncs': sum(book.resyncs for book in self.order_books.values())}
+
+
+class StreamGet(Get):
+    def __init__(self, client: 'Client', cache_depth: int = 1000, clock=None, snapshot_ttl: float = 60,
+                 scheduler: RequestScheduler = None):
+        super(StreamGet, self).__init__(client, cache_depth, clock, snapshot_ttl, scheduler)
+        self.stream = None
+
+    def subscribe(self, symbols: list, interval: str = '1h', **kwargs):
+        self.stream = MarketStream(self, symbols, interval, **kwargs)
+        self.stream.start()
+        return self.stream
+
+    def candles(self, symbol: Symbol, interval: str, end_time=None, limit=1000, to_df=False):
+        stream = self.stream
+        if not stream or interval != stream.interval or end_time or limit > self.cache.depth:
+            return super(StreamGet, self).candles(symbol, interval, end_time, limit, to_df)
+
+        if not stream.synced(symbol.symbol):
+            klines = super(StreamGet, self).candles(symbol, interval, limit=limit)   # REST top-up fills the gap
+            if klines and symbol.symbol in stream.live:
+                stream.resynced(symbol.symbol)
+        else:
+            klines = self.cache.last(symbol.symbol, interval, max(limit, 10))
+        if to_df:
+            return self.candles_to_df(klines)
+        return klines
+
+    def volume(self, symbol: Symbol):
+        ticker = self.stream.tickers.get(symbol.symbol) if self.stream else None
+        if ticker and symbol.symbol in self.stream.live:
+            return ticker['quote_volume']
+        return super(StreamGet, self).volume(symbol)
+
+    def volatility(self, symbol: Symbol):
+        ticker = self.stream.tickers.get(symbol.symbol) if self.stream else None
+        if ticker and symbol.symbol in self.stream.live and ticker['open_price']:
+            return ((ticker['last_price'] / ticker['open_price'] - 1) * 100).quantize(Decimal('0.001'))
+        return super(StreamGet, self).volatility(symbol)
+
+    def order_book(self, symbol: Symbol):
+        return self.stream.order_book(symbol.symbol) if self.stream else None
+
+    def price(self, symbol: Symbol, trend='LONG'):
+        order_book = self.order_book(symbol)
+        if order_book:
+            price = order_book.best_ask() if trend == 'LONG' else order_book.best_bid()
+            if price:
+                return price
+        book = self.stream.books.get(symbol.symbol) if self.stream else None
+        if book and symbol.symbol in self.stream.live:
+            return book['ask'] if trend == 'LONG' else book['bid']
+        return super(StreamGet, self).price(symbol, trend)
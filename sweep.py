@@ -0,0 +1,146 @@
+from backtest import Backtest
+from getter import CANDLE_COLUMNS
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from decimal import *
+import numpy as np
+import pandas as pd
+import itertools
+import os
+import random
+
+SIGNAL_PARAMS = ('fast_length', 'slow_length', 'stoch_length', 'upper', 'lower')
+INT_PARAMS = ('fast_length', 'slow_length', 'stoch_length', 'max_fix_times')
+DECIMAL_PARAMS = ('sl_percent', 'required_fix_percent', 'order_percent', 'required_volume', 'required_volatility')
+
+
+# every combination of the listed values
+def grid(**values):
+    names = list(values)
+    return [dict(zip(names, combination)) for combination in itertools.product(*values.values())]
+
+
+# space maps a parameter to a (low, high) range or to a list of choices
+def random_samples(space: dict, count: int, seed: int = 0):
+    rng = random.Random(seed)
+    samples = []
+    for i in range(count):
+        samples.append({name: rng.choice(bounds) if isinstance(bounds, list) else rng.uniform(*bounds)
+                        for name, bounds in space.items()})
+    return [normalize(sample) for sample in samples]
+
+
+# one sample per stratum and parameter, strata shuffled independently
+def latin_hypercube(space: dict, count: int, seed: int = 0):
+    rng = random.Random(seed)
+    samples = [{} for i in range(count)]
+    for name, bounds in space.items():
+        strata = list(range(count))
+        rng.shuffle(strata)
+        for sample, stratum in zip(samples, strata):
+            position = (stratum + rng.random()) / count
+            if isinstance(bounds, list):
+                sample[name] = bounds[int(position * len(bounds))]
+            else:
+                sample[name] = bounds[0] + position * (bounds[1] - bounds[0])
+    return [normalize(sample) for sample in samples]
+
+
+def normalize(params: dict):
+    params = dict(params)
+    for name in INT_PARAMS:
+        if name in params:
+            params[name] = int(round(params[name]))
+    for name in DECIMAL_PARAMS:
+        if name in params and not isinstance(params[name], Decimal):
+            params[name] = Decimal(str(round(params[name], 6)))
+    return params
+
+
+# candles of every symbol in one shared block: the int64 CANDLE_COLUMNS and then the float64 ones, a column after
+# the other, so that every symbol's column is one contiguous run; symbols maps to row ranges
+class SharedCandles:
+    INTS = [column for column, dtype in CANDLE_COLUMNS if dtype == np.int64]
+    FLOATS = [column for column, dtype in CANDLE_COLUMNS if dtype == np.float64]
+    FIELDS = {'open_time': 0, 'open': 1, 'high': 2, 'low': 3, 'close': 4, 'volume': 5, 'close_time': 6,
+              'cash_volume': 7, 'trades': 8}    # kline positions
+
+    def __init__(self, history: dict = None, name: str = None, symbols: dict = None, rows: int = 0):
+        if history is not None:
+            symbols, rows = {}, 0
+            for symbol, klines in history.items():
+                symbols[symbol] = (rows, rows + len(klines))
+                rows += len(klines)
+            self.memory = shared_memory.SharedMemory(create=True, size=max(1, rows * len(CANDLE_COLUMNS) * 8))
+            self.owner = True
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.symbols = symbols
+        self.rows = rows
+        self.ints = np.ndarray((len(self.INTS), rows), dtype=np.int64, buffer=self.memory.buf)
+        self.floats = np.ndarray((len(self.FLOATS), rows), dtype=np.float64, buffer=self.memory.buf,
+                                 offset=len(self.INTS) * rows * 8)
+
+        if history is not None:
+            for symbol, klines in history.items():
+                start, stop = symbols[symbol]
+                raw = np.array([kline[:9] for kline in klines], dtype=object)
+                self.ints[:, start:stop] = raw[:, [self.FIELDS[column] for column in self.INTS]].T.astype(np.int64)
+                self.floats[:, start:stop] = raw[:, [self.FIELDS[column] for column in self.FLOATS]].T.astype(
+                    np.float64)
+
+    def handle(self):
+        return self.memory.name, self.symbols, self.rows
+
+    # CANDLE_COLUMNS frames over the shared columns, nothing is copied; they live as long as this object is open
+    def frames(self):
+        frames = {}
+        for symbol, (start, stop) in self.symbols.items():
+            columns = {column: self.ints[self.INTS.index(column), start:stop] if dtype == np.int64 else
+                       self.floats[self.FLOATS.index(column), start:stop] for column, dtype in CANDLE_COLUMNS}
+            frames[symbol] = pd.DataFrame(columns, copy=False)
+        return frames
+
+    def close(self):
+        del self.ints, self.floats
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+_worker = {}
+
+
+# the worker keeps the block attached, every replay reads the candles out of it
+def _attach(handle: tuple, settings: dict):
+    candles = SharedCandles(None, *handle)
+    _worker.update({'candles': candles, 'history': candles.frames(), 'settings': settings})
+
+
+def _replay(params: dict):
+    signal_params = {name: params[name] for name in SIGNAL_PARAMS if name in params}
+    settings = dict(_worker['settings'], **{name: value for name, value in params.items()
+                                            if name not in SIGNAL_PARAMS})
+    result = Backtest(_worker['history'], signal_params=signal_params, **settings).run()
+    return {'params': params, 'pnl': result['pnl'], 'max_drawdown': result['max_drawdown'],
+            'trades': len(result['trades']), 'fees': result['fees'], 'pid': os.getpid()}
+
+
+class Sweep:
+    def __init__(self, history: dict, workers: int = None, **settings):
+        self.history = history
+        self.workers = workers if workers else os.cpu_count()
+        self.settings = settings    # Backtest arguments shared by every replay
+
+    # replays every parameter set and ranks them by pnl, then by drawdown
+    def run(self, samples: list):
+        candles = SharedCandles(self.history)
+        try:
+            with ProcessPoolExecutor(self.workers, initializer=_attach,
+                                     initargs=(candles.handle(), self.settings)) as executor:
+                results = list(executor.map(_replay, samples))
+        finally:
+            candles.close()
+        return sorted(results, key=lambda result: (-result['pnl'], result['max_drawdown']))
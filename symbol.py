@@ -2,11 +2,22 @@ from decimal import *
 from datetime import datetime, timedelta
 
 
+FEE_RATE = Decimal('0.0004')     # binance fee for maker
+# quotients are rounded once in the direction of the step rounding that follows, so it sees the exact value
+CEILING = Context(rounding=ROUND_CEILING)
+FLOOR = Context(rounding=ROUND_FLOOR)
+
+
 class BaseTradeData:
+    __slots__ = ('clock', 'start_date', 'side', 'start_price', 'original_quantity', 'current_quantity', 'current_price',
+                 'stop_loss_price', 'stop_loss', 'stop_loss_type', 'take_profit_price', 'take_profit', 'result',
+                 'close_side')
+
     def __init__(self, side: str, orig_qty: Decimal, start_price: Decimal, stop_loss_order: int = None,
                  stop_loss_price: Decimal = None, stop_loss_type: str = None, take_profit_order: int = None,
-                 take_profit_price: Decimal = None):
-        self.start_date: datetime = datetime.now()
+                 take_profit_price: Decimal = None, clock=datetime.now):
+        self.clock = clock      # replaced by the simulated time in backtests
+        self.start_date: datetime = self.clock()
         self.side = side
         self.start_price = start_price
         self.original_quantity = orig_qty
@@ -16,7 +27,7 @@ class BaseTradeData:
         self.stop_loss_price = stop_loss_price
         self.stop_loss = stop_loss_order
         self.stop_loss_type = stop_loss_type
-        self.rake_profit_price = take_profit_price
+        self.take_profit_price = take_profit_price
         self.take_profit = take_profit_order
         self.result = Decimal(0)     # redefine depending on market/limit order and current commission fee
 
@@ -38,13 +49,13 @@ class BaseTradeData:
 
         return {'closed': self.current_quantity == Decimal(0)}
 
+    # the average entry rounds against the position to a whole price step
     def addon(self, qty: Decimal, price: Decimal, price_step: Decimal):
-        self.current_price = (self.current_price * self.current_quantity + price * qty) / (self.current_quantity + qty)
-
+        total = self.current_price * self.current_quantity + price * qty
         if self.side == 'BUY':
-            self.current_price = Decimal(self.current_price).quantize(price_step, rounding=ROUND_UP)
+            self.current_price = CEILING.divide(total, self.current_quantity + qty).quantize(price_step, ROUND_UP)
         else:
-            self.current_price = Decimal(self.current_price).quantize(price_step, rounding=ROUND_DOWN)
+            self.current_price = FLOOR.divide(total, self.current_quantity + qty).quantize(price_step, ROUND_DOWN)
 
         self.current_quantity += qty
         # add commission fee to result
@@ -62,34 +73,39 @@ class BaseTradeData:
 
 
 class TradeData(BaseTradeData):
+    __slots__ = ('addons', 'fixes', 'last_addon_time', 'last_fix_time', 'last_fix_price', 'stop_loss_percent')
+
     def __init__(self, side: str, orig_qty: Decimal, start_price: Decimal, stop_loss_price, stop_loss_order,
-                 stop_loss_type: str):
-        super(TradeData, self).__init__(side, orig_qty, start_price, stop_loss_price, stop_loss_order, stop_loss_type)
+                 stop_loss_type: str, clock=datetime.now):
+        super(TradeData, self).__init__(side, orig_qty, start_price, stop_loss_order, stop_loss_price, stop_loss_type,
+                                        clock=clock)
         self.addons = 1
         self.fixes = 0
         self.last_addon_time = self.start_date
         self.last_fix_time = None
         self.last_fix_price = None
 
-        self.stop_loss_percent = abs((self.stop_loss_price / self.start_price - 1).quantize(Decimal('0.01')))
-        self.result = - self.original_quantity * self.start_price * Decimal(0.0004)     # binance fee for maker
+        self.stop_loss_percent = None
+        if self.stop_loss_price:
+            self.stop_loss_percent = abs((self.stop_loss_price / self.start_price - 1).quantize(Decimal('0.01')))
+        self.result = - self.original_quantity * self.start_price * FEE_RATE
 
     def addon(self, qty: Decimal, price: Decimal, price_step: Decimal):
-        self.last_addon_time = datetime.now()
+        self.last_addon_time = self.clock()
         self.addons += 1
-        self.result -= qty * price * Decimal(0.0004)
+        self.result -= qty * price * FEE_RATE
         self.original_quantity = self.current_quantity + qty
         return super(TradeData, self).addon(qty, price, price_step)
 
     def fix(self, qty: Decimal, price: Decimal):
-        self.last_fix_time = datetime.now()
+        self.last_fix_time = self.clock()
         self.fixes += 1
         self.last_fix_price = price
-        self.result -= qty * price * Decimal(0.0004)
+        self.result -= qty * price * FEE_RATE
         return super(TradeData, self).fix(qty, price)
 
     def fix_allowed(self):
-        return self.last_addon_time < datetime.now() - timedelta(hours=3)
+        return self.last_addon_time < self.clock() - timedelta(hours=3)
 
     def addon_allowed(self, price: Decimal):
         if self.side == 'BUY':
@@ -111,27 +127,51 @@ class TradeData(BaseTradeData):
 
 
 class BaseSymbol:
+    __slots__ = ('symbol', 'price_step', 'lot_step', 'min_qty', 'clock', 'journal', 'index', 'registry',
+                 '__in_trade', 'trade_data')
+
     def __init__(self, symbol: str, price_step: Decimal, lot_step: Decimal, min_qty: Decimal):
         self.symbol = symbol
+        self.set_filters(price_step, lot_step, min_qty)
+        self.clock = datetime.now
+        self.journal = None     # TradeJournal that records every change of the trade, set by the bot
+        self.index = None       # position in the SymbolRegistry that keeps the symbol
+        self.registry = None
+
+        self.in_trade = False
+        self.trade_data = None
+
+    def set_filters(self, price_step: Decimal, lot_step: Decimal, min_qty: Decimal):
         self.price_step = price_step
         self.lot_step = lot_step
         self.min_qty = min_qty
 
-        self.in_trade = False
-        self.trade_data = None
+    @property
+    def in_trade(self):
+        return self.__in_trade
+
+    @in_trade.setter
+    def in_trade(self, value: bool):
+        self.__in_trade = value
+        if self.registry:
+            self.registry.mark(self, value)
 
     # override this method using TradeData(BaseTradeData) object
     def start_trade(self, side: str, orig_qty: Decimal, start_price: Decimal, stop_loss_price: Decimal = None,
                     stop_loss_order: int = None, stop_loss_type: str = None, take_profit_order: int = None,
                     take_profit_price: Decimal = None):
         self.in_trade = True
-        self.trade_data = BaseTradeData(side, orig_qty, start_price, stop_loss_price, stop_loss_order, stop_loss_type,
-                                        take_profit_order, take_profit_price)
+        self.trade_data = BaseTradeData(side, orig_qty, start_price, stop_loss_order, stop_loss_price, stop_loss_type,
+                                        take_profit_order, take_profit_price, self.clock)
+        if self.journal:
+            self.journal.record(self.symbol, 'start', self.trade_data)
 
     def stop_trade(self):
         result = self.trade_data.statistics()
         self.in_trade = False
         self.trade_data = None
+        if self.journal:
+            self.journal.record(self.symbol, 'stop', statistics=result)
         return result
 
     def update_trade_data(self, order: dict = None, new_sl: dict = None, new_tp: dict = None):
@@ -145,21 +185,29 @@ class BaseSymbol:
         if new_tp:
             self.trade_data.take_profit = new_tp['order_id']
             self.trade_data.take_profit_price = new_tp['price']
+        if self.journal:
+            kind = 'order' if order else 'stop_loss' if new_sl else 'take_profit'
+            self.journal.record(self.symbol, kind, self.trade_data)
 
 
 class Symbol(BaseSymbol):
+    __slots__ = ()
+
     def start_trade(self, side: str, orig_qty: Decimal, start_price: Decimal, stop_loss_price: Decimal = None,
                     stop_loss_order: int = None, stop_loss_type: str = None, take_profit_order: int = None,
                     take_profit_price: Decimal = None):
         self.in_trade = True
-        self.trade_data = TradeData(side, orig_qty, start_price, stop_loss_price, stop_loss_order, stop_loss_type)
+        self.trade_data = TradeData(side, orig_qty, start_price, stop_loss_price, stop_loss_order, stop_loss_type,
+                                    self.clock)
+        if self.journal:
+            self.journal.record(self.symbol, 'start', self.trade_data)
 
     def fix_qty(self, parts: int):
         if not self.in_trade:
             print(f'{self.symbol} is not in trade. Attempt to get fix quantity failed')
             return None
 
-        qty = Decimal(self.trade_data.original_quantity / parts).quantize(self.lot_step, rounding=ROUND_DOWN)
+        qty = FLOOR.divide(self.trade_data.original_quantity, parts).quantize(self.lot_step, rounding=ROUND_DOWN)
 
         if qty < self.min_qty:
             qty = self.min_qty
@@ -175,16 +223,20 @@ class Symbol(BaseSymbol):
         return self.trade_data.current_quantity
 
     def quantity(self, price: Decimal, quote_qty: Decimal):
-        qty = (quote_qty / price).quantize(self.lot_step, rounding=ROUND_DOWN)
+        price, quote_qty = Decimal(str(price)), Decimal(str(quote_qty))
+        qty = FLOOR.divide(quote_qty, price).quantize(self.lot_step, rounding=ROUND_DOWN)
         if qty < self.min_qty:
             qty = self.min_qty
         return qty
 
-    def sl_price(self, percent: Decimal):
-        if self.trade_data.side == 'SELL':
-            price = self.trade_data.current_price * Decimal(1 + percent)
+    # off the trade's average price, or off an expected one for a stop placed together with its entry
+    def sl_price(self, percent: Decimal, price: Decimal = None, side: str = None):
+        percent = Decimal(str(percent))
+        price = Decimal(str(price)) if price else self.trade_data.current_price
+        if (side if side else self.trade_data.side) == 'SELL':
+            price = price * (1 + percent)
         else:
-            price = self.trade_data.current_price * Decimal(1 - percent)
+            price = price * (1 - percent)
 
         return price.quantize(self.price_step)
 
@@ -193,3 +245,43 @@ class Symbol(BaseSymbol):
             return True
         else:
             return self.trade_data.addon_allowed(price)
+
+
+# symbols by index and ticker; indices of open trades are kept apart so position checks skip the rest of the market
+class SymbolRegistry:
+    def __init__(self, symbols: list = ()):
+        self.symbols = []
+        self.indices = {}   # ticker -> index
+        self.open = set()   # indices of symbols in trade
+        for symbol in symbols:
+            self.add(symbol)
+
+    def add(self, symbol: BaseSymbol):
+        symbol.index = len(self.symbols)
+        symbol.registry = self
+        self.symbols.append(symbol)
+        self.indices[symbol.symbol] = symbol.index
+        self.mark(symbol, symbol.in_trade)
+
+    def mark(self, symbol: BaseSymbol, in_trade: bool):
+        if in_trade:
+            self.open.add(symbol.index)
+        else:
+            self.open.discard(symbol.index)
+
+    def get(self, ticker: str):
+        index = self.indices.get(ticker)
+        return None if index is None else self.symbols[index]
+
+    # a copy in index order, stream pushes may close trades meanwhile
+    def in_trade(self):
+        return [self.symbols[index] for index in sorted(self.open.copy())]
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __iter__(self):
+        return iter(self.symbols)
+
+    def __contains__(self, ticker: str):
+        return ticker in self.indices
@@ -0,0 +1,27 @@
+import pandas as pd
+from finta import TA
+from metrics import METRICS
+
+
+class TechAnalysis(TA):
+    # finta wraps its classmethods so that they only work when called on the class itself and only accept
+    # frames holding every ohlc column
+    @staticmethod
+    def __frame(series: pd.Series):
+        return pd.DataFrame({'open': series, 'high': series, 'low': series, 'close': series})
+
+    @METRICS.timed('indicator_seconds', indicator='slingshot')
+    def slingshot(self, ohlc: pd.DataFrame, fast_length: int = 38, slow_length: int = 62):
+        ema_slow = TA.EMA(ohlc, slow_length, adjust=False)
+        ema_fast = TA.EMA(ohlc, fast_length, adjust=False)
+        trend = (ema_fast - ema_slow).dropna()
+        return trend
+
+    @METRICS.timed('indicator_seconds', indicator='stoch_rsi')
+    def stoch_rsi(self, ohlc: pd.DataFrame, length: int = 14):
+        smooth_k, smooth_d = 3, 3
+        rsi1 = TA.RSI(ohlc, length, adjust=False)
+        stoch = TA.STOCH(self.__frame(rsi1), length)
+        k = TA.SMA(self.__frame(stoch), smooth_k)
+        d = TA.SMA(self.__frame(k), smooth_d)
+        return k, d
@@ -0,0 +1,87 @@
+from fake_client import RecordedClient
+from getter import Get
+from indicators import EMA, RSI, StochRSI, Indicators, matrix_values
+from tech_analysis import TechAnalysis
+from finta import TA
+import numpy as np
+import os
+
+import pytest
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'market.json.gz')
+BARS = 1000
+TOLERANCE = 1e-6    # relative, against the larger of the value and 1
+
+client = RecordedClient(FIXTURE)
+
+
+def frame(ticker: str):
+    return Get.candles_to_df(client.futures_klines(symbol=ticker, interval='1h', limit=BARS))
+
+
+def assert_close(actual, expected):
+    actual, expected = np.asarray(actual, dtype=np.float64), np.asarray(expected, dtype=np.float64)
+    assert actual.shape == expected.shape
+    assert np.array_equal(np.isnan(actual), np.isnan(expected))
+    assert np.nanmax(np.abs(actual - expected) / np.maximum(np.abs(expected), 1), initial=0) < TOLERANCE
+
+
+def streamed(indicator, closes: np.ndarray):
+    return [indicator.update(close) for close in closes.tolist()]
+
+
+@pytest.mark.parametrize('ticker', client.tickers)
+@pytest.mark.parametrize('period', (38, 62))
+def test_ema(ticker, period):
+    candles = frame(ticker)
+    assert_close(streamed(EMA(period), candles['close'].to_numpy(dtype=np.float64)),
+                 TA.EMA(candles, period, adjust=False).to_numpy())
+
+
+@pytest.mark.parametrize('ticker', client.tickers)
+def test_rsi(ticker):
+    candles = frame(ticker)
+    assert_close(streamed(RSI(14), candles['close'].to_numpy(dtype=np.float64)),
+                 TA.RSI(candles, 14, adjust=False).to_numpy())
+
+
+@pytest.mark.parametrize('ticker', client.tickers)
+def test_stoch_rsi(ticker):
+    candles = frame(ticker)
+    k, d = zip(*streamed(StochRSI(14), candles['close'].to_numpy(dtype=np.float64)))
+    expected_k, expected_d = TechAnalysis().stoch_rsi(candles)
+    assert_close(k, expected_k.to_numpy())
+    assert_close(d, expected_d.to_numpy())
+
+
+# every bar evaluated as the open one on top of the closed ones before it, the way the bot reads candles
+@pytest.mark.parametrize('ticker', client.tickers)
+def test_streamed_values(ticker):
+    candles = frame(ticker)
+    ta = TechAnalysis()
+    k, d = (line.to_numpy() for line in ta.stoch_rsi(candles))
+    expected = {'trend': ta.slingshot(candles).to_numpy()[1:],
+                'slow_ema': TA.EMA(candles, 62, adjust=False).to_numpy()[:-1],
+                'last_close': candles['close'].to_numpy(dtype=np.float64)[:-1], 'k': k[1:], 'd': d[1:]}
+    indicators = Indicators()
+    actual = {name: [] for name in expected}
+    for i in range(2, len(candles) + 1):
+        values = indicators.update(candles.iloc[:i])
+        for name in actual:
+            actual[name].append(values[name])
+    for name in expected:
+        assert_close(actual[name], expected[name])
+
+
+def test_matrix_values():
+    frames = [frame(ticker) for ticker in client.tickers]
+    length = min(len(candles) for candles in frames)
+    frames = [candles.iloc[-length:].reset_index(drop=True) for candles in frames]
+    values = matrix_values(np.array([candles['close'].to_numpy(dtype=np.float64) for candles in frames]))
+    ta = TechAnalysis()
+    for i, candles in enumerate(frames):
+        k, d = ta.stoch_rsi(candles)
+        assert_close(values['trend'][i], ta.slingshot(candles).to_numpy()[-1])
+        assert_close(values['slow_ema'][i], TA.EMA(candles, 62, adjust=False).to_numpy()[-2])
+        assert_close(values['k'][i], k.to_numpy()[-1])
+        assert_close(values['d'][i], d.to_numpy()[-1])
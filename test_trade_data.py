@@ -0,0 +1,107 @@
+from symbol import Symbol
+from decimal import Decimal
+from fractions import Fraction
+import math
+import random
+
+import pytest
+
+
+# the trade accounting in exact rationals: averages round against the position to a whole step, fees are 0.0004
+class ExactTrade:
+    def __init__(self, side: str, qty: Decimal, price: Decimal, price_step: Decimal, lot_step: Decimal):
+        self.side, self.price_step, self.lot_step = side, Fraction(price_step), Fraction(lot_step)
+        self.original_quantity = self.current_quantity = Fraction(qty)
+        self.current_price = Fraction(price)
+        self.result = - self.current_quantity * self.current_price * Fraction(4, 10000)
+
+    def addon(self, qty: Decimal, price: Decimal):
+        qty, price = Fraction(qty), Fraction(price)
+        self.result -= qty * price * Fraction(4, 10000)
+        self.original_quantity = self.current_quantity + qty
+        steps = (self.current_price * self.current_quantity + price * qty) / (self.current_quantity + qty)
+        steps /= self.price_step
+        self.current_price = (math.ceil(steps) if self.side == 'BUY' else math.floor(steps)) * self.price_step
+        self.current_quantity += qty
+
+    def fix(self, qty: Decimal, price: Decimal):
+        qty, price = Fraction(qty), Fraction(price)
+        self.result -= qty * price * Fraction(4, 10000)
+        self.current_quantity -= qty
+        pnl = (price - self.current_price) * qty
+        self.result += pnl if self.side == 'BUY' else -pnl
+
+    def fix_qty(self, parts: int):
+        qty = max(math.floor(self.original_quantity / parts / self.lot_step) * self.lot_step, self.lot_step)
+        return self.current_quantity if self.current_quantity - qty < self.lot_step else qty
+
+    def sl_price(self, percent: Decimal):
+        factor = 1 + Fraction(percent) if self.side == 'SELL' else 1 - Fraction(percent)
+        return round(self.current_price * factor / self.price_step) * self.price_step
+
+    def quantity(self, price: Decimal, quote_qty: Decimal):
+        qty = math.floor(Fraction(quote_qty) / Fraction(price) / self.lot_step) * self.lot_step
+        return max(qty, self.lot_step)
+
+
+def random_price(rng: random.Random, ticks: int, price_step: Decimal):
+    extra = rng.choice((0, 0, 1, 3, 6, 9, 12))     # avgPrice comes back to full precision between ticks
+    return (Decimal(ticks + rng.randint(-ticks // 5, ticks // 5)) * price_step +
+            Decimal(rng.randint(0, 10 ** extra - 1)).scaleb(-extra) * price_step).normalize()
+
+
+def start(side: str, qty: Decimal, price: Decimal, price_step: Decimal, lot_step: Decimal):
+    symbol = Symbol('TESTUSDT', price_step, lot_step, lot_step)
+    symbol.start_trade(side, qty, price, stop_loss_type='STOP_MARKET')
+    return symbol, ExactTrade(side, qty, price, price_step, lot_step)
+
+
+def test_full_precision_fills():
+    symbol, exact = start('BUY', Decimal(1), Decimal('43210.123456789'), Decimal('0.1'), Decimal('0.001'))
+    symbol.update_trade_data(order={'side': 'SELL', 'qty': Decimal(1), 'price': Decimal('43300.987654321')})
+    exact.fix(Decimal(1), Decimal('43300.987654321'))
+    assert symbol.trade_data.result == Decimal('56.2597530875560')
+    assert Fraction(symbol.trade_data.result) == exact.result
+    assert symbol.trade_data.last_fix_price == Decimal('43300.987654321')
+
+
+def test_average_entry_rounds_against_the_position():
+    symbol, exact = start('SELL', Decimal(3), Decimal('100.05'), Decimal('0.1'), Decimal(1))
+    symbol.update_trade_data(order={'side': 'SELL', 'qty': Decimal(1), 'price': Decimal('100.000000001')})
+    exact.addon(Decimal(1), Decimal('100.000000001'))
+    assert symbol.trade_data.current_price == Decimal('100.0')
+    assert Fraction(symbol.trade_data.current_price) == exact.current_price
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_matches_exact_accounting(seed):
+    rng = random.Random(seed)
+    for case in range(50):
+        price_step = Decimal(1).scaleb(-rng.randint(0, 5))
+        lot_step = Decimal(1).scaleb(-rng.randint(0, 3))
+        ticks = rng.randint(10, 10 ** 7)
+        side = rng.choice(('BUY', 'SELL'))
+        symbol, exact = start(side, Decimal(rng.randint(1, 1000)) * lot_step, random_price(rng, ticks, price_step),
+                              price_step, lot_step)
+        for i in range(8):
+            addon, qty = rng.random() < 0.5, Decimal(rng.randint(1, 1000)) * lot_step
+            price = random_price(rng, ticks, price_step)
+            if addon:
+                exact.addon(qty, price)
+            else:
+                qty = min(qty, symbol.trade_data.current_quantity)
+                if not qty:
+                    continue
+                exact.fix(qty, price)
+            symbol.update_trade_data(order={'side': side if addon else symbol.trade_data.close_side, 'qty': qty,
+                                            'price': price})
+            trade = symbol.trade_data
+            percent, quote = Decimal(rng.randint(1, 500)).scaleb(-4), Decimal(rng.randint(1, 10 ** 6))
+            assert Fraction(trade.current_price) == exact.current_price
+            assert Fraction(trade.current_quantity) == exact.current_quantity
+            assert Fraction(trade.original_quantity) == exact.original_quantity
+            assert Fraction(trade.result) == exact.result
+            assert Fraction(symbol.sl_price(percent)) == exact.sl_price(percent)
+            assert Fraction(symbol.quantity(price, quote)) == exact.quantity(price, quote)
+            if exact.current_quantity:
+                assert Fraction(symbol.fix_qty(6)) == exact.fix_qty(6)
@@ -0,0 +1,179 @@
+from getter import AccountState
+from rate_limiter import RequestScheduler
+
+from concurrent.futures import Future
+from decimal import *
+import asyncio
+import json
+import threading
+import websockets
+
+FINAL_STATUSES = {'FILLED', 'CANCELED', 'EXPIRED', 'REJECTED'}
+
+
+class UserStream:
+    def __init__(self, scheduler: RequestScheduler, url: str = 'wss://fstream.binance.com', keepalive: float = 1800,
+                 reconnect_delay: float = 1, max_reconnect_delay: float = 60, account: AccountState = None):
+        self.scheduler = scheduler
+        self.account = account
+        self.url = url
+        self.keepalive = keepalive
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+
+        self.orders = {}      # order id -> last known order, in the BaseOrderController.get_order_info format
+        self.positions = {}   # symbol -> {'amount', 'entry_price'}
+        self.balances = {}    # asset -> {'wallet', 'cross_wallet'}
+        self.waiters = {}     # order id -> (symbol, [futures resolved once the order is final])
+        self.listeners = []   # called with every order update, from the stream thread
+        self.lock = threading.Lock()
+        self.live = False
+        self.events = 0
+        self.reconnects = 0
+        self.resyncs = 0
+
+        self.loop = None
+        self.thread = None
+        self.socket = None
+        self.stopped = False
+
+    @staticmethod
+    def parse_order(order: dict):
+        return {'status': order['X'], 'qty': Decimal(order['z']), 'price': Decimal(order['ap']), 'id': int(order['i']),
+                'stop_price': Decimal(order['sp']), 'side': order['S'], 'symbol': order['s'],
+                'time': int(order['T'])}
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def tracking(self, order_id: int):
+        return self.live and order_id in self.orders
+
+    def update(self, order: dict, notify: bool = True):
+        with self.lock:
+            known = self.orders.get(order['id'])
+            if known and known['status'] in FINAL_STATUSES and order['status'] not in FINAL_STATUSES:
+                return    # a late REST answer must not reopen an order the stream already closed
+            self.orders[order['id']] = order
+            futures = []
+            if order['status'] in FINAL_STATUSES and order['id'] in self.waiters:
+                futures = self.waiters.pop(order['id'])[1]
+        for future in futures:
+            if not future.done():
+                future.set_result(order)
+        if notify:
+            for callback in self.listeners:
+                callback(order)
+
+    def wait_fill(self, symbol: str, order_id: int):
+        future = Future()
+        with self.lock:
+            order = self.orders.get(order_id)
+            if order and order['status'] in FINAL_STATUSES:
+                future.set_result(order)
+            else:
+                self.waiters.setdefault(order_id, (symbol, []))[1].append(future)
+        return future
+
+    async def fill(self, symbol: str, order_id: int, timeout: float = None):
+        return await asyncio.wait_for(asyncio.wrap_future(self.wait_fill(symbol, order_id)), timeout)
+
+    def handle(self, message: dict):
+        event = message.get('e')
+        if event == 'ORDER_TRADE_UPDATE':
+            self.events += 1
+            self.update(self.parse_order(message['o']))
+        elif event == 'ACCOUNT_UPDATE':
+            self.events += 1
+            for balance in message['a'].get('B', []):
+                self.balances[balance['a']] = {'wallet': Decimal(balance['wb']),
+                                               'cross_wallet': Decimal(balance['cw'])}
+            for position in message['a'].get('P', []):
+                self.positions[position['s']] = {'amount': Decimal(position['pa']),
+                                                 'entry_price': Decimal(position['ep'])}
+            if self.account:
+                self.account.apply(self.balances)
+        elif event == 'listenKeyExpired':
+            return False
+        return True
+
+    # orders that may have changed while disconnected are read once over REST, balances on the next sizing
+    def resync(self):
+        if self.account:
+            self.account.invalidate()
+        with self.lock:
+            pending = {order_id: order['symbol'] for order_id, order in self.orders.items()
+                       if order['status'] not in FINAL_STATUSES}
+            pending.update({order_id: waiter[0] for order_id, waiter in self.waiters.items()})
+        for order_id, symbol in pending.items():
+            try:
+                order = self.scheduler.call('futures_get_order', symbol=symbol, orderId=order_id)
+            except:
+                continue
+            self.update({'status': order['status'], 'qty': Decimal(order['executedQty']),
+                         'price': Decimal(order['avgPrice']), 'id': int(order['orderId']),
+                         'stop_price': Decimal(order['stopPrice']), 'side': order['side'], 'symbol': symbol,
+                         'time': int(order.get('updateTime', 0))})
+        self.resyncs += 1
+
+    async def __keepalive(self, listen_key: str):
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(self.keepalive)
+            try:
+                await loop.run_in_executor(None, lambda: self.scheduler.call('futures_stream_keepalive',
+                                                                             listenKey=listen_key))
+            except:
+                pass
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        delay = self.reconnect_delay
+        while not self.stopped:
+            keepalive = None
+            try:
+                listen_key = await loop.run_in_executor(None, self.scheduler.call, 'futures_stream_get_listen_key')
+                async with websockets.connect(f'{self.url}/ws/{listen_key}') as socket:
+                    self.socket = socket
+                    delay = self.reconnect_delay
+                    keepalive = asyncio.ensure_future(self.__keepalive(listen_key))
+                    await loop.run_in_executor(None, self.resync)     # events meanwhile wait in the socket
+                    self.live = True
+                    async for message in socket:
+                        if not self.handle(json.loads(message)):
+                            break
+            except Exception:
+                pass
+            finally:
+                self.live = False
+                self.socket = None
+                if keepalive:
+                    keepalive.cancel()
+
+            if self.stopped:
+                break
+            self.reconnects += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    def __run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.run())
+        self.loop.close()
+
+    def start(self):
+        self.stopped = False
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout: float = 5):
+        self.stopped = True
+        if self.loop and self.loop.is_running() and self.socket:
+            asyncio.run_coroutine_threadsafe(self.socket.close(), self.loop)
+        if self.thread:
+            self.thread.join(timeout)
+
+    def stats(self):
+        return {'live': self.live, 'events': self.events, 'orders': len(self.orders), 'waiters': len(self.waiters),
+                'reconnects': self.reconnects, 'resyncs': self.resyncs}